@@ -1,4 +1,7 @@
-from typing import Optional
+import json
+import logging
+import re
+from typing import Any, AsyncIterator, Dict, List, Optional
 
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage, SystemMessage
@@ -8,12 +11,27 @@ from app.config import settings
 
 DEFAULT_MODEL = "gemini-2.5-flash"
 MAX_INPUT_CHARS = 8000  # guardrail to avoid huge payloads
+BATCH_MAX_OUTPUT_TOKENS = 2048
+
+SYSTEM_PROMPT = (
+    "You are an assistant that produces crisp, 2-4 sentence summaries of emails. "
+    "Keep key senders, intent, dates or action items when present. "
+    "Be concise and avoid fluff."
+)
+
+logger = logging.getLogger(__name__)
 
 
 class Summarizer:
     """Simple on-demand summarizer using Gemini via LangChain."""
 
-    def __init__(self, model_name: Optional[str] = None):
+    def __init__(self, model_name: Optional[str] = None, model: Optional[Any] = None):
+        # An injected chat model (anything with `ainvoke`) replaces Gemini, e.g. a local stub
+        if model is not None:
+            self.model = model
+            self.batch_model = model
+            return
+
         api_key = settings.GEMINI_API_KEY
         if not api_key:
             raise ValueError("GEMINI_API_KEY is not configured")
@@ -25,27 +43,109 @@ class Summarizer:
             google_api_key=api_key,
             timeout=20,
         )
+        self.batch_model = ChatGoogleGenerativeAI(
+            model=model_name or settings.GEMINI_MODEL or DEFAULT_MODEL,
+            temperature=0.3,
+            max_output_tokens=BATCH_MAX_OUTPUT_TOKENS,
+            google_api_key=api_key,
+            timeout=60,
+        )
 
-    async def summarize(self, text: str, context: Optional[str] = None) -> str:
-        """Return a short summary of the given text. Fails soft if input is empty."""
-        if not text:
-            return ""
-
+    def _build_messages(self, text: str, context: Optional[str] = None) -> List[Any]:
         trimmed = text[:MAX_INPUT_CHARS]
 
-        system_prompt = (
-            "You are an assistant that produces crisp, 2-4 sentence summaries of emails. "
-            "Keep key senders, intent, dates or action items when present. "
-            "Be concise and avoid fluff."
-        )
+        system_prompt = SYSTEM_PROMPT
         if context:
             system_prompt += f" Context: {context}"
 
-        messages = [
+        return [
             SystemMessage(content=system_prompt),
             HumanMessage(content=f"Summarize this email:\n\n{trimmed}"),
         ]
 
-        resp = await self.model.ainvoke(messages)
+    async def summarize(self, text: str, context: Optional[str] = None) -> str:
+        """Return a short summary of the given text. Fails soft if input is empty."""
+        if not text:
+            return ""
+
+        resp = await self.model.ainvoke(self._build_messages(text, context))
         return resp.content if hasattr(resp, "content") else str(resp)
 
+    async def stream(self, text: str, context: Optional[str] = None) -> AsyncIterator[str]:
+        """Yield the summary as the model produces it, chunk by chunk."""
+        if not text:
+            return
+
+        async for chunk in self.model.astream(self._build_messages(text, context)):
+            content = chunk.content if hasattr(chunk, "content") else str(chunk)
+            if content:
+                yield content
+
+    async def summarize_batch(self, items: Dict[str, str], fallback: bool = True) -> Dict[str, str]:
+        """
+        Summarize several short emails with a single LLM call.
+
+        Args:
+            items: Mapping of id to email text (callers should pack only short emails)
+            fallback: Summarize ids missing from a malformed response one by one
+
+        Returns:
+            Mapping of id to summary. Without fallback, ids the model did not return are omitted.
+        """
+        items = {item_id: text for item_id, text in items.items() if text}
+        if not items:
+            return {}
+        if len(items) == 1 and fallback:
+            item_id, text = next(iter(items.items()))
+            return {item_id: await self.summarize(text)}
+
+        payload = [{"id": item_id, "email": text[:MAX_INPUT_CHARS]} for item_id, text in items.items()]
+        messages = [
+            SystemMessage(content=(
+                SYSTEM_PROMPT
+                + " You will receive a JSON array of emails, each with an \"id\" and an \"email\". "
+                "Summarize every email independently. Respond with only a JSON array of objects "
+                "with keys \"id\" and \"summary\", one per input email, reusing the given ids."
+            )),
+            HumanMessage(content=json.dumps(payload, ensure_ascii=False)),
+        ]
+
+        summaries: Dict[str, str] = {}
+        try:
+            resp = await self.batch_model.ainvoke(messages)
+            content = resp.content if hasattr(resp, "content") else str(resp)
+            summaries = self._parse_batch_response(content, items)
+        except ValueError as e:
+            logger.warning(f"[SUMMARIZER] Malformed batch response for {len(items)} emails: {e}")
+
+        if fallback:
+            for item_id, text in items.items():
+                if item_id not in summaries:
+                    summaries[item_id] = await self.summarize(text)
+        return summaries
+
+    @staticmethod
+    def _parse_batch_response(content: Any, items: Dict[str, str]) -> Dict[str, str]:
+        """Extract {id: summary} from the model output, ignoring unknown ids and empty summaries."""
+        if isinstance(content, list):
+            # Some chat models return content parts instead of a plain string
+            content = "".join(part if isinstance(part, str) else part.get("text", "") for part in content)
+
+        text = re.sub(r"^```(?:json)?\s*|\s*```$", "", content.strip())
+        start, end = text.find("["), text.rfind("]")
+        if start == -1 or end <= start:
+            raise ValueError("no JSON array in response")
+        try:
+            parsed = json.loads(text[start:end + 1])
+        except json.JSONDecodeError as e:
+            raise ValueError(str(e)) from e
+
+        summaries: Dict[str, str] = {}
+        for entry in parsed:
+            if not isinstance(entry, dict):
+                continue
+            item_id = str(entry.get("id", ""))
+            summary = entry.get("summary")
+            if item_id in items and isinstance(summary, str) and summary.strip():
+                summaries[item_id] = summary.strip()
+        return summaries
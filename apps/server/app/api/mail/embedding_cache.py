@@ -0,0 +1,131 @@
+"""
+Content-hash embedding cache.
+
+Newsletters, notifications and mass mail produce the same embedding text for many
+messages and users. Vectors are stored in `embedding_cache` keyed by a hash of the
+whitespace-normalized text and the provider model name, so repeated texts are embedded
+once. Entries expire after EMBEDDING_CACHE_TTL_DAYS (TTL index).
+"""
+
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.asynchronous.database import AsyncDatabase
+
+from app.api.mail.semantic_embedding import embedding_model_name, encode_texts
+from app.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+_stats: Dict[str, int] = {"texts": 0, "cache_hits": 0, "batch_duplicates": 0, "embedded": 0}
+_last_job: Dict[str, Any] = {}
+
+
+def normalize_embedding_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def content_hash(text: str, model_name: Optional[str] = None) -> str:
+    model_name = model_name or embedding_model_name()
+    return hashlib.sha256(f"{model_name}|{normalize_embedding_text(text)}".encode("utf-8")).hexdigest()
+
+
+def hit_rate(stats: Dict[str, int]) -> float:
+    """Share of texts that did not need a provider call."""
+    texts = stats.get("texts", 0)
+    return round((texts - stats.get("embedded", 0)) / texts, 4) if texts else 0.0
+
+
+class EmbeddingCache:
+    """Embeds texts through the provider, reusing stored vectors for texts seen before."""
+
+    def __init__(self, db: AsyncDatabase):
+        self.db = db
+        self.cache_collection = db["embedding_cache"]
+
+    async def embed(self, texts: List[str], spec: Optional[str] = None) -> Tuple[List[List[float]], Dict[str, int]]:
+        """
+        Return embeddings for `texts` in order, from the serving provider or the one named by `spec`.
+
+        Returns:
+            (embeddings, stats) where stats counts texts, cache hits, in-batch duplicates
+            and texts actually sent to the provider
+        """
+        if not settings.EMBEDDING_CACHE_ENABLED:
+            embeddings = await encode_texts(texts, spec)
+            stats = {"texts": len(texts), "cache_hits": 0, "batch_duplicates": 0, "embedded": len(texts)}
+            self._record(stats)
+            return embeddings, stats
+
+        model_name = embedding_model_name(spec)
+        keys = [content_hash(text, model_name) for text in texts]
+        unique: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            unique.setdefault(key, text)
+
+        vectors: Dict[str, List[float]] = {}
+        try:
+            docs = await self.cache_collection.find(
+                {"_id": {"$in": list(unique)}, "expires_at": {"$gt": datetime.utcnow()}},
+                {"embedding": 1}
+            ).to_list(length=None)
+            vectors = {doc["_id"]: doc["embedding"] for doc in docs}
+        except Exception as e:
+            logger.warning(f"[EMBEDDING CACHE] Lookup failed, embedding everything: {e}")
+        cache_hits = len(vectors)
+
+        missing = [key for key in unique if key not in vectors]
+        if missing:
+            embeddings = await encode_texts([unique[key] for key in missing], spec)
+            vectors.update(zip(missing, embeddings))
+            await self._store(model_name, missing, embeddings)
+
+        stats = {
+            "texts": len(texts),
+            "cache_hits": cache_hits,
+            "batch_duplicates": len(texts) - len(unique),
+            "embedded": len(missing),
+        }
+        self._record(stats)
+        return [vectors[key] for key in keys], stats
+
+    async def _store(self, model_name: str, keys: List[str], embeddings: List[List[float]]) -> None:
+        now = datetime.utcnow()
+        expires_at = now + timedelta(days=settings.EMBEDDING_CACHE_TTL_DAYS)
+        operations = [
+            UpdateOne(
+                {"_id": key},
+                {"$set": {
+                    "model": model_name,
+                    "embedding": embedding,
+                    "created_at": now,
+                    "expires_at": expires_at
+                }},
+                upsert=True
+            )
+            for key, embedding in zip(keys, embeddings)
+        ]
+        try:
+            await self.cache_collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            logger.warning(f"[EMBEDDING CACHE] Failed to store {len(operations)} embeddings: {e}")
+
+    def _record(self, stats: Dict[str, int]) -> None:
+        for name, value in stats.items():
+            _stats[name] += value
+
+
+def record_embedding_job(stats: Dict[str, int]) -> None:
+    """Remember the cache counters of the latest embedding job run."""
+    _last_job.clear()
+    _last_job.update(stats)
+    _last_job["hit_rate"] = hit_rate(stats)
+    _last_job["finished_at"] = datetime.utcnow().isoformat()
+
+
+def embedding_cache_stats() -> Dict[str, Any]:
+    return {**_stats, "hit_rate": hit_rate(_stats), "last_job": dict(_last_job)}
@@ -0,0 +1,261 @@
+"""
+Embedding model migration.
+
+Moving to another embedding model (or provider) without wiping the serving collection:
+1. start: the target version gets its own collection (`<QDRANT_COLLECTION>__<model>`);
+   from then on new embeddings are written to both versions (dual-write)
+2. a background job re-embeds every stored email into the target collection in
+   throttled batches (EMBEDDING_MIGRATION_BATCH_SIZE, EMBEDDING_MIGRATION_PAUSE_SECONDS),
+   checkpointing an `_id` cursor so it resumes after restarts
+3. cutover: once the target is complete ("ready"), one atomic update of the state
+   document makes it the serving version; instances pick it up within
+   EMBEDDING_VERSION_REFRESH_SECONDS. The old collection is left in place for rollback.
+
+State is a single document in `embedding_migration`.
+"""
+
+import asyncio
+import logging
+import re
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.asynchronous.database import AsyncDatabase
+
+from app.api.mail.embedding_versions import (
+    EmbeddingVersion,
+    default_version,
+    serving_version,
+    set_active_versions,
+    target_version,
+)
+from app.api.mail.semantic_embedding import embedding_model_name
+from app.api.mail.vector_store import get_vector_store
+from app.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+STATE_ID = "state"
+ACTIVE_STATUSES = ("migrating", "ready")
+
+_loaded_at: Optional[float] = None
+
+
+async def load_embedding_versions(db: AsyncDatabase, force: bool = False) -> None:
+    """Refresh the cached serving/target versions from Mongo (at most every EMBEDDING_VERSION_REFRESH_SECONDS)."""
+    global _loaded_at
+    now = time.monotonic()
+    if not force and _loaded_at is not None and now - _loaded_at < settings.EMBEDDING_VERSION_REFRESH_SECONDS:
+        return
+    _loaded_at = now
+    try:
+        state = await db["embedding_migration"].find_one({"_id": STATE_ID})
+    except Exception as e:
+        logger.warning(f"[EMBEDDING MIGRATION] Could not load embedding versions, keeping cached ones: {e}")
+        return
+    state = state or {}
+    serving = EmbeddingVersion.from_dict(state.get("serving")) or default_version()
+    target = EmbeddingVersion.from_dict(state.get("target")) if state.get("status") in ACTIVE_STATUSES else None
+    if serving != serving_version() or target != target_version():
+        logger.info(f"[EMBEDDING MIGRATION] Serving {serving.provider} ({serving.collection}), target {target.provider if target else None}")
+    set_active_versions(serving, target)
+
+
+def target_collection_name(spec: str) -> str:
+    """Collection for a migration target: the base collection suffixed with the model name."""
+    slug = re.sub(r"[^a-z0-9]+", "-", embedding_model_name(spec).lower()).strip("-")
+    return f"{default_version().collection}__{slug}"
+
+
+class EmbeddingMigrator:
+    """Starts, runs, reports and cuts over embedding model migrations."""
+
+    def __init__(self, mail_service):
+        self.mail_service = mail_service
+        self.db = mail_service.db
+        self.state_collection = mail_service.db["embedding_migration"]
+        self.worker_id = uuid.uuid4().hex
+
+    async def start(self, provider: str) -> Dict[str, Any]:
+        """
+        Begin migrating to `provider` (EMBEDDING_PROVIDER syntax).
+
+        Raises:
+            ValueError: unknown provider, same as serving, or a migration already in progress
+        """
+        await load_embedding_versions(self.db, force=True)
+        state = await self.state_collection.find_one({"_id": STATE_ID}) or {}
+        if state.get("status") in ACTIVE_STATUSES:
+            raise ValueError(f"A migration to {state['target']['provider']} is already in progress")
+
+        serving = serving_version()
+        target = EmbeddingVersion(provider=provider, collection=target_collection_name(provider))
+        if target.provider == serving.provider or target.collection == serving.collection:
+            raise ValueError(f"{provider} is already the serving embedding model")
+
+        # Create the target collection up front so dual-writes never race its creation
+        await asyncio.to_thread(get_vector_store, target)
+        total = await self.mail_service.emails_collection.estimated_document_count()
+        await self.state_collection.update_one(
+            {"_id": STATE_ID},
+            {"$set": {
+                "status": "migrating",
+                "serving": serving.to_dict(),
+                "target": target.to_dict(),
+                "cursor": None,
+                "processed": 0,
+                "embedded": 0,
+                "total": total,
+                "started_at": datetime.utcnow(),
+                "finished_at": None,
+                "cutover_at": None,
+                "worker_id": None,
+                "heartbeat_at": None,
+                "error": None
+            }},
+            upsert=True
+        )
+        await load_embedding_versions(self.db, force=True)
+        logger.info(f"[EMBEDDING MIGRATION] Started {serving.provider} -> {provider} ({target.collection}), ~{total} emails")
+        return await self.status()
+
+    async def status(self) -> Dict[str, Any]:
+        state = await self.state_collection.find_one({"_id": STATE_ID}, {"_id": 0, "cursor": 0, "worker_id": 0})
+        if not state:
+            return {"status": "idle", "serving": serving_version().to_dict(), "target": None}
+        total = state.get("total") or 0
+        processed = state.get("processed", 0)
+        state["progress"] = round(min(processed / total, 1.0), 4) if total else 0.0
+        started_at = state.get("started_at")
+        if state.get("status") == "migrating" and started_at and processed:
+            elapsed = (datetime.utcnow() - started_at).total_seconds()
+            rate = processed / elapsed if elapsed > 0 else 0.0
+            state["emails_per_second"] = round(rate, 2)
+            state["eta_seconds"] = round(max(total - processed, 0) / rate) if rate else None
+        return state
+
+    async def cutover(self, force: bool = False) -> Dict[str, Any]:
+        """
+        Atomically make the target the serving version.
+        Without `force` the re-embed job must have finished; forcing serves a partial index.
+        """
+        state = await self.state_collection.find_one({"_id": STATE_ID}) or {}
+        statuses = list(ACTIVE_STATUSES) if force else ["ready"]
+        result = await self.state_collection.find_one_and_update(
+            {"_id": STATE_ID, "status": {"$in": statuses}, "target": state.get("target")},
+            {"$set": {
+                "status": "done",
+                "serving": state.get("target"),
+                "previous": state.get("serving"),
+                "target": None,
+                "cutover_at": datetime.utcnow()
+            }},
+            return_document=ReturnDocument.AFTER
+        )
+        if result is None:
+            raise ValueError("No migration is ready for cutover" if not force else "No migration in progress")
+        await load_embedding_versions(self.db, force=True)
+        logger.info(f"[EMBEDDING MIGRATION] Cut over to {result['serving']['provider']} ({result['serving']['collection']})")
+        return await self.status()
+
+    async def abort(self) -> Dict[str, Any]:
+        """Stop dual-writing and re-embedding; the serving version is unchanged."""
+        result = await self.state_collection.update_one(
+            {"_id": STATE_ID, "status": {"$in": list(ACTIVE_STATUSES)}},
+            {"$set": {"status": "aborted", "finished_at": datetime.utcnow()}}
+        )
+        if result.matched_count == 0:
+            raise ValueError("No migration in progress")
+        await load_embedding_versions(self.db, force=True)
+        logger.info("[EMBEDDING MIGRATION] Aborted")
+        return await self.status()
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=settings.EMBEDDING_MIGRATION_STALE_SECONDS)
+        return await self.state_collection.find_one_and_update(
+            {"_id": STATE_ID, "status": "migrating", "$or": [
+                {"worker_id": None},
+                {"worker_id": self.worker_id},
+                {"heartbeat_at": {"$lt": stale_before}},
+            ]},
+            {"$set": {"worker_id": self.worker_id, "heartbeat_at": now}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def run_job(self, state: Dict[str, Any]) -> None:
+        """Re-embed all emails into the target collection from the checkpointed cursor."""
+        target = EmbeddingVersion.from_dict(state.get("target"))
+        if target is None:
+            return
+        cursor = state.get("cursor")
+        processed = state.get("processed", 0)
+        embedded = state.get("embedded", 0)
+        vector_store = await asyncio.to_thread(get_vector_store, target)
+        batch_size = settings.EMBEDDING_MIGRATION_BATCH_SIZE
+        logger.info(f"[EMBEDDING MIGRATION] Re-embedding into {target.collection} from {processed} emails")
+
+        while True:
+            query: Dict[str, Any] = {} if cursor is None else {"_id": {"$gt": cursor}}
+            docs = await self.mail_service.emails_collection.find(query).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+            if not docs:
+                break
+
+            docs_by_user: Dict[str, List[Dict[str, Any]]] = {}
+            for doc in docs:
+                if doc.get("user_id"):
+                    docs_by_user.setdefault(doc["user_id"], []).append(doc)
+            for user_id, user_docs in docs_by_user.items():
+                items = self.mail_service._prepare_embedding_items(user_docs)
+                if not items:
+                    continue
+                embeddings, _ = await self.mail_service.embedding_cache.embed(
+                    [item.pop("text") for item in items], target.provider
+                )
+                for item, embedding in zip(items, embeddings):
+                    item["embedding"] = embedding
+                await asyncio.to_thread(vector_store.upsert, user_id, items)
+                embedded += len({item["message_id"] for item in items})
+
+            cursor = docs[-1]["_id"]
+            processed += len(docs)
+            # Checkpoint; stops when the migration was aborted or taken over
+            result = await self.state_collection.update_one(
+                {"_id": STATE_ID, "status": "migrating", "worker_id": self.worker_id},
+                {"$set": {"cursor": cursor, "processed": processed, "embedded": embedded, "heartbeat_at": datetime.utcnow()}}
+            )
+            if result.matched_count == 0:
+                logger.info("[EMBEDDING MIGRATION] Migration no longer owned by this worker, stopping")
+                return
+            # Throttle so live embedding and search keep most of the provider quota
+            await asyncio.sleep(settings.EMBEDDING_MIGRATION_PAUSE_SECONDS)
+
+        result = await self.state_collection.update_one(
+            {"_id": STATE_ID, "status": "migrating", "worker_id": self.worker_id},
+            {"$set": {"status": "ready", "processed": processed, "embedded": embedded, "finished_at": datetime.utcnow()}}
+        )
+        if result.matched_count == 0:
+            return
+        logger.info(f"[EMBEDDING MIGRATION] Re-embedded {embedded} of {processed} emails into {target.collection}; ready for cutover")
+        if settings.EMBEDDING_MIGRATION_AUTO_CUTOVER:
+            await self.cutover()
+
+    async def run_forever(self) -> None:
+        logger.info("[EMBEDDING MIGRATION] Migration loop started")
+        while True:
+            try:
+                await load_embedding_versions(self.db)
+                state = await self._claim()
+                if state:
+                    await self.run_job(state)
+            except Exception as e:
+                logger.error(f"[EMBEDDING MIGRATION] Job failed, will resume from the last checkpoint: {e}")
+                try:
+                    await self.state_collection.update_one({"_id": STATE_ID}, {"$set": {"error": str(e)[:500]}})
+                except Exception:
+                    pass
+            await asyncio.sleep(settings.EMBEDDING_MIGRATION_POLL_SECONDS)
@@ -0,0 +1,235 @@
+"""
+Embedding work queue (outbox).
+
+Sync enqueues one item per indexed message in `embedding_queue`; workers claim items
+in batches instead of scanning `email_index` for `is_embedded` flags, so each run costs
+in proportion to pending work. Items:
+- pending: waiting (or backing off until `available_at` after a failure)
+- processing: claimed under a `claim_id` until `lease_until`; an expired lease is claimable again
+- failed: gave up after EMBEDDING_QUEUE_MAX_ATTEMPTS
+Completed items are deleted. Users are served round-robin, longest-waiting first.
+"""
+
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List
+
+from pymongo import UpdateOne
+from pymongo.asynchronous.database import AsyncDatabase
+
+from app.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_STATE_ID = "embedding_queue_backfill"
+
+
+def queue_item_id(user_id: str, message_id: str) -> str:
+    return f"{user_id}:{message_id}"
+
+
+class EmbeddingQueue:
+    """Claimable queue of (user, message) embedding work items."""
+
+    def __init__(self, db: AsyncDatabase):
+        self.db = db
+        self.queue_collection = db["embedding_queue"]
+        self.state_collection = db["embedding_queue_state"]
+
+    async def enqueue(self, user_id: str, message_ids: Iterable[str]) -> int:
+        """Add (or re-arm) work items; re-enqueueing an item being processed makes it run again."""
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne(
+                {"_id": queue_item_id(user_id, message_id)},
+                {
+                    "$set": {
+                        "user_id": user_id,
+                        "message_id": message_id,
+                        "status": "pending",
+                        "available_at": now,
+                        "claim_id": None,
+                        "attempts": 0
+                    },
+                    "$setOnInsert": {"enqueued_at": now}
+                },
+                upsert=True
+            )
+            for message_id in message_ids if message_id
+        ]
+        if not operations:
+            return 0
+        await self.queue_collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    def _claimable_filter(self, now: datetime) -> Dict[str, Any]:
+        return {"$or": [
+            {"status": "pending", "available_at": {"$lte": now}},
+            {"status": "processing", "lease_until": {"$lt": now}},
+        ]}
+
+    async def claim(self, max_items: int) -> Dict[str, Any]:
+        """
+        Claim up to `max_items` items, split fairly across users with pending work.
+
+        Returns:
+            {"claim_id": str, "items": {user_id: [message_id, ...]}}
+        """
+        now = datetime.utcnow()
+        claim_id = uuid.uuid4().hex
+        claimable = self._claimable_filter(now)
+
+        cursor = await self.queue_collection.aggregate([
+            {"$match": claimable},
+            {"$group": {"_id": "$user_id", "oldest": {"$min": "$enqueued_at"}}},
+            {"$sort": {"oldest": 1}},
+            {"$limit": max(1, settings.EMBEDDING_QUEUE_MAX_USERS_PER_CLAIM)},
+        ])
+        users = [doc["_id"] for doc in await cursor.to_list(length=None)]
+        if not users:
+            return {"claim_id": claim_id, "items": {}}
+
+        # Equal share per user; leftovers go to the users who still have work
+        claimed: Dict[str, List[str]] = {}
+        remaining = max_items
+        active = list(users)
+        while remaining > 0 and active:
+            share = max(1, remaining // len(active))
+            still_active = []
+            for user_id in active:
+                if remaining <= 0:
+                    break
+                message_ids = await self._claim_for_user(user_id, min(share, remaining), claim_id, now)
+                if message_ids:
+                    claimed.setdefault(user_id, []).extend(message_ids)
+                    remaining -= len(message_ids)
+                if len(message_ids) == share:
+                    still_active.append(user_id)
+            active = still_active
+
+        total = sum(len(ids) for ids in claimed.values())
+        if total:
+            logger.info(f"[EMBEDDING QUEUE] Claimed {total} items for {len(claimed)} users (claim {claim_id})")
+        return {"claim_id": claim_id, "items": claimed}
+
+    async def _claim_for_user(self, user_id: str, limit: int, claim_id: str, now: datetime) -> List[str]:
+        candidates = await self.queue_collection.find(
+            {"user_id": user_id, **self._claimable_filter(now)},
+            {"_id": 1}
+        ).sort("enqueued_at", 1).limit(limit).to_list(length=limit)
+        if not candidates:
+            return []
+
+        # Conditional update: an item another worker claimed in between no longer matches
+        candidate_ids = [doc["_id"] for doc in candidates]
+        await self.queue_collection.update_many(
+            {"_id": {"$in": candidate_ids}, **self._claimable_filter(now)},
+            {"$set": {
+                "status": "processing",
+                "claim_id": claim_id,
+                "claimed_at": now,
+                "lease_until": now + timedelta(seconds=settings.EMBEDDING_QUEUE_LEASE_SECONDS)
+            }}
+        )
+        # Only this call's candidates: earlier rounds of the same claim already returned theirs
+        won = await self.queue_collection.find(
+            {"_id": {"$in": candidate_ids}, "claim_id": claim_id},
+            {"message_id": 1}
+        ).to_list(length=None)
+        return [doc["message_id"] for doc in won]
+
+    async def complete(self, claim_id: str, user_id: str, message_ids: List[str]) -> None:
+        """Remove finished items (unless they were re-enqueued while processing)."""
+        await self.queue_collection.delete_many({
+            "_id": {"$in": [queue_item_id(user_id, m_id) for m_id in message_ids]},
+            "claim_id": claim_id
+        })
+
+    async def release(self, claim_id: str, user_id: str, message_ids: List[str], error: str) -> None:
+        """Return failed items to the queue with exponential backoff, or mark them failed."""
+        now = datetime.utcnow()
+        item_ids = [queue_item_id(user_id, m_id) for m_id in message_ids]
+        items = await self.queue_collection.find(
+            {"_id": {"$in": item_ids}, "claim_id": claim_id},
+            {"attempts": 1}
+        ).to_list(length=None)
+        operations = []
+        for item in items:
+            attempts = item.get("attempts", 0) + 1
+            failed = attempts >= settings.EMBEDDING_QUEUE_MAX_ATTEMPTS
+            delay = settings.EMBEDDING_QUEUE_RETRY_SECONDS * (2 ** (attempts - 1))
+            operations.append(UpdateOne(
+                {"_id": item["_id"], "claim_id": claim_id},
+                {"$set": {
+                    "status": "failed" if failed else "pending",
+                    "attempts": attempts,
+                    "available_at": now + timedelta(seconds=delay),
+                    "claim_id": None,
+                    "last_error": error[:500]
+                }}
+            ))
+        if operations:
+            await self.queue_collection.bulk_write(operations, ordered=False)
+
+    async def backfill_once(self, email_index_collection) -> int:
+        """Enqueue messages indexed before the queue existed (runs once per database)."""
+        state = await self.state_collection.find_one({"_id": BACKFILL_STATE_ID})
+        if state and state.get("done"):
+            return 0
+
+        enqueued = 0
+        batch: Dict[str, List[str]] = {}
+        cursor = email_index_collection.find(
+            {"is_embedded": {"$ne": True}},
+            {"_id": 0, "user_id": 1, "message_id": 1}
+        )
+        async for doc in cursor:
+            batch.setdefault(doc["user_id"], []).append(doc["message_id"])
+            if sum(len(ids) for ids in batch.values()) >= 1000:
+                for user_id, message_ids in batch.items():
+                    enqueued += await self.enqueue(user_id, message_ids)
+                batch = {}
+        for user_id, message_ids in batch.items():
+            enqueued += await self.enqueue(user_id, message_ids)
+
+        await self.state_collection.update_one(
+            {"_id": BACKFILL_STATE_ID},
+            {"$set": {"done": True, "enqueued": enqueued, "finished_at": datetime.utcnow()}},
+            upsert=True
+        )
+        logger.info(f"[EMBEDDING QUEUE] Backfilled {enqueued} unembedded messages")
+        return enqueued
+
+    async def lag(self, user_id: str) -> Dict[str, Any]:
+        """Queue depth and lag for one user, plus totals across users."""
+        now = datetime.utcnow()
+        cursor = await self.queue_collection.aggregate([
+            {"$group": {
+                "_id": {"user_id": "$user_id", "status": "$status"},
+                "count": {"$sum": 1},
+                "oldest": {"$min": "$enqueued_at"}
+            }}
+        ])
+        groups = await cursor.to_list(length=None)
+
+        totals: Dict[str, int] = {"pending": 0, "processing": 0, "failed": 0}
+        user: Dict[str, Any] = {"pending": 0, "processing": 0, "failed": 0, "lag_seconds": 0.0}
+        users_waiting = set()
+        max_lag = 0.0
+        for group in groups:
+            status = group["_id"]["status"]
+            totals[status] = totals.get(status, 0) + group["count"]
+            lag = (now - group["oldest"]).total_seconds() if status != "failed" and group.get("oldest") else 0.0
+            if status != "failed":
+                users_waiting.add(group["_id"]["user_id"])
+                max_lag = max(max_lag, lag)
+            if group["_id"]["user_id"] == user_id:
+                user[status] = group["count"]
+                user["lag_seconds"] = round(max(user["lag_seconds"], lag), 1)
+
+        return {
+            "user": user,
+            "totals": {**totals, "users_waiting": len(users_waiting), "max_lag_seconds": round(max_lag, 1)}
+        }
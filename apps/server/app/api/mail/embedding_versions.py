@@ -0,0 +1,56 @@
+"""
+Active embedding versions.
+
+An embedding version pairs a provider spec (EMBEDDING_PROVIDER syntax, e.g. `gemini`,
+`gemini:models/text-embedding-005`, `hashing:1024`) with the vector collection holding
+its vectors. Queries always use the serving version; during a model migration new
+embeddings are also written to the target version. The pair is persisted by
+`embedding_migration` and cached here so the hot paths can read it synchronously.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from app.config import settings
+
+
+@dataclass(frozen=True)
+class EmbeddingVersion:
+    provider: str
+    collection: str
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"provider": self.provider, "collection": self.collection}
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> Optional["EmbeddingVersion"]:
+        if not data or not data.get("provider") or not data.get("collection"):
+            return None
+        return cls(provider=data["provider"], collection=data["collection"])
+
+
+def default_version() -> EmbeddingVersion:
+    """Version used before any migration: the configured provider and collection."""
+    return EmbeddingVersion(
+        provider=settings.EMBEDDING_PROVIDER,
+        collection=getattr(settings, "QDRANT_COLLECTION", "emails") or "emails",
+    )
+
+
+_serving: Optional[EmbeddingVersion] = None
+_target: Optional[EmbeddingVersion] = None
+
+
+def serving_version() -> EmbeddingVersion:
+    return _serving or default_version()
+
+
+def target_version() -> Optional[EmbeddingVersion]:
+    """Version being migrated to (dual-written), if a migration is running."""
+    return _target
+
+
+def set_active_versions(serving: Optional[EmbeddingVersion], target: Optional[EmbeddingVersion]) -> None:
+    global _serving, _target
+    _serving = serving
+    _target = target if target != serving else None
@@ -0,0 +1,185 @@
+"""
+Embedding worker.
+
+Drains `embedding_queue` through a three-stage pipeline so text building, provider
+calls and vector store writes overlap:
+- producer: claims fair batches, loads the emails and builds chunk texts
+- embedders (EMBEDDING_WORKER_CONCURRENCY): embed batches through the content-hash cache
+- writer: upserts vectors, marks emails embedded and completes the queue items
+Stages are connected by bounded queues, so at most EMBEDDING_WORKER_QUEUE_DEPTH batches
+are claimed ahead of the writer.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.api.mail.embedding_cache import hit_rate, record_embedding_job
+from app.api.mail.embedding_migration import load_embedding_versions
+from app.api.mail.vector_store import get_vector_store
+from app.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+THROUGHPUT_WINDOW_SECONDS = 60
+
+_metrics: Dict[str, Any] = {"emails": 0, "batches": 0, "failed_batches": 0, "drains": 0, "last_drain": {}}
+_completions: Deque[Tuple[float, int]] = deque()
+
+
+@dataclass
+class _Batch:
+    claim_id: str
+    user_id: str
+    message_ids: List[str]
+    items: List[Dict[str, Any]] = field(default_factory=list)
+    cache_stats: Dict[str, int] = field(default_factory=dict)
+
+
+def _record_completion(emails: int) -> None:
+    now = time.monotonic()
+    _completions.append((now, emails))
+    while _completions and _completions[0][0] < now - THROUGHPUT_WINDOW_SECONDS:
+        _completions.popleft()
+
+
+def embedding_worker_metrics() -> Dict[str, Any]:
+    now = time.monotonic()
+    recent = sum(count for at, count in _completions if at >= now - THROUGHPUT_WINDOW_SECONDS)
+    return {
+        **_metrics,
+        "emails_per_second": round(recent / THROUGHPUT_WINDOW_SECONDS, 2),
+        "window_seconds": THROUGHPUT_WINDOW_SECONDS,
+    }
+
+
+class EmbeddingWorker:
+    """Pipelined consumer of the embedding queue for one MailService."""
+
+    def __init__(self, mail_service):
+        self.mail_service = mail_service
+        self.queue = mail_service.embedding_queue
+
+    async def run_forever(self) -> None:
+        """Drain the queue continuously, idling briefly when it is empty."""
+        logger.info(f"[EMBEDDING WORKER] Started (concurrency {settings.EMBEDDING_WORKER_CONCURRENCY})")
+        while True:
+            try:
+                processed = await self.drain()
+            except Exception as e:
+                logger.error(f"[EMBEDDING WORKER] Drain failed: {e}")
+                processed = 0
+            if not processed:
+                await asyncio.sleep(settings.EMBEDDING_WORKER_IDLE_SECONDS)
+
+    async def drain(self, max_claims: Optional[int] = None) -> int:
+        """
+        Process queued work until the queue is empty (or `max_claims` batches were claimed).
+
+        Returns:
+            Number of emails completed
+        """
+        await load_embedding_versions(self.mail_service.db)
+        await self.queue.backfill_once(self.mail_service.email_index_collection)
+
+        started = time.perf_counter()
+        depth = max(1, settings.EMBEDDING_WORKER_QUEUE_DEPTH)
+        prepared: asyncio.Queue = asyncio.Queue(maxsize=depth)
+        embedded: asyncio.Queue = asyncio.Queue(maxsize=depth)
+        totals = {"emails": 0, "texts": 0, "cache_hits": 0, "batch_duplicates": 0, "embedded": 0}
+
+        concurrency = max(1, settings.EMBEDDING_WORKER_CONCURRENCY)
+        embedders = [asyncio.create_task(self._embed_stage(prepared, embedded)) for _ in range(concurrency)]
+        writer = asyncio.create_task(self._write_stage(embedded, totals))
+        try:
+            await self._produce(prepared, max_claims)
+        finally:
+            for _ in embedders:
+                await prepared.put(None)
+            await asyncio.gather(*embedders, return_exceptions=True)
+            await embedded.put(None)
+            await asyncio.gather(writer, return_exceptions=True)
+
+        if totals["emails"]:
+            elapsed = time.perf_counter() - started
+            cache_stats = {name: totals[name] for name in ("texts", "cache_hits", "batch_duplicates", "embedded")}
+            record_embedding_job(cache_stats)
+            _metrics["drains"] += 1
+            _metrics["last_drain"] = {
+                "emails": totals["emails"],
+                "seconds": round(elapsed, 2),
+                "emails_per_second": round(totals["emails"] / elapsed, 2) if elapsed else 0.0,
+            }
+            logger.info(f"[EMBEDDING WORKER] Embedded {totals['emails']} emails in {elapsed:.1f}s ({_metrics['last_drain']['emails_per_second']}/s); {totals['texts']} texts, {totals['cache_hits']} cache hits, {totals['embedded']} provider calls (hit rate {hit_rate(cache_stats):.0%})")
+        return totals["emails"]
+
+    async def _produce(self, prepared: asyncio.Queue, max_claims: Optional[int]) -> None:
+        claims = 0
+        while max_claims is None or claims < max_claims:
+            claim = await self.queue.claim(settings.EMBEDDING_BATCH_SIZE)
+            claims += 1
+            if not claim["items"]:
+                return
+            for user_id, message_ids in claim["items"].items():
+                # Distinct ids, so the throughput counters count emails rather than claim rows
+                message_ids = list(dict.fromkeys(message_ids))
+                batch = _Batch(claim["claim_id"], user_id, message_ids)
+                try:
+                    docs = await self.mail_service.emails_collection.find(
+                        {"user_id": user_id, "message_id": {"$in": message_ids}}
+                    ).to_list(length=len(message_ids))
+                    batch.items = self.mail_service._prepare_embedding_items(docs)
+                except Exception as e:
+                    await self._fail(batch, e)
+                    continue
+                await prepared.put(batch)
+
+    async def _embed_stage(self, prepared: asyncio.Queue, embedded: asyncio.Queue) -> None:
+        while True:
+            batch = await prepared.get()
+            if batch is None:
+                return
+            try:
+                if batch.items:
+                    batch.cache_stats = await self.mail_service._embed_items(batch.items)
+            except Exception as e:
+                await self._fail(batch, e)
+                continue
+            await embedded.put(batch)
+
+    async def _write_stage(self, embedded: asyncio.Queue, totals: Dict[str, int]) -> None:
+        vector_store = get_vector_store()
+        while True:
+            batch = await embedded.get()
+            if batch is None:
+                return
+            try:
+                await self.mail_service._store_embedded_items(batch.user_id, batch.items, vector_store)
+                await self.mail_service.email_index_collection.update_many(
+                    {"user_id": batch.user_id, "message_id": {"$in": batch.message_ids}},
+                    {"$set": {"is_embedded": True}}
+                )
+                await self.queue.complete(batch.claim_id, batch.user_id, batch.message_ids)
+            except Exception as e:
+                await self._fail(batch, e)
+                continue
+            emails = len(batch.message_ids)
+            totals["emails"] += emails
+            for name, value in batch.cache_stats.items():
+                totals[name] = totals.get(name, 0) + value
+            _metrics["emails"] += emails
+            _metrics["batches"] += 1
+            _record_completion(emails)
+
+    async def _fail(self, batch: _Batch, error: Exception) -> None:
+        logger.error(f"[EMBEDDING WORKER] Failed to embed batch of {len(batch.message_ids)} for user {batch.user_id}: {error}")
+        _metrics["failed_batches"] += 1
+        try:
+            # Failed items go back to the queue with backoff
+            await self.queue.release(batch.claim_id, batch.user_id, batch.message_ids, str(error))
+        except Exception as e:
+            logger.error(f"[EMBEDDING WORKER] Failed to release batch for user {batch.user_id}: {e}")
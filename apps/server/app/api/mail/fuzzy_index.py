@@ -0,0 +1,176 @@
+"""
+Trigram fuzzy index.
+
+Typo-tolerant lookup over the distinct subjects, sender names and sender addresses
+of each user (`search_trigrams`), maintained at ingest. Entries are keyed by the folded
+value and keep every display variant seen (case, diacritics), so a match can be expanded
+back to all emails carrying any of them. Candidates are fetched by trigram overlap in
+MongoDB and re-ranked by overlap and edit distance.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Set
+
+from pymongo import UpdateOne
+from pymongo.asynchronous.database import AsyncDatabase
+
+from app.api.mail.lexical_index import fold_text
+from app.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+FUZZY_FIELDS = ("from_email", "from_name", "subject")
+MAX_VALUE_CHARS = 120
+OVERLAP_WEIGHT = 0.6
+DISTANCE_WEIGHT = 0.4
+
+
+def trigrams(text: str) -> Set[str]:
+    """Character trigrams of the folded text, padded so short words and word starts count."""
+    folded = " ".join(fold_text(text).split())
+    if not folded:
+        return set()
+    padded = f"  {folded} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str, max_distance: Optional[int] = None) -> int:
+    """
+    Optimal string alignment distance (Levenshtein plus adjacent transpositions, the most
+    common typo), stopping early once every path exceeds `max_distance`.
+    """
+    if a == b:
+        return 0
+    before_previous: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i]
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                distance = min(distance, before_previous[j - 2] + 1)
+            current.append(distance)
+        if max_distance is not None and min(current) > max_distance:
+            return max_distance + 1
+        before_previous, previous = previous, current
+    return previous[-1]
+
+
+def prefix_distance(query: str, value: str) -> int:
+    """Edit distance between the query and the best-matching prefix of the value or one of its words."""
+    candidates = [value] + value.replace("@", " ").replace(".", " ").split()
+    limit = max(len(query), 1)
+    return min(edit_distance(query, candidate[:len(query)], limit) for candidate in candidates)
+
+
+class TrigramIndex:
+    """Trigram index over distinct sender and subject values."""
+
+    def __init__(self, db: AsyncDatabase):
+        self.db = db
+        self.trigrams_collection = db["search_trigrams"]
+
+    async def add_email(self, doc: Dict[str, Any]) -> None:
+        """Record the sender and subject values of one email."""
+        user_id = doc.get("user_id")
+        if not user_id:
+            return
+
+        received_on = doc.get("received_on") or ""
+        operations = []
+        for field in FUZZY_FIELDS:
+            value = (doc.get(field) or "").strip()[:MAX_VALUE_CHARS]
+            grams = trigrams(value)
+            if not grams:
+                continue
+            folded = " ".join(fold_text(value).split())
+            operations.append(UpdateOne(
+                {"user_id": user_id, "field": field, "folded": folded},
+                {
+                    "$set": {"value": value},
+                    "$setOnInsert": {"trigrams": sorted(grams)},
+                    "$addToSet": {"variants": value},
+                    "$max": {"last_seen": received_on}
+                },
+                upsert=True
+            ))
+        if operations:
+            await self.trigrams_collection.bulk_write(operations, ordered=False)
+
+    async def suggest(
+        self,
+        user_id: str,
+        query: str,
+        limit: int = 10,
+        fields: Optional[List[str]] = None,
+        with_variants: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Return the values closest to `query`, tolerating typos.
+
+        Returns:
+            List of {field, value, score} dicts, best first (score in 0..1); with
+            `with_variants`, also the display `variants` stored for each value
+        """
+        folded_query = " ".join(fold_text(query).split())
+        query_grams = trigrams(folded_query)
+        if len(folded_query) < 2 or not query_grams:
+            return []
+
+        match: Dict[str, Any] = {"user_id": user_id, "trigrams": {"$in": sorted(query_grams)}}
+        if fields:
+            match["field"] = {"$in": fields}
+
+        pipeline = [
+            {"$match": match},
+            {"$project": {
+                "_id": 0,
+                "field": 1,
+                "value": 1,
+                "folded": 1,
+                "variants": 1,
+                "last_seen": 1,
+                "overlap": {"$size": {"$setIntersection": ["$trigrams", sorted(query_grams)]}}
+            }},
+            {"$sort": {"overlap": -1, "last_seen": -1}},
+            {"$limit": settings.FUZZY_CANDIDATE_LIMIT}
+        ]
+        cursor = await self.trigrams_collection.aggregate(pipeline)
+        candidates = await cursor.to_list(length=None)
+
+        max_distance = max(1, len(folded_query) // 3)
+        results = []
+        for candidate in candidates:
+            distance = prefix_distance(folded_query, candidate["folded"])
+            if distance > max_distance:
+                continue
+            overlap = candidate["overlap"] / len(query_grams)
+            closeness = 1 - distance / max(len(folded_query), 1)
+            result = {
+                "field": candidate["field"],
+                "value": candidate["value"],
+                "score": round(OVERLAP_WEIGHT * overlap + DISTANCE_WEIGHT * closeness, 4),
+                "last_seen": candidate.get("last_seen") or ""
+            }
+            if with_variants:
+                result["variants"] = candidate.get("variants") or [candidate["value"]]
+            results.append(result)
+
+        results.sort(key=lambda item: (item["score"], item["last_seen"]), reverse=True)
+        return [{k: v for k, v in item.items() if k != "last_seen"} for item in results[:limit]]
+
+    async def rebuild_user(self, user_id: str, source_collection) -> int:
+        """Rebuild a user's trigram index from stored documents."""
+        await self.trigrams_collection.delete_many({"user_id": user_id})
+        processed = 0
+        cursor = source_collection.find(
+            {"user_id": user_id},
+            {"_id": 0, "user_id": 1, "subject": 1, "from_name": 1, "from_email": 1, "received_on": 1}
+        )
+        async for doc in cursor:
+            await self.add_email(doc)
+            processed += 1
+        logger.info(f"[FUZZY INDEX] Rebuilt trigram index for user {user_id} from {processed} emails")
+        return processed
@@ -0,0 +1,327 @@
+"""
+Lexical search index.
+
+Per-user token inverted index over subject, sender and clean body, stored in MongoDB:
+- `search_postings`: one document per (user, term, message) with weighted term frequency
+- `search_terms`: document frequency per (user, term), also used for prefix expansion
+- `search_documents`: indexed terms and length per (user, message); swapped atomically on
+  (re)index so concurrent indexers agree on what is new and which counters to adjust
+- `search_index_stats`: document count and total length per user (BM25 normalization)
+
+Updated incrementally at sync time and on label changes, queried with BM25.
+"""
+
+import asyncio
+import logging
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.errors import BulkWriteError
+
+from app.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Field weights applied to term frequency
+FIELD_WEIGHTS = {
+    "subject": 3,
+    "from_name": 2,
+    "from_email": 2,
+    "clean_text": 1,
+}
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "was", "were", "will", "with",
+}
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def fold_text(text: str) -> str:
+    """Lowercase and strip diacritics, so "Báo cáo" matches "bao cao"."""
+    text = text.lower().replace("đ", "d")
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def tokenize(text: str) -> List[str]:
+    if not text:
+        return []
+    return [
+        token for token in _TOKEN_PATTERN.findall(fold_text(text))
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+def parse_query(query: str) -> Tuple[List[str], List[str]]:
+    """
+    Split a query into exact terms and prefix terms.
+    A trailing `*` marks a prefix; the last word is always a prefix (search-as-you-type).
+    """
+    words = query.strip().split()
+    exact: List[str] = []
+    prefixes: List[str] = []
+    for i, word in enumerate(words):
+        is_prefix = word.endswith("*") or i == len(words) - 1
+        tokens = tokenize(word.rstrip("*"))
+        if not tokens:
+            continue
+        if is_prefix:
+            exact.extend(tokens[:-1])
+            prefixes.append(tokens[-1])
+        else:
+            exact.extend(tokens)
+    return exact, prefixes
+
+
+def posting_id(user_id: str, message_id: str, term: str) -> str:
+    return f"{user_id}:{message_id}:{term}"
+
+
+class LexicalIndex:
+    """Inverted index with BM25 ranking, prefix queries and label filters."""
+
+    def __init__(self, db: AsyncDatabase):
+        self.db = db
+        self.postings_collection = db["search_postings"]
+        self.terms_collection = db["search_terms"]
+        self.documents_collection = db["search_documents"]
+        self.stats_collection = db["search_index_stats"]
+
+    def _term_frequencies(self, doc: Dict[str, Any]) -> Counter:
+        frequencies: Counter = Counter()
+        for field, weight in FIELD_WEIGHTS.items():
+            value = doc.get(field) or ""
+            if field == "clean_text":
+                value = value[:settings.SEARCH_INDEX_MAX_BODY_CHARS]
+            for token in tokenize(value):
+                frequencies[token] += weight
+        return frequencies
+
+    async def index_email(self, doc: Dict[str, Any]) -> None:
+        """(Re)index one email. Safe to call repeatedly for the same message."""
+        user_id = doc.get("user_id")
+        message_id = doc.get("message_id")
+        if not user_id or not message_id:
+            return
+
+        frequencies = self._term_frequencies(doc)
+        doc_length = sum(frequencies.values())
+        new_terms = set(frequencies)
+
+        # Swap in the new state and get the previous one in one step: with several indexers on
+        # the same message, exactly one sees no previous record, and each adjusts the counters
+        # by the difference from the state it replaced
+        previous = await self.documents_collection.find_one_and_update(
+            {"user_id": user_id, "message_id": message_id},
+            {"$set": {"terms": sorted(new_terms), "dl": doc_length}, "$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        old_terms = set(previous.get("terms", [])) if previous else set()
+        old_length = previous.get("dl", 0) if previous else 0
+        version = (previous.get("version", 0) if previous else 0) + 1
+
+        await self._write_postings(user_id, message_id, frequencies, doc_length, version, doc)
+
+        await self._update_document_frequencies(user_id, new_terms - old_terms, old_terms - new_terms)
+        await self.stats_collection.update_one(
+            {"user_id": user_id},
+            {"$inc": {
+                "doc_count": 0 if previous else 1,
+                "total_length": doc_length - old_length,
+            }},
+            upsert=True
+        )
+
+    async def _write_postings(
+        self,
+        user_id: str,
+        message_id: str,
+        frequencies: Counter,
+        doc_length: int,
+        version: int,
+        doc: Dict[str, Any]
+    ) -> None:
+        """
+        Replace the message's postings with `version` of them.
+
+        Postings are keyed by (user, message, term) and only overwrite older versions, so
+        concurrent indexings of one message converge on the newest instead of duplicating.
+        """
+        labels = doc.get("labels", [])
+        received_on = doc.get("received_on") or ""
+        operations = [
+            ReplaceOne(
+                {"_id": posting_id(user_id, message_id, term), "version": {"$lt": version}},
+                {
+                    "user_id": user_id,
+                    "term": term,
+                    "message_id": message_id,
+                    "tf": tf,
+                    "dl": doc_length,
+                    "labels": labels,
+                    "received_on": received_on,
+                    "version": version,
+                },
+                upsert=True
+            )
+            for term, tf in frequencies.items()
+        ]
+        if operations:
+            try:
+                await self.postings_collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                # Duplicate keys are postings a newer version already wrote
+                if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                    raise
+
+        message_filter = {"user_id": user_id, "message_id": message_id}
+        await self.postings_collection.delete_many({**message_filter, "version": {"$lt": version}})
+        current = await self.documents_collection.find_one(message_filter, {"version": 1})
+        if current and current.get("version", 0) != version:
+            # Re-indexed meanwhile; the newer version may have cleaned up before these were written
+            await self.postings_collection.delete_many({**message_filter, "version": version})
+
+    async def remove_email(self, user_id: str, message_id: str) -> None:
+        # Only the caller that deletes the record decrements the counters
+        previous = await self.documents_collection.find_one_and_delete({"user_id": user_id, "message_id": message_id})
+        await self.postings_collection.delete_many({"user_id": user_id, "message_id": message_id})
+        if not previous:
+            return
+
+        await self._update_document_frequencies(user_id, set(), set(previous.get("terms", [])))
+        await self.stats_collection.update_one(
+            {"user_id": user_id},
+            {"$inc": {"doc_count": -1, "total_length": -previous.get("dl", 0)}}
+        )
+
+    async def update_labels(self, user_id: str, message_id: str, labels: List[str]) -> None:
+        """Keep label filters in step with label changes (no re-tokenization needed)."""
+        await self.postings_collection.update_many(
+            {"user_id": user_id, "message_id": message_id},
+            {"$set": {"labels": labels}}
+        )
+
+    async def _update_document_frequencies(self, user_id: str, added: Iterable[str], removed: Iterable[str]) -> None:
+        operations = [
+            UpdateOne({"user_id": user_id, "term": term}, {"$inc": {"df": 1}}, upsert=True)
+            for term in added
+        ]
+        operations.extend(
+            UpdateOne({"user_id": user_id, "term": term}, {"$inc": {"df": -1}})
+            for term in removed
+        )
+        if operations:
+            await self.terms_collection.bulk_write(operations, ordered=False)
+
+    async def _expand_prefixes(self, user_id: str, prefixes: List[str]) -> Dict[str, List[str]]:
+        """Map each prefix to the most frequent indexed terms starting with it."""
+        expansions: Dict[str, List[str]] = {}
+        for prefix in prefixes:
+            docs = await self.terms_collection.find(
+                {"user_id": user_id, "term": {"$regex": f"^{re.escape(prefix)}"}, "df": {"$gt": 0}},
+                {"_id": 0, "term": 1}
+            ).sort("df", -1).limit(settings.SEARCH_PREFIX_MAX_EXPANSIONS).to_list(length=None)
+            expansions[prefix] = [doc["term"] for doc in docs]
+        return expansions
+
+    async def has_documents(self, user_id: str) -> bool:
+        stats = await self.stats_collection.find_one({"user_id": user_id})
+        return bool(stats and stats.get("doc_count", 0) > 0)
+
+    async def search(
+        self,
+        user_id: str,
+        query: str,
+        label: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0
+    ) -> List[Tuple[str, float]]:
+        """
+        Rank the user's emails against `query` with BM25.
+
+        Each query word contributes its best-scoring expansion, so a prefix that expands to
+        many terms does not outweigh an exact match.
+
+        Returns:
+            (message_id, score) pairs, best first, for the requested page
+        """
+        exact, prefixes = parse_query(query)
+        if not exact and not prefixes:
+            return []
+
+        stats = await self.stats_collection.find_one({"user_id": user_id}) or {}
+        doc_count = max(stats.get("doc_count", 0), 1)
+        avg_length = max(stats.get("total_length", 0), 1) / doc_count
+
+        groups: List[List[str]] = [[term] for term in exact]
+        expansions = await self._expand_prefixes(user_id, prefixes)
+        groups.extend(expansions[prefix] or [prefix] for prefix in prefixes)
+        all_terms = sorted({term for group in groups for term in group})
+
+        term_docs = await self.terms_collection.find(
+            {"user_id": user_id, "term": {"$in": all_terms}},
+            {"_id": 0, "term": 1, "df": 1}
+        ).to_list(length=None)
+        document_frequency = {doc["term"]: doc.get("df", 0) for doc in term_docs}
+
+        # One capped postings query per query word, so a very common word cannot crowd out rare ones
+        results = await asyncio.gather(*(self._fetch_postings(user_id, group, label) for group in groups))
+
+        term_scores: Dict[Tuple[str, str], float] = {}
+        for posting in (posting for postings in results for posting in postings):
+            df = max(document_frequency.get(posting["term"], 1), 1)
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            tf = posting["tf"]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * posting["dl"] / avg_length)
+            term_scores[(posting["message_id"], posting["term"])] = idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        scores: Dict[str, float] = {}
+        message_ids = {message_id for message_id, _ in term_scores}
+        for message_id in message_ids:
+            total = 0.0
+            for group in groups:
+                total += max((term_scores.get((message_id, term), 0.0) for term in group), default=0.0)
+            scores[message_id] = total
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[offset:offset + limit]
+
+    async def _fetch_postings(self, user_id: str, terms: List[str], label: Optional[str]) -> List[Dict[str, Any]]:
+        posting_filter: Dict[str, Any] = {"user_id": user_id, "term": {"$in": terms}}
+        if label:
+            posting_filter["labels"] = label
+        return await self.postings_collection.find(
+            posting_filter,
+            {"_id": 0, "term": 1, "message_id": 1, "tf": 1, "dl": 1}
+        ).sort("tf", -1).limit(settings.SEARCH_MAX_POSTINGS_PER_TERM).to_list(length=None)
+
+    async def rebuild_user(self, user_id: str, source_collection) -> int:
+        """Rebuild a user's index from stored documents (backfill for mailboxes synced earlier)."""
+        await self.postings_collection.delete_many({"user_id": user_id})
+        await self.terms_collection.delete_many({"user_id": user_id})
+        await self.documents_collection.delete_many({"user_id": user_id})
+        await self.stats_collection.delete_one({"user_id": user_id})
+
+        indexed = 0
+        cursor = source_collection.find(
+            {"user_id": user_id},
+            {"_id": 0, "user_id": 1, "message_id": 1, "subject": 1, "from_name": 1,
+             "from_email": 1, "clean_text": 1, "labels": 1, "received_on": 1}
+        )
+        async for doc in cursor:
+            await self.index_email(doc)
+            indexed += 1
+        logger.info(f"[LEXICAL INDEX] Rebuilt index for user {user_id}: {indexed} emails")
+        return indexed
@@ -0,0 +1,496 @@
+"""
+Embedded vector store.
+
+In-process alternative to Qdrant for single-node deployments (VECTOR_STORE_BACKEND=local).
+Each user's vectors live under `<LOCAL_VECTOR_STORE_PATH>/<collection>/<user hash>/` as
+append-only segments:
+- `seg-NNNNNN.npy`: unit-length float32 vectors, memory-mapped on load
+- `seg-NNNNNN.q8.npy` / `.scale.npy`: int8 codes and scales, held in RAM (VECTOR_QUANTIZATION=int8)
+- `seg-NNNNNN.json`: message ids and payloads (written last; marks the segment complete)
+
+Rows are message chunks. A message written again lands in a new segment with all of its
+chunks and every older row of it is masked out, so the latest version wins. Small recent
+segments of similar size are merged tier by tier (LOCAL_VECTOR_MERGE_FACTOR); everything is
+compacted into one segment only once too many rows are superseded. Queries are a vectorized dot product per segment with
+label filters applied as boolean masks; with quantization the dot product runs on the
+int8 codes and only the best candidates are rescored from the memory-mapped originals.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from app.api.mail.vector_codec import (
+    int8_scores,
+    prepare_matrix,
+    prepare_vector,
+    quantization_enabled,
+    quantize_int8,
+    rescore_limit,
+    stored_dimension,
+)
+from app.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+EXCLUDED_LABELS = ("DRAFT", "TRASH")
+
+
+class _Segment:
+    def __init__(
+        self,
+        seq: int,
+        vectors: np.ndarray,
+        message_ids: List[str],
+        payloads: List[Dict],
+        codes: Optional[np.ndarray] = None,
+        scales: Optional[np.ndarray] = None,
+        order: Optional[int] = None
+    ):
+        self.seq = seq
+        # Replay position on load; a merged segment takes the newest position it replaced
+        self.order = order if order is not None else seq
+        self.vectors = vectors
+        self.codes = codes
+        self.scales = scales
+        self.message_ids = message_ids
+        self.payloads = payloads
+        self.alive = np.ones(len(message_ids), dtype=bool)
+        self._label_masks: Optional[Dict[str, np.ndarray]] = None
+        self._thread_rows: Optional[Dict[str, List[int]]] = None
+
+    def label_mask(self, label: str) -> np.ndarray:
+        if self._label_masks is None:
+            masks: Dict[str, np.ndarray] = {}
+            for row, payload in enumerate(self.payloads):
+                for row_label in payload.get("labels") or []:
+                    if row_label not in masks:
+                        masks[row_label] = np.zeros(len(self.payloads), dtype=bool)
+                    masks[row_label][row] = True
+            self._label_masks = masks
+        mask = self._label_masks.get(label)
+        return mask if mask is not None else np.zeros(len(self.payloads), dtype=bool)
+
+    def thread_rows(self, thread_id: str) -> List[int]:
+        if self._thread_rows is None:
+            rows: Dict[str, List[int]] = {}
+            for row, payload in enumerate(self.payloads):
+                if payload.get("thread_id"):
+                    rows.setdefault(payload["thread_id"], []).append(row)
+            self._thread_rows = rows
+        return self._thread_rows.get(thread_id, [])
+
+
+def _read_manifests(path: str) -> List[Tuple[int, int, Dict]]:
+    """(order, seq, meta) of a user's segments in replay order, without loading any vectors."""
+    if not os.path.isdir(path):
+        return []
+    metas = []
+    for name in os.listdir(path):
+        if name.startswith("seg-") and name.endswith(".json"):
+            seq = int(name[4:10])
+            with open(os.path.join(path, name), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            metas.append((meta.get("order", seq), seq, meta))
+    # A merged segment replays at the position of the newest segment it replaced
+    return sorted(metas, key=lambda entry: (entry[0], entry[1]))
+
+
+def _count_live_chunks(path: str) -> int:
+    """Live (message, chunk) rows of a user directory, replaying the segment manifests only."""
+    chunks_by_message: Dict[str, Set[int]] = {}
+    for _, _, meta in _read_manifests(path):
+        # Like _add_segment: a segment replaces every chunk of the messages it contains
+        segment_chunks: Dict[str, Set[int]] = {}
+        for message_id, payload in zip(meta["message_ids"], meta["payloads"]):
+            segment_chunks.setdefault(message_id, set()).add(int(payload.get("chunk_index") or 0))
+        chunks_by_message.update(segment_chunks)
+    return sum(len(chunks) for chunks in chunks_by_message.values())
+
+
+class _UserVectors:
+    """
+    Segments of one user plus the location of the live row of each message chunk.
+
+    `lock` guards the in-memory state; queries and appends hold it. Merges write their
+    segment file without it and only take it to snapshot their inputs and to swap the
+    merged segment in.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+        self.segments: List[_Segment] = []
+        self.locations: Dict[Tuple[str, int], Tuple[_Segment, int]] = {}
+        self.keys_by_message: Dict[str, List[Tuple[str, int]]] = {}
+        self._seq = 0
+        self._load()
+
+    def _segment_path(self, seq: int, ext: str) -> str:
+        return os.path.join(self.path, f"seg-{seq:06d}.{ext}")
+
+    def _load(self) -> None:
+        self.segments = []
+        self.locations = {}
+        self.keys_by_message = {}
+        for order, seq, meta in _read_manifests(self.path):
+            vectors = np.load(self._segment_path(seq, "npy"), mmap_mode="r")
+            codes, scales = self._load_codes(seq, vectors)
+            self._add_segment(_Segment(seq, vectors, meta["message_ids"], meta["payloads"], codes, scales, order))
+            self._seq = max(self._seq, seq)
+
+    def _load_codes(self, seq: int, vectors: np.ndarray) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        if not quantization_enabled():
+            return None, None
+        codes_path = self._segment_path(seq, "q8.npy")
+        if os.path.exists(codes_path):
+            return np.load(codes_path), np.load(self._segment_path(seq, "scale.npy"))
+        # Segment written before quantization was enabled
+        return quantize_int8(np.asarray(vectors))
+
+    def _save_array(self, path: str, array: np.ndarray) -> None:
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, array)
+        os.replace(path + ".tmp", path)
+
+    def _add_segment(self, segment: _Segment) -> None:
+        # A segment carries every chunk of the messages it contains
+        for message_id in set(segment.message_ids):
+            for key in self.keys_by_message.pop(message_id, []):
+                previous_segment, previous_row = self.locations.pop(key)
+                previous_segment.alive[previous_row] = False
+        for row, message_id in enumerate(segment.message_ids):
+            key = (message_id, int(segment.payloads[row].get("chunk_index") or 0))
+            self.locations[key] = (segment, row)
+            self.keys_by_message.setdefault(message_id, []).append(key)
+        self.segments.append(segment)
+
+    def _write_segment(
+        self,
+        seq: int,
+        vectors: np.ndarray,
+        message_ids: List[str],
+        payloads: List[Dict],
+        order: Optional[int] = None
+    ) -> _Segment:
+        os.makedirs(self.path, exist_ok=True)
+        npy_path = self._segment_path(seq, "npy")
+        json_path = self._segment_path(seq, "json")
+        self._save_array(npy_path, vectors)
+        codes, scales = None, None
+        if quantization_enabled():
+            codes, scales = quantize_int8(vectors)
+            self._save_array(self._segment_path(seq, "q8.npy"), codes)
+            self._save_array(self._segment_path(seq, "scale.npy"), scales)
+        meta: Dict[str, object] = {"message_ids": message_ids, "payloads": payloads}
+        if order is not None:
+            meta["order"] = order
+        with open(json_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(json_path + ".tmp", json_path)
+        return _Segment(seq, np.load(npy_path, mmap_mode="r"), message_ids, payloads, codes, scales, order)
+
+    def _next_seq(self) -> int:
+        self._seq += 1
+        return self._seq
+
+    def append(self, vectors: np.ndarray, message_ids: List[str], payloads: List[Dict]) -> None:
+        """Write a new segment. Caller holds `lock`; call `maybe_merge` after releasing it."""
+        self._add_segment(self._write_segment(self._next_seq(), vectors, message_ids, payloads))
+
+    def dead_rows(self) -> int:
+        return sum(len(segment.alive) - int(segment.alive.sum()) for segment in self.segments)
+
+    def _merge_candidates(self) -> List[_Segment]:
+        """
+        Tiered merging: a segment's tier is log_F(live rows). When the newest
+        LOCAL_VECTOR_MERGE_FACTOR (F) segments share a tier they are merged into one
+        segment of the next tier, so each row is rewritten O(log n) times.
+        """
+        factor = max(2, settings.LOCAL_VECTOR_MERGE_FACTOR)
+        run: List[_Segment] = []
+        tier = None
+        for segment in reversed(self.segments):
+            live = int(segment.alive.sum())
+            segment_tier = int(math.log(max(live, 1), factor))
+            if tier is not None and segment_tier != tier:
+                break
+            tier = segment_tier
+            run.append(segment)
+        return list(reversed(run)) if len(run) >= factor else []
+
+    def maybe_merge(self) -> None:
+        """Merge small recent segments, or everything once too many rows are superseded."""
+        if not self._merge_lock.acquire(blocking=False):
+            # Another thread is merging this user; it re-checks when done
+            return
+        try:
+            while True:
+                with self.lock:
+                    live = len(self.locations)
+                    if self.dead_rows() > live * settings.LOCAL_VECTOR_MAX_DEAD_RATIO:
+                        sources = list(self.segments)
+                    else:
+                        sources = self._merge_candidates()
+                if not sources:
+                    return
+                self._merge(sources)
+        finally:
+            self._merge_lock.release()
+
+    def compact(self) -> None:
+        """Merge all live rows into a single segment."""
+        with self._merge_lock:
+            with self.lock:
+                sources = list(self.segments)
+            if sources:
+                self._merge(sources)
+
+    def _merge(self, sources: List[_Segment]) -> None:
+        """Rewrite the live rows of `sources` as one segment. Caller holds `_merge_lock`, not `lock`."""
+        with self.lock:
+            seq = self._next_seq()
+            order = max(segment.order for segment in sources)
+            picked = [(segment, np.flatnonzero(segment.alive)) for segment in sources]
+
+        # Segment files are immutable, so reading and writing happens outside the lock
+        vectors: List[np.ndarray] = []
+        message_ids: List[str] = []
+        payloads: List[Dict] = []
+        origins: List[Tuple[_Segment, int]] = []
+        for segment, rows in picked:
+            if len(rows) == 0:
+                continue
+            vectors.append(np.asarray(segment.vectors[rows]))
+            message_ids.extend(segment.message_ids[row] for row in rows)
+            payloads.extend(segment.payloads[row] for row in rows)
+            origins.extend((segment, int(row)) for row in rows)
+        # A crash before the sources are removed only leaves superseded rows behind:
+        # the merged segment replays after them (same order, higher seq)
+        merged = None
+        if message_ids:
+            merged = self._write_segment(seq, np.concatenate(vectors), message_ids, payloads, order)
+
+        with self.lock:
+            source_ids = {id(segment) for segment in sources}
+            position = max(index for index, segment in enumerate(self.segments) if id(segment) in source_ids)
+            remaining = [segment for segment in self.segments[:position + 1] if id(segment) not in source_ids]
+            newer = self.segments[position + 1:]
+            if merged is not None:
+                # Rows superseded while the merge was being written stay dead
+                for row, origin in enumerate(origins):
+                    key = (merged.message_ids[row], int(merged.payloads[row].get("chunk_index") or 0))
+                    if self.locations.get(key) == origin:
+                        self.locations[key] = (merged, row)
+                    else:
+                        merged.alive[row] = False
+                remaining.append(merged)
+            self.segments = remaining + newer
+
+        for segment in sources:
+            for ext in ("json", "npy", "q8.npy", "scale.npy"):
+                try:
+                    os.remove(self._segment_path(segment.seq, ext))
+                except OSError:
+                    pass
+        logger.info(f"[LOCAL VECTORS] Merged {len(sources)} segments ({len(message_ids)} vectors) at {self.path}")
+
+
+class LocalVectorStore:
+    """In-process vector store with the same interface as QdrantVectorStore."""
+
+    def __init__(self, base_path: str, collection_name: str = "emails", provider_dimension: Optional[int] = None):
+        self.root = os.path.join(base_path, collection_name)
+        self.collection_name = collection_name
+        self.dimension = stored_dimension(provider_dimension)
+        self._users: Dict[str, _UserVectors] = {}
+        self._users_lock = threading.Lock()
+        self._ensure_collection()
+
+    def _ensure_collection(self) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        manifest_path = os.path.join(self.root, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                size = json.load(f).get("dimension")
+            if size != self.dimension:
+                raise ValueError(
+                    f"Collection '{self.collection_name}' has {size}-dimension vectors but the "
+                    f"embedding provider produces {self.dimension}; set QDRANT_COLLECTION to a separate collection"
+                )
+            return
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump({"dimension": self.dimension}, f)
+
+    def _user_dir(self, user_id: str) -> str:
+        return os.path.join(self.root, hashlib.sha1(user_id.encode("utf-8")).hexdigest()[:20])
+
+    def _loaded_users(self) -> List[_UserVectors]:
+        with self._users_lock:
+            return list(self._users.values())
+
+    def _user(self, user_id: str) -> _UserVectors:
+        with self._users_lock:
+            user = self._users.get(user_id)
+            if user is None:
+                user = _UserVectors(self._user_dir(user_id))
+                self._users[user_id] = user
+            return user
+
+    def upsert(
+        self,
+        user_id: str,
+        items: Sequence[Dict],
+    ) -> None:
+        if not items:
+            return
+        # Last item wins for repeated message chunks within one call
+        latest: Dict[Tuple[str, int], Dict] = {}
+        for item in items:
+            latest[(item["message_id"], item.get("chunk_index", 0))] = item
+
+        keys = list(latest)
+        message_ids = [m_id for m_id, _ in keys]
+        vectors = np.asarray([latest[key]["embedding"] for key in keys], dtype=np.float32)
+        if vectors.shape[1] < self.dimension:
+            raise ValueError(f"Expected {self.dimension}-dimension vectors, got {vectors.shape[1]}")
+        vectors = prepare_matrix(vectors, self.dimension)
+        payloads = []
+        for m_id, chunk_index in keys:
+            item = latest[(m_id, chunk_index)]
+            payloads.append({
+                "user_id": user_id,
+                "message_id": m_id,
+                "thread_id": item.get("thread_id", ""),
+                "subject": item.get("subject", ""),
+                "from_name": item.get("from_name", ""),
+                "from_email": item.get("from_email", ""),
+                "snippet": item.get("snippet", ""),
+                "labels": item.get("labels", []),
+                "chunk_index": chunk_index,
+                "chunk_count": item.get("chunk_count", 1),
+                "passage": item.get("passage", ""),
+            })
+
+        user = self._user(user_id)
+        with user.lock:
+            user.append(vectors, message_ids, payloads)
+        user.maybe_merge()
+
+    def query(
+        self,
+        user_id: str,
+        query_embedding: List[float],
+        top_k: int,
+        mailbox_label_id: Optional[str] = None,
+        exclude_message_id: Optional[str] = None,
+        exclude_thread_id: Optional[str] = None,
+    ) -> List[Tuple[str, float, Dict]]:
+        query = np.asarray(prepare_vector(query_embedding, self.dimension), dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0 or top_k <= 0:
+            return []
+        query = query / norm
+
+        user = self._user(user_id)
+        candidates: List[Tuple[float, _Segment, int]] = []
+        with user.lock:
+            for segment in user.segments:
+                mask = segment.alive.copy()
+                for label in EXCLUDED_LABELS:
+                    mask &= ~segment.label_mask(label)
+                if mailbox_label_id:
+                    mask &= segment.label_mask(mailbox_label_id)
+                if exclude_thread_id:
+                    mask[segment.thread_rows(exclude_thread_id)] = False
+                if exclude_message_id:
+                    for key in user.keys_by_message.get(exclude_message_id, []):
+                        located_segment, row = user.locations[key]
+                        if located_segment is segment:
+                            mask[row] = False
+                rows = np.flatnonzero(mask)
+                if len(rows) == 0:
+                    continue
+                if segment.codes is not None:
+                    # Approximate pass on the int8 codes, then exact scores for the shortlist
+                    # Whole segment: score the stored codes in place instead of gathering a copy
+                    scores = int8_scores(segment.codes, segment.scales, query, None if len(rows) == len(mask) else rows)
+                    limit = rescore_limit(top_k)
+                    if len(rows) > limit:
+                        shortlist = np.argpartition(-scores, limit - 1)[:limit]
+                        rows = rows[shortlist]
+                scores = np.asarray(segment.vectors[rows]) @ query
+                if len(rows) > top_k:
+                    best = np.argpartition(-scores, top_k - 1)[:top_k]
+                    rows, scores = rows[best], scores[best]
+                candidates.extend((float(score), segment, int(row)) for score, row in zip(scores, rows))
+
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        return [
+            (segment.message_ids[row], score, segment.payloads[row])
+            for score, segment, row in candidates[:top_k]
+        ]
+
+    def message_vector(self, user_id: str, message_id: str) -> Optional[Tuple[List[float], Dict]]:
+        """
+        Stored vector of a message (mean of its chunk vectors) and its first chunk's payload.
+        Returns None when the message has no vectors.
+        """
+        user = self._user(user_id)
+        with user.lock:
+            keys = sorted(user.keys_by_message.get(message_id, []), key=lambda key: key[1])
+            if not keys:
+                return None
+            rows = [user.locations[key] for key in keys]
+            vectors = np.stack([np.asarray(segment.vectors[row], dtype=np.float32) for segment, row in rows])
+            segment, row = rows[0]
+            return vectors.mean(axis=0).tolist(), dict(segment.payloads[row])
+
+    def count(self, user_id: Optional[str] = None) -> int:
+        if user_id:
+            user = self._user(user_id)
+            with user.lock:
+                return len(user.locations)
+        with self._users_lock:
+            loaded = {user.path: user for user in self._users.values()}
+        total = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(path):
+                continue
+            user = loaded.get(path)
+            if user is None:
+                # Users never loaded in this process are counted from their manifests
+                total += _count_live_chunks(path)
+                continue
+            with user.lock:
+                total += len(user.locations)
+        return total
+
+    def compact(self, user_ids: Optional[Iterable[str]] = None) -> int:
+        """Compact the given users (default: all loaded users). Returns the number compacted."""
+        users = [self._user(user_id) for user_id in user_ids] if user_ids is not None else self._loaded_users()
+        for user in users:
+            user.compact()
+        return len(users)
+
+    def dedupe(self, user_id: Optional[str] = None) -> Dict[str, int]:
+        """Drop superseded rows (one live row per message chunk is kept by construction)."""
+        users = [self._user(user_id)] if user_id else self._loaded_users()
+        deleted = 0
+        chunks = 0
+        for user in users:
+            with user.lock:
+                deleted += user.dead_rows()
+            user.compact()
+            with user.lock:
+                chunks += len(user.locations)
+        return {"scanned": chunks + deleted, "chunks": chunks, "deleted": deleted}
@@ -1,7 +1,7 @@
 """Pydantic models for mail API following Zero's structure."""
 
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
 from datetime import datetime
 from pydantic.alias_generators import to_camel
 
@@ -87,6 +87,7 @@ class ThreadPreview(CamelModel):
     body: str  # Preview text
     summary: Optional[str] = None
     has_attachments: bool = False
+    highlight: Optional[str] = None  # best-matching passage of long emails (semantic search)
 
 
 class ThreadListResponse(CamelModel):
@@ -141,6 +142,31 @@ class SemanticSearchRequest(CamelModel):
     mailbox_id: Optional[str] = None
     page: int = Field(1, ge=1)
     limit: int = Field(20, ge=1, le=100)
+    cursor: Optional[str] = None  # X-Search-Cursor from a previous page
+
+
+class HybridSearchRequest(CamelModel):
+    """Request model for hybrid (lexical + semantic) search fused with reciprocal rank fusion."""
+    query: str = Field(..., min_length=1)
+    mailbox_id: Optional[str] = None
+    page: int = Field(1, ge=1)
+    limit: int = Field(20, ge=1, le=100)
+    mode: Literal["hybrid", "lexical", "semantic"] = "hybrid"
+    # Quality/latency trade-off
+    candidates: int = Field(50, ge=10, le=500, description="Candidates fetched from each retriever")
+    rrf_k: int = Field(60, ge=1, le=1000, description="RRF rank constant; larger flattens rank differences")
+    lexical_weight: float = Field(1.0, ge=0)
+    semantic_weight: float = Field(1.0, ge=0)
+    min_semantic_score: float = Field(0.3, ge=0, le=1)
+    semantic_timeout_ms: Optional[int] = Field(None, ge=50, le=30000, description="Return lexical-only results if semantic retrieval is slower")
+
+
+class HybridSearchResponse(CamelModel):
+    results: List[ThreadPreview]
+    timings: Dict[str, float]  # milliseconds per stage
+    sources: Dict[str, int]  # candidates returned by each retriever
+    degraded: bool = False  # a retriever failed or timed out
+    rebuilding: bool = False  # semantic index rebuild in progress; semantic results are partial
 
 
 class SendEmailRequest(CamelModel):
@@ -195,6 +221,7 @@ class EmailDocument(CamelModel):
     processed_html: str  # Processed HTML content
     decoded_body: Optional[str] = None
     snippet: Optional[str] = None
+    clean_text: Optional[str] = None  # Normalized text (no HTML, quotes, signatures) for AI and search
 
     # Metadata
     labels: List[str]  # Gmail label IDs
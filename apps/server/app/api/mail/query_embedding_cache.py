@@ -0,0 +1,131 @@
+"""
+Query embedding cache.
+
+Semantic search embeds the query text on every request, including each page of the
+same query. Embeddings are cached by normalized query text and model name:
+- In-process LRU with TTL (always on unless disabled)
+- Optional MongoDB backend (`query_embedding_cache`, TTL index) shared across replicas
+"""
+
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from pymongo.asynchronous.database import AsyncDatabase
+
+from app.api.mail.semantic_embedding import embedding_model_name, encode_texts
+from app.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.casefold().split())
+
+
+def query_cache_key(query: str, model_name: Optional[str] = None) -> str:
+    model_name = model_name or embedding_model_name()
+    return hashlib.sha256(f"{model_name}|{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """Bounded in-process LRU cache whose entries expire after `ttl_seconds`."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: List[float]) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_memory_cache = LRUCache(settings.QUERY_EMBEDDING_CACHE_SIZE, settings.QUERY_EMBEDDING_CACHE_TTL_SECONDS)
+_stats: Dict[str, int] = {"memory_hits": 0, "shared_hits": 0, "misses": 0}
+
+
+async def _get_shared(db: AsyncDatabase, key: str) -> Optional[List[float]]:
+    doc = await db["query_embedding_cache"].find_one(
+        {"_id": key, "expires_at": {"$gt": datetime.utcnow()}},
+        {"embedding": 1}
+    )
+    return doc["embedding"] if doc else None
+
+
+async def _set_shared(db: AsyncDatabase, key: str, embedding: List[float]) -> None:
+    now = datetime.utcnow()
+    await db["query_embedding_cache"].update_one(
+        {"_id": key},
+        {"$set": {
+            "model": embedding_model_name(),
+            "embedding": embedding,
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=settings.QUERY_EMBEDDING_CACHE_TTL_SECONDS)
+        }},
+        upsert=True
+    )
+
+
+async def embed_query(query: str, db: Optional[AsyncDatabase] = None) -> List[float]:
+    """
+    Return the embedding for a search query, computing it only on a cache miss.
+
+    Args:
+        query: Raw query text (normalized for the cache key only)
+        db: Database for the shared backend; ignored unless QUERY_EMBEDDING_CACHE_BACKEND is "mongo"
+    """
+    backend = settings.QUERY_EMBEDDING_CACHE_BACKEND
+    if backend == "none":
+        return (await encode_texts([query]))[0]
+
+    key = query_cache_key(query)
+    embedding = _memory_cache.get(key)
+    if embedding is not None:
+        _stats["memory_hits"] += 1
+        return embedding
+
+    use_shared = backend == "mongo" and db is not None
+    if use_shared:
+        try:
+            embedding = await _get_shared(db, key)
+        except Exception as e:
+            logger.warning(f"[QUERY CACHE] Shared cache lookup failed: {e}")
+        if embedding is not None:
+            _stats["shared_hits"] += 1
+            _memory_cache.set(key, embedding)
+            return embedding
+
+    _stats["misses"] += 1
+    embedding = (await encode_texts([query]))[0]
+    _memory_cache.set(key, embedding)
+    if use_shared:
+        try:
+            await _set_shared(db, key, embedding)
+        except Exception as e:
+            logger.warning(f"[QUERY CACHE] Shared cache write failed: {e}")
+    return embedding
+
+
+def query_cache_stats() -> Dict[str, int]:
+    return {**_stats, "memory_entries": len(_memory_cache)}
@@ -1,13 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Response, Form, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, Form, UploadFile, File, Header
 from typing import List, Optional
 from urllib.parse import quote
+from fastapi.responses import StreamingResponse
 import logging
 from app.api.auth.dependencies import get_current_user
 from app.api.auth.models import UserInfo
 from app.config import settings
 from app.api.mail.service import MailService
 from app.api.mail.dependencies import get_mail_service
-from app.api.mail.models import SnoozeEmailRequest, SemanticSearchRequest
+from app.api.mail.semantic_embedding import get_embedding_provider
+from app.api.mail.query_embedding_cache import query_cache_stats
+from app.api.mail.embedding_cache import embedding_cache_stats
+from app.api.mail.embedding_worker import embedding_worker_metrics
+from app.api.mail.vector_codec import quantization_enabled, storage_estimate, stored_dimension
+from app.api.mail.models import SnoozeEmailRequest, SemanticSearchRequest, HybridSearchRequest, HybridSearchResponse
 
 logger = logging.getLogger(__name__)
 from app.api.mail.models import (
@@ -22,9 +28,19 @@ from app.api.mail.models import (
     ForwardEmailRequest
 )
 from app.models.api_response import APIResponse
+from app.utils.etag import etag_matches
+from app.utils.responses import fast_api_response
+from app.utils.single_flight import single_flight_metrics
 
 router = APIRouter(prefix="/mail", tags=["Mail"])
 
+# Clients may cache privately but must revalidate with If-None-Match on every view
+ETAG_CACHE_CONTROL = "private, no-cache"
+
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": ETAG_CACHE_CONTROL})
+
 
 @router.get("/mailboxes", response_model=APIResponse[List[Mailbox]])
 async def get_mailboxes(
@@ -42,12 +58,21 @@ async def get_emails(
     page_token: str = Query(None, description="Page token for pagination"),
     limit: int = Query(50, ge=1, le=100, description="Items per page"),
     summarize: bool = Query(False, description="If true, include AI summary"),
+    if_none_match: Optional[str] = Header(None),
     mail_service: MailService = Depends(get_mail_service),
     current_user: UserInfo = Depends(get_current_user)
 ):
     """Get paginated thread list for a mailbox. Returns lightweight thread IDs with historyIds."""
+    # Summaries are filled in asynchronously, so summarized pages are never validated by ETag
+    etag = None
+    if not summarize:
+        etag = await mail_service.get_mailbox_etag(current_user.id, mailbox_id, page_token, limit)
+        if etag_matches(if_none_match, etag):
+            return _not_modified(etag)
+
     result = await mail_service.get_emails(current_user.id, mailbox_id, page_token, limit, summarize)
-    return APIResponse(data=result, message="Emails retrieved successfully")
+    headers = {"ETag": etag, "Cache-Control": ETAG_CACHE_CONTROL} if etag else None
+    return fast_api_response(ThreadListResponse, result, "Emails retrieved successfully", headers)
 
 
 @router.get("/emails/{email_id}", response_model=APIResponse[ThreadDetailResponse])
@@ -55,18 +80,43 @@ async def get_email_detail(
     email_id: str,
     mail_service: MailService = Depends(get_mail_service),
     current_user: UserInfo = Depends(get_current_user),
-    summarize: bool = Query(False, description="If true, include AI summary")
+    summarize: bool = Query(False, description="If true, include AI summary"),
+    if_none_match: Optional[str] = Header(None)
 ):
     """Get full thread detail with all messages and metadata."""
     try:
+        etag = None
+        if not summarize:
+            etag = await mail_service.get_email_detail_etag(current_user.id, email_id)
+            if etag_matches(if_none_match, etag):
+                return _not_modified(etag)
+
         email_detail = await mail_service.get_email_detail(current_user.id, email_id, summarize)
-        return APIResponse(data=email_detail, message="Email retrieved successfully")
+        headers = {"ETag": etag, "Cache-Control": ETAG_CACHE_CONTROL} if etag else None
+        return fast_api_response(ThreadDetailResponse, email_detail, "Email retrieved successfully", headers)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/emails/{email_id}/related", response_model=APIResponse[List[ThreadPreview]])
+async def get_related_emails(
+    email_id: str,
+    limit: int = Query(10, ge=1, le=50, description="Number of related emails"),
+    mail_service: MailService = Depends(get_mail_service),
+    current_user: UserInfo = Depends(get_current_user)
+):
+    """Emails semantically similar to this one (other threads), found from its stored embedding."""
+    try:
+        results = await mail_service.get_related_emails(current_user.id, email_id, limit)
+        return fast_api_response(List[ThreadPreview], results, "Related emails retrieved successfully")
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get related emails: {str(e)}")
+
+
 @router.post("/emails/{email_id}/reply", response_model=APIResponse[dict])
 async def reply_email(
     email_id: str,
@@ -441,13 +491,28 @@ async def search_emails(
 ):
     try:
         results = await mail_service.search_emails(current_user.id, q, mailbox_id, page, limit)
-        return APIResponse(data=results, message="Search completed successfully")
+        return fast_api_response(List[ThreadPreview], results, "Search completed successfully")
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to search emails: {str(e)}")
 
 
+@router.get("/search/suggest", response_model=APIResponse[List[dict]])
+async def suggest_search(
+    q: str = Query(..., min_length=2, description="Partial sender, address or subject"),
+    limit: int = Query(8, ge=1, le=20, description="Maximum suggestions"),
+    mail_service: MailService = Depends(get_mail_service),
+    current_user: UserInfo = Depends(get_current_user)
+):
+    """Typo-tolerant autocomplete over sender names, sender addresses and subjects."""
+    try:
+        results = await mail_service.suggest_search(current_user.id, q, limit)
+        return APIResponse(data=results, message="Suggestions retrieved successfully")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get suggestions: {str(e)}")
+
+
 @router.post("/search/semantic", response_model=APIResponse[List[ThreadPreview]])
 async def search_emails_semantic(
     payload: SemanticSearchRequest,
@@ -455,20 +520,45 @@ async def search_emails_semantic(
     current_user: UserInfo = Depends(get_current_user),
 ):
     try:
-        results = await mail_service.search_emails_semantic(
+        results, cursor, rebuilding = await mail_service.search_emails_semantic(
             current_user.id,
             payload.query,
             payload.mailbox_id,
             payload.page,
             payload.limit,
+            payload.cursor,
+        )
+        return fast_api_response(
+            List[ThreadPreview],
+            results,
+            "Semantic search completed successfully",
+            headers={"X-Search-Cursor": cursor, "X-Index-Rebuilding": "true" if rebuilding else "false"}
         )
-        return APIResponse(data=results, message="Semantic search completed successfully")
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to perform semantic search: {str(e)}")
 
 
+@router.post("/search/hybrid", response_model=APIResponse[HybridSearchResponse])
+async def search_emails_hybrid(
+    payload: HybridSearchRequest,
+    mail_service: MailService = Depends(get_mail_service),
+    current_user: UserInfo = Depends(get_current_user)
+):
+    """
+    Keyword and semantic search in one ranked page (reciprocal rank fusion).
+    Per-stage timings are returned; `candidates`, weights and `semanticTimeoutMs` tune quality vs latency.
+    """
+    try:
+        result = await mail_service.search_emails_hybrid(current_user.id, payload)
+        return fast_api_response(HybridSearchResponse, result, "Hybrid search completed successfully")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to run hybrid search: {str(e)}")
+
+
 @router.post("/emails/{email_id}/summarize", response_model=APIResponse[dict])
 async def summarize_email(
     email_id: str,
@@ -485,6 +575,30 @@ async def summarize_email(
         raise HTTPException(status_code=500, detail=f"Failed to summarize email: {str(e)}")
 
 
+@router.post("/emails/{email_id}/summarize/stream")
+async def stream_email_summary(
+    email_id: str,
+    mail_service: MailService = Depends(get_mail_service),
+    current_user: UserInfo = Depends(get_current_user)
+):
+    """
+    Stream a summary of a single email as Server-Sent Events.
+    A stored summary is sent immediately; otherwise model tokens are relayed as they arrive.
+    """
+    try:
+        events = await mail_service.stream_email_summary(current_user.id, email_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to summarize email: {str(e)}")
+
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.post("/emails/{email_id}/snooze", response_model=APIResponse[dict])
 async def snooze_email_endpoint(
     email_id: str,
@@ -638,6 +752,206 @@ async def trigger_startup_sync(
         raise HTTPException(status_code=500, detail=f"Failed to trigger startup sync: {str(e)}")
 
 
+@router.post("/admin/search/reindex", response_model=APIResponse[dict])
+async def rebuild_search_index(
+    mail_service: MailService = Depends(get_mail_service),
+    current_user: UserInfo = Depends(get_current_user)
+):
+    """
+    Rebuild the local search index for the current user.
+    Needed once for mailboxes synced before the index existed.
+    """
+    try:
+        result = await mail_service.rebuild_search_index(current_user.id)
+        return APIResponse(data=result, message=f"Indexed {result['indexed']} emails")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild search index: {str(e)}")
+
+
+@router.get("/admin/embeddings/queue", response_model=APIResponse[dict])
+async def get_embedding_queue_status(
+    mail_service: MailService = Depends(get_mail_service),
+    current_user: UserInfo = Depends(get_current_user)
+):
+    """
+    Get embedding queue status.
+    Shows the current user's pending/processing/failed items and lag, plus totals across users.
+    """
+    try:
+        result = await mail_service.get_embedding_queue_status(current_user.id)
+        return APIResponse(data=result, message="Embedding queue status retrieved successfully")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get embedding queue status: {str(e)}")
+
+
+@router.post("/admin/embeddings/dedupe", response_model=APIResponse[dict])
+async def dedupe_semantic_index(
+    mail_service: MailService = Depends(get_mail_service),
+    current_user: UserInfo = Depends(get_current_user)
+):
+    """
+    Remove duplicate vectors of the current user's emails.
+    Vectors written before point ids were derived from the message id are collapsed into one per email.
+    """
+    try:
+        result = await mail_service.dedupe_semantic_index(current_user.id)
+        return APIResponse(data=result, message=f"Removed {result['deleted']} duplicate vectors")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to dedupe semantic index: {str(e)}")
+
+
+@router.post("/admin/embeddings/rebuild", response_model=APIResponse[dict])
+async def rebuild_semantic_index(
+    force: bool = Query(False, description="Start over instead of resuming a failed rebuild"),
+    mail_service: MailService = Depends(get_mail_service),
+    current_user: UserInfo = Depends(get_current_user)
+):
+    """
+    Queue a background rebuild of the current user's semantic index.
+    Emails are streamed in batches and progress is checkpointed; poll GET /admin/embeddings/rebuild.
+    """
+    try:
+        result = await mail_service.request_semantic_rebuild(current_user.id, force=force)
+        return APIResponse(data=result, message="Semantic index rebuild queued")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to queue semantic index rebuild: {str(e)}")
+
+
+@router.get("/admin/embeddings/rebuild", response_model=APIResponse[dict])
+async def get_semantic_rebuild_status(
+    mail_service: MailService = Depends(get_mail_service),
+    current_user: UserInfo = Depends(get_current_user)
+):
+    """
+    Get the current user's semantic index rebuild status.
+    Shows job state, processed/total emails, progress and the vectors stored so far.
+    """
+    try:
+        result = await mail_service.get_semantic_rebuild_status(current_user.id)
+        return APIResponse(data=result, message="Semantic rebuild status retrieved successfully")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get semantic rebuild status: {str(e)}")
+
+
+@router.get("/admin/embeddings/migration", response_model=APIResponse[dict])
+async def get_embedding_migration_status(
+    mail_service: MailService = Depends(get_mail_service),
+    current_user: UserInfo = Depends(get_current_user)
+):
+    """
+    Get embedding model migration progress.
+    Shows serving and target versions, status (migrating/ready/done/aborted), re-embedded emails, rate and ETA.
+    """
+    try:
+        result = await mail_service.get_embedding_migration_status()
+        return APIResponse(data=result, message="Embedding migration status retrieved successfully")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get embedding migration status: {str(e)}")
+
+
+@router.post("/admin/embeddings/migration", response_model=APIResponse[dict])
+async def start_embedding_migration(
+    provider: str = Query(..., min_length=1, description="Target provider, e.g. gemini:models/text-embedding-005 or hashing:1024"),
+    mail_service: MailService = Depends(get_mail_service),
+    current_user: UserInfo = Depends(get_current_user)
+):
+    """
+    Start migrating to another embedding model.
+    New embeddings are dual-written and existing emails are re-embedded in the background; queries keep using the current model until cutover.
+    """
+    try:
+        result = await mail_service.start_embedding_migration(provider)
+        return APIResponse(data=result, message=f"Embedding migration to {provider} started")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to start embedding migration: {str(e)}")
+
+
+@router.post("/admin/embeddings/migration/cutover", response_model=APIResponse[dict])
+async def cutover_embedding_migration(
+    force: bool = Query(False, description="Cut over before re-embedding finished (partial results until it does)"),
+    mail_service: MailService = Depends(get_mail_service),
+    current_user: UserInfo = Depends(get_current_user)
+):
+    """Switch queries to the migration target in one atomic update."""
+    try:
+        result = await mail_service.cutover_embedding_migration(force=force)
+        return APIResponse(data=result, message="Embedding migration cut over")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to cut over embedding migration: {str(e)}")
+
+
+@router.post("/admin/embeddings/migration/abort", response_model=APIResponse[dict])
+async def abort_embedding_migration(
+    mail_service: MailService = Depends(get_mail_service),
+    current_user: UserInfo = Depends(get_current_user)
+):
+    """Stop the running embedding migration; the serving model is unchanged."""
+    try:
+        result = await mail_service.abort_embedding_migration()
+        return APIResponse(data=result, message="Embedding migration aborted")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to abort embedding migration: {str(e)}")
+
+
+@router.get("/admin/summaries/status", response_model=APIResponse[dict])
+async def get_summarize_job_status(
+    mail_service: MailService = Depends(get_mail_service),
+    current_user: UserInfo = Depends(get_current_user)
+):
+    """
+    Get status of the background summarize job.
+    Shows the number of recent emails still waiting for a summary and last-run throughput.
+    """
+    try:
+        result = await mail_service.summary_service.get_summarize_job_status()
+        return APIResponse(data=result, message="Summarize job status retrieved successfully")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get summarize job status: {str(e)}")
+
+
+@router.get("/admin/embeddings/metrics", response_model=APIResponse[dict])
+async def get_embedding_metrics(
+    current_user: UserInfo = Depends(get_current_user)
+):
+    """
+    Get embedding provider metrics for this process.
+    Shows call/text/retry/failure counts, call latency percentiles, query and content-hash cache hits
+    embedding worker throughput (emails/second) and the estimated vector memory per million emails.
+    """
+    return APIResponse(
+        data={
+            "provider": get_embedding_provider().metrics(),
+            "query_cache": query_cache_stats(),
+            "embedding_cache": embedding_cache_stats(),
+            "worker": embedding_worker_metrics(),
+            "storage": {
+                "backend": settings.VECTOR_STORE_BACKEND,
+                "quantization": settings.VECTOR_QUANTIZATION,
+                **storage_estimate(stored_dimension(), quantization_enabled(), settings.VECTOR_ON_DISK)
+            }
+        },
+        message="Embedding metrics retrieved successfully"
+    )
+
+
+@router.get("/admin/single-flight/metrics", response_model=APIResponse[dict])
+async def get_single_flight_metrics(
+    current_user: UserInfo = Depends(get_current_user)
+):
+    """
+    Get single-flight metrics for this process.
+    Per operation: calls, executions actually run, calls coalesced onto an in-flight execution,
+    waits on another instance's lease and the coalesce rate.
+    """
+    return APIResponse(data=single_flight_metrics(), message="Single-flight metrics retrieved successfully")
+
+
 @router.get("/admin/stats", response_model=APIResponse[dict])
 async def get_admin_stats(
     mail_service: MailService = Depends(get_mail_service),
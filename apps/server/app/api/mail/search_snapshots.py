@@ -0,0 +1,83 @@
+"""
+Semantic search result snapshots.
+
+The ranked message ids of a semantic query are stored for a short time
+(`semantic_search_snapshots`, TTL index), so later pages only hydrate their own
+slice instead of re-running the vector query. Snapshot ids are derived from the
+user, query, mailbox, model and the user's embeddings version, which changes
+whenever new embeddings land.
+"""
+
+import hashlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo.asynchronous.database import AsyncDatabase
+
+from app.api.mail.query_embedding_cache import normalize_query
+from app.config import settings
+
+
+def snapshot_id_for(
+    user_id: str,
+    query: str,
+    mailbox_label_id: Optional[str],
+    model_name: str,
+    embeddings_version: int,
+    min_score: float
+) -> str:
+    raw = "|".join([
+        user_id, normalize_query(query), mailbox_label_id or "", model_name,
+        str(embeddings_version), f"{min_score:.4f}"
+    ])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+class SearchSnapshotStore:
+    """Short-lived ranked-id snapshots behind a cursor token."""
+
+    def __init__(self, db: AsyncDatabase):
+        self.db = db
+        self.snapshots_collection = db["semantic_search_snapshots"]
+
+    async def get(self, user_id: str, snapshot_id: str) -> Optional[Dict[str, Any]]:
+        return await self.snapshots_collection.find_one({
+            "_id": snapshot_id,
+            "user_id": user_id,
+            "expires_at": {"$gt": datetime.utcnow()}
+        })
+
+    async def save(
+        self,
+        user_id: str,
+        snapshot_id: str,
+        message_ids: List[str],
+        scores: List[float],
+        embeddings_version: int,
+        depth: int,
+        highlights: Optional[List[Optional[str]]] = None,
+        ttl_seconds: Optional[int] = None
+    ) -> None:
+        """
+        Store a ranking; `depth` is the top_k it was fetched with (fewer ids means exhaustive).
+        `highlights` holds the best-matching passage per id, when there is one.
+        `ttl_seconds` overrides SEMANTIC_SNAPSHOT_TTL_SECONDS.
+        """
+        now = datetime.utcnow()
+        await self.snapshots_collection.update_one(
+            {"_id": snapshot_id},
+            {"$set": {
+                "user_id": user_id,
+                "message_ids": message_ids,
+                "scores": scores,
+                "highlights": highlights or [],
+                "embeddings_version": embeddings_version,
+                "depth": depth,
+                "created_at": now,
+                "expires_at": now + timedelta(seconds=ttl_seconds or settings.SEMANTIC_SNAPSHOT_TTL_SECONDS)
+            }},
+            upsert=True
+        )
+
+    async def invalidate_user(self, user_id: str) -> None:
+        await self.snapshots_collection.delete_many({"user_id": user_id})
@@ -1,28 +1,236 @@
+"""
+Embedding providers.
+
+Providers are selected by spec (EMBEDDING_PROVIDER, or a migration target):
+- gemini[:<model>]: Gemini embeddings (text-embedding-004 by default) through a long-lived
+  async client (network, quota-limited)
+- hashing[:<dimension>]: CPU-only feature-hashing model built with NumPy (offline, for
+  backfills, tests and benchmarks)
+
+Vectors from different providers are not comparable; each provider reports its own
+name and dimension, and the vector collection must match them. Without a spec the
+serving version's provider is used (see embedding_versions).
+"""
+
+import asyncio
+import logging
 import math
-from typing import Iterable, List
+import random
+import re
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+import numpy as np
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+from app.api.mail.embedding_versions import serving_version
+from app.api.mail.lexical_index import fold_text
 from app.config import settings
 
 MODEL_NAME = "models/text-embedding-004"
+GEMINI_DIMENSION = 768
+GEMINI_DIMENSIONS = {
+    "models/text-embedding-004": 768,
+    "models/text-embedding-005": 768,
+    "models/gemini-embedding-001": 3072,
+}
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_PATTERNS = ("429", "resource_exhausted", "resource exhausted", "quota", "rate limit", "503", "unavailable", "deadline")
+
+
+def _is_retryable(error: Exception) -> bool:
+    error_str = str(error).lower()
+    return any(pattern in error_str for pattern in RETRYABLE_PATTERNS)
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class EmbeddingProvider(ABC):
+    """Base class: providers implement `_embed_batch` and set `name` and `dimension`."""
+
+    name: str = ""
+    dimension: int = 0
+
+    def __init__(self):
+        self._latencies_ms: Deque[float] = deque(maxlen=1000)
+        self._counters: Dict[str, int] = {"calls": 0, "texts": 0, "retries": 0, "failures": 0}
+
+    def _record_call(self, started: float, texts: int) -> None:
+        self._latencies_ms.append((time.perf_counter() - started) * 1000)
+        self._counters["calls"] += 1
+        self._counters["texts"] += texts
+
+    @abstractmethod
+    async def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        """Embed one request-sized batch, in order."""
+
+    def _batch_size(self) -> int:
+        return max(1, settings.EMBEDDING_REQUEST_BATCH_SIZE)
+
+    async def embed_documents(self, texts: Iterable[str]) -> List[List[float]]:
+        """Embed texts in order, in sub-batches of `_batch_size()`."""
+        data = list(texts)
+        if not data:
+            return []
+
+        batch_size = self._batch_size()
+        batches = [data[i:i + batch_size] for i in range(0, len(data), batch_size)]
+        results = await asyncio.gather(*(self._embed_batch(batch) for batch in batches))
+        return [embedding for batch_embeddings in results for embedding in batch_embeddings]
+
+    def metrics(self) -> Dict[str, Any]:
+        latencies = list(self._latencies_ms)
+        return {
+            "provider": self.name,
+            "dimension": self.dimension,
+            **self._counters,
+            "latency_ms_p50": round(_percentile(latencies, 50), 2),
+            "latency_ms_p95": round(_percentile(latencies, 95), 2),
+            "latency_ms_p99": round(_percentile(latencies, 99), 2),
+            "latency_samples": len(latencies),
+        }
+
+
+class EmbeddingClient(EmbeddingProvider):
+    """
+    Long-lived async Gemini embedding client.
+
+    Splits inputs into sub-batches, runs at most EMBEDDING_CONCURRENCY calls at once,
+    retries quota/unavailable errors with exponential backoff and records per-call latency.
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME, dimension: int = GEMINI_DIMENSION):
+        super().__init__()
+        self.name = model_name
+        self.dimension = dimension
+        self._model: Optional[GoogleGenerativeAIEmbeddings] = None
+        self._semaphore = asyncio.Semaphore(settings.EMBEDDING_CONCURRENCY)
+
+    def _get_model(self) -> GoogleGenerativeAIEmbeddings:
+        if self._model is None:
+            self._model = GoogleGenerativeAIEmbeddings(
+                model=self.name,
+                google_api_key=settings.GEMINI_API_KEY
+            )
+        return self._model
+
+    async def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        max_retries = settings.EMBEDDING_MAX_RETRIES
+        for attempt in range(max_retries + 1):
+            async with self._semaphore:
+                started = time.perf_counter()
+                try:
+                    embeddings = await self._get_model().aembed_documents(batch)
+                    self._record_call(started, len(batch))
+                    return embeddings
+                except Exception as e:
+                    self._latencies_ms.append((time.perf_counter() - started) * 1000)
+                    if attempt >= max_retries or not _is_retryable(e):
+                        self._counters["failures"] += 1
+                        raise
+                    error = e
+            # Back off outside the semaphore so other batches keep the slot busy
+            self._counters["retries"] += 1
+            delay = min(settings.EMBEDDING_MAX_BACKOFF_SECONDS, settings.EMBEDDING_BACKOFF_SECONDS * (2 ** attempt))
+            delay *= random.uniform(0.5, 1.0)
+            logger.warning(f"[EMBEDDING] Retryable error on batch of {len(batch)} (attempt {attempt + 1}/{max_retries + 1}), retrying in {delay:.1f}s: {error}")
+            await asyncio.sleep(delay)
+        return []  # unreachable
+
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+_SIGN_SEED = 0x9E3779B9
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Offline embedding model: signed feature hashing of words, word bigrams and
+    character trigrams, log-scaled and L2-normalized. Deterministic across processes.
+    """
+
+    def __init__(self, dimension: int):
+        super().__init__()
+        self.dimension = dimension
+        self.name = f"hashing-v1-{dimension}"
+
+    def _batch_size(self) -> int:
+        return 256
+
+    def _features(self, text: str) -> List[str]:
+        words = _WORD_PATTERN.findall(fold_text(text)[:settings.EMBEDDING_HASHING_MAX_CHARS])
+        features = [f"w:{word}" for word in words]
+        features.extend(f"b:{a} {b}" for a, b in zip(words, words[1:]))
+        for word in words:
+            padded = f"<{word}>"
+            features.extend(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+        return features
+
+    def _encode(self, batch: List[str]) -> List[List[float]]:
+        matrix = np.zeros((len(batch), self.dimension), dtype=np.float32)
+        for row, text in enumerate(batch):
+            features = self._features(text)
+            if not features:
+                continue
+            encoded = [feature.encode("utf-8") for feature in features]
+            indices = np.fromiter((zlib.crc32(f) % self.dimension for f in encoded), dtype=np.int64, count=len(encoded))
+            signs = np.fromiter((1.0 if zlib.crc32(f, _SIGN_SEED) & 1 else -1.0 for f in encoded), dtype=np.float32, count=len(encoded))
+            np.add.at(matrix[row], indices, signs)
+
+        # Sublinear term frequency, then unit length so cosine == dot product
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (matrix / norms).tolist()
+
+    async def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        started = time.perf_counter()
+        embeddings = await asyncio.to_thread(self._encode, batch)
+        self._record_call(started, len(batch))
+        return embeddings
+
+
+_providers: Dict[str, EmbeddingProvider] = {}
+
+
+def _create_provider(spec: str) -> EmbeddingProvider:
+    backend, _, option = spec.partition(":")
+    if backend == "hashing":
+        return HashingEmbeddingProvider(int(option) if option else settings.EMBEDDING_HASHING_DIMENSION)
+    if backend == "gemini":
+        model_name = option or MODEL_NAME
+        return EmbeddingClient(model_name, GEMINI_DIMENSIONS.get(model_name, GEMINI_DIMENSION))
+    raise ValueError(f"Unknown embedding provider: {spec}")
+
 
-def _get_model() -> GoogleGenerativeAIEmbeddings:
-    return GoogleGenerativeAIEmbeddings(
-        model=MODEL_NAME,
-        google_api_key=settings.GEMINI_API_KEY
-    )
+def get_embedding_provider(spec: Optional[str] = None) -> EmbeddingProvider:
+    """Provider for `spec` (`backend[:option]`); defaults to the serving version's provider."""
+    spec = spec or serving_version().provider
+    provider = _providers.get(spec)
+    if provider is None:
+        provider = _providers[spec] = _create_provider(spec)
+        logger.info(f"[EMBEDDING] Using provider {provider.name} ({provider.dimension} dimensions)")
+    return provider
 
-def encode_texts(texts: Iterable[str], batch_size: int = 16) -> List[List[float]]:
-    """Encode texts to embeddings using Gemini."""
-    data = list(texts)
-    if not data:
-        return []
 
-    model = _get_model()
-    embeddings = model.embed_documents(data)
+async def encode_texts(texts: Iterable[str], spec: Optional[str] = None) -> List[List[float]]:
+    """Encode texts to embeddings with the serving (or the given) provider."""
+    return await get_embedding_provider(spec).embed_documents(texts)
 
-    return embeddings
 
-def embedding_dimension() -> int:
-    return 768
+def embedding_model_name(spec: Optional[str] = None) -> str:
+    return get_embedding_provider(spec).name
 
 
+def embedding_dimension(spec: Optional[str] = None) -> int:
+    return get_embedding_provider(spec).dimension
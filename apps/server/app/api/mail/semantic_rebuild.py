@@ -0,0 +1,158 @@
+"""
+Background semantic index rebuilds.
+
+When a user has no vectors (new vector store, lost collection, provider change), search
+requests a rebuild instead of running one inline. Jobs live in `semantic_rebuild_jobs`
+(one per user) and are run by a background loop that streams the user's emails by `_id`
+in batches and checkpoints the cursor after each one, so a restarted or crashed job
+resumes where it stopped. A job whose heartbeat is older than SEMANTIC_REBUILD_STALE_SECONDS
+is picked up again by any instance.
+"""
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.api.mail.embedding_migration import load_embedding_versions
+from app.api.mail.vector_store import get_vector_store
+from app.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class SemanticRebuilder:
+    """Queues, runs and reports per-user semantic index rebuilds."""
+
+    def __init__(self, mail_service):
+        self.mail_service = mail_service
+        self.jobs_collection = mail_service.db["semantic_rebuild_jobs"]
+        self.worker_id = uuid.uuid4().hex
+
+    async def request(self, user_id: str, force: bool = False) -> Dict[str, Any]:
+        """
+        Queue a rebuild unless one is already queued or running.
+        A failed job resumes from its checkpoint; `force` starts over from the first email.
+        """
+        now = datetime.utcnow()
+        existing = await self.jobs_collection.find_one({"_id": user_id})
+        update: Dict[str, Any] = {"status": "queued", "requested_at": now, "error": None}
+        if force or not existing or existing.get("status") == "done":
+            update.update({"cursor": None, "processed": 0, "started_at": None, "finished_at": None})
+        try:
+            await self.jobs_collection.update_one(
+                {"_id": user_id, "status": {"$nin": list(ACTIVE_STATUSES)}},
+                {"$set": update},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Already queued or running
+            pass
+        return await self.status(user_id)
+
+    async def status(self, user_id: str) -> Dict[str, Any]:
+        job = await self.jobs_collection.find_one({"_id": user_id}, {"cursor": 0, "worker_id": 0})
+        if not job:
+            return {"user_id": user_id, "status": "none"}
+        job["user_id"] = job.pop("_id")
+        total = job.get("total") or 0
+        job["progress"] = round(min(job.get("processed", 0) / total, 1.0), 4) if total else 0.0
+        return job
+
+    async def is_rebuilding(self, user_id: str) -> bool:
+        job = await self.jobs_collection.find_one({"_id": user_id, "status": {"$in": list(ACTIVE_STATUSES)}}, {"_id": 1})
+        return job is not None
+
+    async def _claim_job(self) -> Optional[Dict[str, Any]]:
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=settings.SEMANTIC_REBUILD_STALE_SECONDS)
+        return await self.jobs_collection.find_one_and_update(
+            {"$or": [
+                {"status": "queued"},
+                {"status": "running", "heartbeat_at": {"$lt": stale_before}},
+            ]},
+            {"$set": {"status": "running", "worker_id": self.worker_id, "heartbeat_at": now}},
+            sort=[("requested_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def run_job(self, job: Dict[str, Any]) -> None:
+        user_id = job["_id"]
+        cursor = job.get("cursor")
+        processed = job.get("processed", 0)
+        emails_collection = self.mail_service.emails_collection
+        await load_embedding_versions(self.mail_service.db)
+        vector_store = get_vector_store()
+
+        total = await emails_collection.count_documents({"user_id": user_id})
+        await self.jobs_collection.update_one(
+            {"_id": user_id, "worker_id": self.worker_id},
+            {"$set": {"total": total, "started_at": job.get("started_at") or datetime.utcnow()}}
+        )
+        logger.info(f"[SEMANTIC REBUILD] User {user_id}: starting at {processed}/{total} emails")
+
+        try:
+            while True:
+                query: Dict[str, Any] = {"user_id": user_id}
+                if cursor is not None:
+                    query["_id"] = {"$gt": cursor}
+                docs = await emails_collection.find(query).sort("_id", 1).limit(
+                    settings.SEMANTIC_REBUILD_BATCH_SIZE
+                ).to_list(length=settings.SEMANTIC_REBUILD_BATCH_SIZE)
+                if not docs:
+                    break
+
+                await self.mail_service._upsert_embeddings_batch(user_id, docs, vector_store)
+                await self.mail_service.email_index_collection.update_many(
+                    {"user_id": user_id, "message_id": {"$in": [doc["message_id"] for doc in docs if doc.get("message_id")]}},
+                    {"$set": {"is_embedded": True}}
+                )
+                cursor = docs[-1]["_id"]
+                processed += len(docs)
+
+                # Checkpoint; stop if another instance took the job over
+                result = await self.jobs_collection.update_one(
+                    {"_id": user_id, "worker_id": self.worker_id},
+                    {"$set": {"cursor": cursor, "processed": processed, "heartbeat_at": datetime.utcnow()}}
+                )
+                if result.matched_count == 0:
+                    logger.warning(f"[SEMANTIC REBUILD] User {user_id}: job taken over by another worker, stopping")
+                    return
+
+            await self.jobs_collection.update_one(
+                {"_id": user_id, "worker_id": self.worker_id},
+                {"$set": {"status": "done", "processed": processed, "finished_at": datetime.utcnow()}}
+            )
+            logger.info(f"[SEMANTIC REBUILD] User {user_id}: done, {processed} emails")
+        except Exception as e:
+            logger.error(f"[SEMANTIC REBUILD] User {user_id}: failed after {processed} emails: {e}")
+            await self.jobs_collection.update_one(
+                {"_id": user_id, "worker_id": self.worker_id},
+                {"$set": {"status": "failed", "error": str(e)[:500], "finished_at": datetime.utcnow()}}
+            )
+
+    async def run_pending(self) -> int:
+        """Run queued (and abandoned) jobs until none are left. Returns the number run."""
+        ran = 0
+        while True:
+            job = await self._claim_job()
+            if not job:
+                return ran
+            await self.run_job(job)
+            ran += 1
+
+    async def run_forever(self) -> None:
+        logger.info("[SEMANTIC REBUILD] Rebuild loop started")
+        while True:
+            try:
+                await self.run_pending()
+            except Exception as e:
+                logger.error(f"[SEMANTIC REBUILD] Loop error: {e}")
+            await asyncio.sleep(settings.SEMANTIC_REBUILD_POLL_SECONDS)
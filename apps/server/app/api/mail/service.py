@@ -6,7 +6,7 @@ from app.config import settings
 from bson import ObjectId
 import email.utils
 from datetime import datetime, timezone, timedelta
-from typing import Optional, List, Set, Dict, Any, Iterable
+from typing import Optional, List, Set, Dict, Any, Iterable, Tuple, AsyncIterator
 import base64
 import logging
 from email.mime.text import MIMEText
@@ -20,8 +20,12 @@ import asyncio
 import uuid
 import time
 
-from app.api.mail.semantic_embedding import encode_texts, MODEL_NAME
+from app.api.mail.embedding_versions import target_version
+from app.api.mail.semantic_embedding import embedding_model_name
 from app.api.mail.vector_store import get_vector_store
+from app.utils.etag import build_etag
+from app.utils.single_flight import single_flight
+from app.utils.text_cleaner import clean_email_text, split_passages
 
 
 logger = logging.getLogger(__name__)
@@ -53,9 +57,19 @@ from app.api.mail.models import (
     MailSyncState,
     UserLabel,
     KanbanColumn,
-    SnoozeSchedule
+    SnoozeSchedule,
+    HybridSearchRequest
 )
-from app.api.agents.summarizer import Summarizer
+from app.api.mail.summary_service import SummaryService
+from app.api.mail.lexical_index import LexicalIndex
+from app.api.mail.fuzzy_index import TrigramIndex
+from app.api.mail.query_embedding_cache import embed_query
+from app.api.mail.embedding_cache import EmbeddingCache
+from app.api.mail.embedding_queue import EmbeddingQueue
+from app.api.mail.embedding_worker import EmbeddingWorker
+from app.api.mail.semantic_rebuild import SemanticRebuilder
+from app.api.mail.embedding_migration import EmbeddingMigrator, load_embedding_versions
+from app.api.mail.search_snapshots import SearchSnapshotStore, snapshot_id_for
 
 class MailService:
   def __init__(self, db: AsyncDatabase):
@@ -70,7 +84,14 @@ class MailService:
     self.labels_collection = self.db["labels"]
     self.kanban_columns_collection = self.db["kanban_columns"]
     self.snooze_schedules_collection = self.db["snooze_schedules"]
-    self._summarizer: Optional[Summarizer] = None
+    self.summary_service = SummaryService(db)
+    self.lexical_index = LexicalIndex(db)
+    self.fuzzy_index = TrigramIndex(db)
+    self.search_snapshots = SearchSnapshotStore(db)
+    self.embedding_cache = EmbeddingCache(db)
+    self.embedding_queue = EmbeddingQueue(db)
+    self.semantic_rebuilder = SemanticRebuilder(self)
+    self.embedding_migrator = EmbeddingMigrator(self)
 
     # Import and initialize sync service
     from app.api.mail.sync_service import EmailSyncService
@@ -79,11 +100,6 @@ class MailService:
     # Background sync queue collection
     self.sync_queue_collection = self.db["mail_sync_queue"]
 
-  def _get_summarizer(self) -> Summarizer:
-    if self._summarizer is None:
-      self._summarizer = Summarizer()
-    return self._summarizer
-
   async def _resolve_label_id(self, service, user_id: str, mailbox_id: Optional[str]) -> Optional[str]:
     if not mailbox_id:
       return None
@@ -127,7 +143,8 @@ class MailService:
 
   def _build_embedding_text(self, doc: Dict[str, Any]) -> str:
     subject = doc.get("subject") or ""
-    body = doc.get("body", "")
+    # Normalized text is much shorter than raw bodies (no markup, quoted history or signatures)
+    body = doc.get("clean_text") or clean_email_text(doc.get("body", ""))
     snippet = doc.get("snippet", "")
 
     # Use body from emails collection, fallback to snippet
@@ -161,6 +178,29 @@ class MailService:
       result = subject or email_content or ""
       return result
 
+  def _build_embedding_chunks(self, doc: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """
+    Split the embedding text of long emails into overlapping passages.
+
+    Returns:
+        (text to embed, passage) pairs; every text repeats the subject for context.
+        Short emails give a single pair identical to _build_embedding_text.
+    """
+    text = self._build_embedding_text(doc)
+    if not text.strip():
+      return []
+    subject = (doc.get("subject") or "").strip()
+    content = text[len(subject):].strip() if subject and text.startswith(subject) else text
+    passages = split_passages(
+      content,
+      settings.EMBEDDING_CHUNK_CHARS,
+      settings.EMBEDDING_CHUNK_OVERLAP_CHARS,
+      settings.EMBEDDING_MAX_CHUNKS
+    )
+    if len(passages) <= 1:
+      return [(text, content)]
+    return [(f"{subject}\n\n{passage}".strip(), passage) for passage in passages]
+
 
 
 
@@ -169,29 +209,16 @@ class MailService:
     """Smart sync that prioritizes recent emails and supports incremental updates."""
     return await self.sync_service.sync_email_index(user_id, mailbox_id, max_emails)
 
-  async def _upsert_embeddings_batch(self, user_id: str, docs: Iterable[Dict[str, Any]], vector_store) -> None:
-    docs_list = [d for d in docs if d.get("message_id")]
-    if not docs_list:
-      return
-
-    # Filter out docs that don't have meaningful content to embed
-    valid_docs = []
-    valid_texts = []
-    for doc in docs_list:
-      text = self._build_embedding_text(doc)
-      if text.strip():
-        valid_docs.append(doc)
-        valid_texts.append(text)
-
-    if not valid_docs:
-      return
-
-    embeddings = encode_texts(valid_texts)
-    now = datetime.utcnow().isoformat()
+  def _prepare_embedding_items(self, docs: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Build vector store items (one per chunk, no embedding yet) for the emails worth embedding.
+    Each item carries the text to embed under `text`.
+    """
     items: List[Dict[str, Any]] = []
-    
-    for doc, emb in zip(valid_docs, embeddings):
-      message_id = doc["message_id"]
+    for doc in docs:
+      message_id = doc.get("message_id")
+      if not message_id:
+        continue
       labels = doc.get("labels") or []
 
       # Skip draft emails
@@ -213,38 +240,76 @@ class MailService:
       else:
         email_content = ""
 
-      # Calculate word count and reading time
-      full_text = f"{subject}\n\n{email_content}".strip()
-      word_count = len(full_text.split())
-      reading_time = max(1, word_count // 200)  # Average reading speed: 200 words/min
-
       # Skip emails with too little content
-      if word_count < 2 or len(full_text.strip()) < 10:
+      full_text = f"{subject}\n\n{email_content}".strip()
+      if len(full_text.split()) < 2 or len(full_text) < 10:
         continue
 
-      # Check for attachments
-      has_attachments = doc.get("has_attachments", False)
-      attachments = doc.get("attachments", [])
-      attachment_types = []
-      if attachments and isinstance(attachments, list):
-        for att in attachments:
-          if isinstance(att, dict) and att.get("mime_type"):
-            attachment_types.append(att["mime_type"])
+      # Filter out docs that don't have meaningful content to embed
+      chunks = self._build_embedding_chunks(doc)
+      if not chunks:
+        continue
 
-      items.append(
-        {
-          "message_id": message_id,
-          "subject": doc.get("subject", ""),
-          "from_name": doc.get("from_name", ""),
-          "from_email": doc.get("from_email", ""),
-          "snippet": doc.get("snippet", ""),
-          "labels": labels if isinstance(labels, list) else [labels],
-          "embedding": emb,
-        }
-      )
-    
+      # One point per chunk; all chunks of a message are written together
+      for chunk_index, (text, passage) in enumerate(chunks):
+        items.append(
+          {
+            "message_id": message_id,
+            "thread_id": doc.get("thread_id", ""),
+            "subject": doc.get("subject", ""),
+            "from_name": doc.get("from_name", ""),
+            "from_email": doc.get("from_email", ""),
+            "snippet": doc.get("snippet", ""),
+            "labels": labels if isinstance(labels, list) else [labels],
+            "text": text,
+            "chunk_index": chunk_index,
+            "chunk_count": len(chunks),
+            "passage": passage[:settings.SEMANTIC_HIGHLIGHT_CHARS] if len(chunks) > 1 else "",
+          }
+        )
+    return items
+
+  async def _embed_items(self, items: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Replace each item's `text` with its `embedding`. Returns the embedding cache counters.
+    During a model migration the target model's vector is added as `target_embedding`.
+    """
+    texts = [item.pop("text") for item in items]
+    # Identical texts (newsletters, notifications) reuse a stored vector
+    embeddings, cache_stats = await self.embedding_cache.embed(texts)
+    for item, embedding in zip(items, embeddings):
+      item["embedding"] = embedding
+    target = target_version()
+    if target is not None:
+      target_embeddings, _ = await self.embedding_cache.embed(texts, target.provider)
+      for item, embedding in zip(items, target_embeddings):
+        item["target_embedding"] = embedding
+        item["target_collection"] = target.collection
+    return cache_stats
+
+  async def _store_embedded_items(self, user_id: str, items: List[Dict[str, Any]], vector_store) -> None:
     if items:
-      vector_store.upsert(user_id, items)
+      # Vector store clients are blocking
+      await asyncio.to_thread(vector_store.upsert, user_id, items)
+      # Dual-write while migrating; items embedded before a cutover or abort are skipped
+      target = target_version()
+      if target is not None:
+        target_items = [
+          {**item, "embedding": item["target_embedding"]}
+          for item in items if item.get("target_collection") == target.collection
+        ]
+        if target_items:
+          await asyncio.to_thread(get_vector_store(target).upsert, user_id, target_items)
+      await self._bump_embeddings_version(user_id)
+
+  async def _upsert_embeddings_batch(self, user_id: str, docs: Iterable[Dict[str, Any]], vector_store) -> Dict[str, int]:
+    """Embed and store a batch of one user's emails. Returns the embedding cache counters."""
+    items = self._prepare_embedding_items(docs)
+    if not items:
+      return {"texts": 0, "cache_hits": 0, "batch_duplicates": 0, "embedded": 0}
+    cache_stats = await self._embed_items(items)
+    await self._store_embedded_items(user_id, items, vector_store)
+    return cache_stats
 
   def _build_search_pipeline(self, query: str, user_id: str, mailbox_label_id: Optional[str], limit: int, page: int) -> List[dict]:
     skip = (page - 1) * limit
@@ -280,6 +345,13 @@ class MailService:
           "fuzzy": {"maxEdits": 1, "prefixLength": 3},
           "score": {"boost": {"value": 1}}
         }
+      },
+      {
+        "text": {
+          "path": "clean_text",
+          "query": query,
+          "score": {"boost": {"value": 1}}
+        }
       }
     ]
     search_stage = {
@@ -322,36 +394,92 @@ class MailService:
     ]
     return pipeline
 
+  async def _search_lexical_index(self, user_id: str, query: str, mailbox_label_id: Optional[str], page: int, limit: int) -> List[Dict[str, Any]]:
+    """Rank with the local inverted index (BM25) and hydrate the page from email_index in one query."""
+    if not await self.lexical_index.has_documents(user_id):
+      # Mailbox synced before the index existed and not rebuilt yet: keep the regex scan
+      return await self._search_regex(user_id, query, mailbox_label_id, limit)
+
+    ranked = await self.lexical_index.search(user_id, query, mailbox_label_id, limit, (page - 1) * limit)
+    if not ranked and page == 1:
+      # No term matched: likely a typo in a sender or subject
+      return await self._search_fuzzy(user_id, query, mailbox_label_id, limit)
+    message_ids = [message_id for message_id, _ in ranked]
+    docs = await self.email_index_collection.find(
+      {"user_id": user_id, "message_id": {"$in": message_ids}}
+    ).to_list(length=None)
+    docs_by_id = {doc["message_id"]: doc for doc in docs}
+    logger.info(f"[SEARCH] Local index returned {len(message_ids)} docs")
+    return [docs_by_id[message_id] for message_id in message_ids if message_id in docs_by_id]
+
+  async def _search_fuzzy(self, user_id: str, query: str, mailbox_label_id: Optional[str], limit: int) -> List[Dict[str, Any]]:
+    """Resolve the query to the closest sender/subject values, then return their newest emails."""
+    suggestions = await self.fuzzy_index.suggest(
+      user_id, query, limit=settings.FUZZY_SEARCH_MAX_VALUES, with_variants=True
+    )
+    if not suggestions:
+      return []
+
+    # Every display variant of the folded value, e.g. both "José" and "jose"
+    fuzzy_query: Dict[str, Any] = {
+      "user_id": user_id,
+      "$or": [{item["field"]: {"$in": item["variants"]}} for item in suggestions]
+    }
+    if mailbox_label_id:
+      fuzzy_query["labels"] = mailbox_label_id
+    docs = await self.email_index_collection.find(fuzzy_query).sort("received_on", -1).limit(limit).to_list(length=limit)
+    logger.info(f"[SEARCH] Fuzzy fallback matched {[item['value'] for item in suggestions]}, returned {len(docs)} docs")
+    return docs
+
+  async def suggest_search(self, user_id: str, query: str, limit: int) -> List[Dict[str, Any]]:
+    """Typo-tolerant autocomplete over senders and subjects."""
+    return await self.fuzzy_index.suggest(user_id, query, limit=limit)
+
+  async def rebuild_search_index(self, user_id: str) -> Dict[str, Any]:
+    """Rebuild the user's local search indexes (BM25 and trigram) from email_index."""
+    indexed = await self.lexical_index.rebuild_user(user_id, self.email_index_collection)
+    await self.fuzzy_index.rebuild_user(user_id, self.email_index_collection)
+    return {"user_id": user_id, "indexed": indexed}
+
+  async def _search_regex(self, user_id: str, query: str, mailbox_label_id: Optional[str], limit: int) -> List[Dict[str, Any]]:
+    fallback_filter = {"user_id": user_id}
+    if mailbox_label_id:
+      fallback_filter["labels"] = mailbox_label_id
+    regex = {"$regex": query, "$options": "i"}
+    fallback_query = {
+      "$or": [
+        {"subject": regex},
+        {"from_name": regex},
+        {"from_email": regex},
+        {"snippet": regex},
+        {"clean_text": regex}
+      ],
+      **fallback_filter
+    }
+    logger.info(f"[SEARCH] Fallback query: {fallback_query}")
+    docs = await self.email_index_collection.find(fallback_query).sort("received_on", -1).limit(limit).to_list(length=limit)
+    logger.info(f"[SEARCH] Fallback search returned {len(docs)} docs")
+    return docs
+
   async def search_emails(self, user_id: str, query: str, mailbox_id: Optional[str], page: int, limit: int):
     logger.info(f"[SEARCH] user_id={user_id}, query='{query}', mailbox_id={mailbox_id}, page={page}, limit={limit}")
     service = await self.get_gmail_service(user_id)
     mailbox_label_id = await self._resolve_label_id(service, user_id, mailbox_id)
-    pipeline = self._build_search_pipeline(query, user_id, mailbox_label_id, limit, page)
-    
-    logger.info(f"[SEARCH] Pipeline: {pipeline}")
-    
-    try:
-      cursor = await self.email_index_collection.aggregate(pipeline)
-      docs = await cursor.to_list(length=limit)
-      logger.info(f"[SEARCH] Atlas search returned {len(docs)} docs")
-    except Exception as e:
-      logger.warning(f"[SEARCH] Atlas search failed: {e}, falling back to regex search")
-      fallback_filter = {"user_id": user_id}
-      if mailbox_label_id:
-        fallback_filter["labels"] = mailbox_label_id
-      regex = {"$regex": query, "$options": "i"}
-      fallback_query = {
-        "$or": [
-          {"subject": regex},
-          {"from_name": regex},
-          {"from_email": regex},
-          {"snippet": regex}
-        ],
-        **fallback_filter
-      }
-      logger.info(f"[SEARCH] Fallback query: {fallback_query}")
-      docs = await self.email_index_collection.find(fallback_query).sort("received_on", -1).limit(limit).to_list(length=limit)
-      logger.info(f"[SEARCH] Fallback search returned {len(docs)} docs")
+
+    if settings.SEARCH_BACKEND == "local":
+      docs = await self._search_lexical_index(user_id, query, mailbox_label_id, page, limit)
+    else:
+      pipeline = self._build_search_pipeline(query, user_id, mailbox_label_id, limit, page)
+
+      logger.info(f"[SEARCH] Pipeline: {pipeline}")
+
+      try:
+        cursor = await self.email_index_collection.aggregate(pipeline)
+        docs = await cursor.to_list(length=limit)
+        logger.info(f"[SEARCH] Atlas search returned {len(docs)} docs")
+      except Exception as e:
+        logger.warning(f"[SEARCH] Atlas search failed: {e}, falling back to local index")
+        docs = await self._search_lexical_index(user_id, query, mailbox_label_id, page, limit)
     
     total_count = await self.email_index_collection.count_documents({"user_id": user_id})
     logger.info(f"[SEARCH] Total emails in index for user: {total_count}")
@@ -385,116 +513,360 @@ class MailService:
     logger.info(f"[SEARCH] Returning {len(results)} results")
     return results
 
-  async def search_emails_semantic(self, user_id: str, query: str, mailbox_id: Optional[str], page: int, limit: int):
-    logger.info(f"[SEMANTIC SEARCH] user_id={user_id}, query='{query}', mailbox_id={mailbox_id}, page={page}, limit={limit}")
+  async def _resolve_search_label(self, user_id: str, mailbox_id: Optional[str]) -> Optional[str]:
+    if not mailbox_id:
+      return None
+    try:
+      service = await self.get_gmail_service(user_id)
+      return await self._resolve_label_id(service, user_id, mailbox_id)
+    except Exception as e:
+      logger.warning(f"[SEMANTIC SEARCH] Failed to resolve mailbox label id: {e}")
+      return None
 
-    # Minimum similarity score threshold for relevance
-    SCORE_THRESHOLD = 0.6
+  def _index_doc_to_preview(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+    labels = doc.get("labels", [])
+    return {
+      "id": doc.get("message_id"),
+      "history_id": doc.get("history_id"),
+      "subject": doc.get("subject", "(No Subject)"),
+      "sender": {
+        "name": doc.get("from_name") or "",
+        "email": doc.get("from_email") or "",
+      },
+      "to": doc.get("to", []),
+      "received_on": doc.get("received_on") or "",
+      "unread": doc.get("unread", False),
+      "tags": [{"id": l, "name": l} for l in labels],
+      "body": doc.get("snippet", "")[:150],
+      "has_attachments": doc.get("has_attachments", False),
+    }
 
-    mailbox_label_id: Optional[str] = None
-    if mailbox_id:
-      try:
-        service = await self.get_gmail_service(user_id)
-        mailbox_label_id = await self._resolve_label_id(service, user_id, mailbox_id)
-      except Exception as e:
-        logger.warning(f"[SEMANTIC SEARCH] Failed to resolve mailbox label id: {e}")
-    query_embedding = encode_texts([query])[0]
+  async def _hydrate_previews(self, user_id: str, message_ids: List[str]) -> List[Dict[str, Any]]:
+    """Load previews for ranked message ids with a single $in query, keeping the rank order."""
+    if not message_ids:
+      return []
+    docs = await self.email_index_collection.find(
+      {"user_id": user_id, "message_id": {"$in": message_ids}}
+    ).to_list(length=len(message_ids))
+    doc_by_id = {d.get("message_id"): d for d in docs}
+    return [self._index_doc_to_preview(doc_by_id[m_id]) for m_id in message_ids if m_id in doc_by_id]
+
+  async def _semantic_candidates(
+    self,
+    user_id: str,
+    query: str,
+    mailbox_label_id: Optional[str],
+    top_k: int,
+    min_score: float
+  ) -> List[Tuple[str, float, Optional[str]]]:
+    """
+    Vector retrieval: (message_id, score, highlight) triples above `min_score`, best first, unique.
+    A message scores as its best chunk; highlight is that chunk's passage (long emails only).
+    """
+    await load_embedding_versions(self.db)
+    # Cached per normalized query, so paging costs no embedding call.
+    # The Qdrant client is blocking; keep it off the event loop
+    query_embedding = await embed_query(query, self.db)
     vector_store = get_vector_store()
-    top_k = page * limit + 10
-    scored = vector_store.query(user_id, query_embedding, top_k, mailbox_label_id)
+    # Chunks of one message compete for the same slots, so fetch extra points
+    point_limit = top_k * settings.SEMANTIC_CHUNK_OVERFETCH
+    scored = await asyncio.to_thread(vector_store.query, user_id, query_embedding, point_limit, mailbox_label_id)
 
     if not scored:
-      logger.info("[SEMANTIC SEARCH] No vectors found, attempting lazy rebuild from Mongo")
-      await self._rebuild_semantic_index_for_user(user_id)
-      scored = vector_store.query(user_id, query_embedding, top_k, mailbox_label_id)
-      if not scored:
-        logger.info("[SEMANTIC SEARCH] No vectors after rebuild, returning empty result")
-        return []
+      if await asyncio.to_thread(vector_store.count, user_id) == 0:
+        # Rebuilding inline would block this request for the whole mailbox; queue it instead
+        logger.info("[SEMANTIC SEARCH] No vectors found, requesting a background rebuild")
+        await single_flight("semantic_rebuild").do(user_id, lambda: self.semantic_rebuilder.request(user_id))
+      return []
 
     # Filter results by similarity score threshold
-    scored = [(m_id, score, label_id) for m_id, score, label_id in scored if score >= SCORE_THRESHOLD]
-    logger.info(f"[SEMANTIC SEARCH] Filtered to {len(scored)} results above threshold {SCORE_THRESHOLD}")
+    filtered = [(m_id, score, payload) for m_id, score, payload in scored if score >= min_score]
+    logger.info(f"[SEMANTIC SEARCH] Filtered to {len(filtered)} chunks above threshold {min_score}")
+    filtered.sort(key=lambda x: x[1], reverse=True)
+
+    seen: Set[str] = set()
+    unique: List[Tuple[str, float, Optional[str]]] = []
+    for m_id, score, payload in filtered:
+      if m_id not in seen:
+        seen.add(m_id)
+        unique.append((m_id, score, payload.get("passage") or None))
+    return unique[:top_k]
+
+  async def _lexical_candidates(self, user_id: str, query: str, mailbox_label_id: Optional[str], top_k: int) -> List[str]:
+    """Keyword retrieval: ranked message ids from Atlas $search or the local index."""
+    if settings.SEARCH_BACKEND != "local":
+      try:
+        pipeline = self._build_search_pipeline(query, user_id, mailbox_label_id, top_k, 1)
+        cursor = await self.email_index_collection.aggregate(pipeline)
+        docs = await cursor.to_list(length=top_k)
+        return [doc["message_id"] for doc in docs]
+      except Exception as e:
+        logger.warning(f"[SEARCH] Atlas search failed: {e}, falling back to local index")
+
+    if await self.lexical_index.has_documents(user_id):
+      ranked = await self.lexical_index.search(user_id, query, mailbox_label_id, top_k)
+      if ranked:
+        return [message_id for message_id, _ in ranked]
+    docs = await self._search_lexical_index(user_id, query, mailbox_label_id, 1, top_k)
+    return [doc["message_id"] for doc in docs]
+
+  async def search_emails_semantic(
+    self,
+    user_id: str,
+    query: str,
+    mailbox_id: Optional[str],
+    page: int,
+    limit: int,
+    cursor: Optional[str] = None
+  ) -> Tuple[List[Dict[str, Any]], str, bool]:
+    """
+    Semantic search served from a ranked-id snapshot.
+
+    The first request runs the vector query once to a fixed depth and stores the ranking;
+    later pages (same query, or the returned cursor) only hydrate their own slice.
+    While the user's index is being rebuilt, results come from the vectors stored so far,
+    topped up with keyword matches, and no snapshot is kept.
+
+    Returns:
+        (results, cursor, rebuilding) where cursor identifies the snapshot for later pages
+    """
+    logger.info(f"[SEMANTIC SEARCH] user_id={user_id}, query='{query}', mailbox_id={mailbox_id}, page={page}, limit={limit}")
 
-    if not scored:
-      logger.info(f"[SEMANTIC SEARCH] No results above threshold {SCORE_THRESHOLD}, returning empty result")
-      return []
+    # Minimum similarity score threshold for relevance
+    SCORE_THRESHOLD = 0.6
 
-    scored.sort(key=lambda x: x[1], reverse=True)
-      
-    message_ids = [m_id for m_id, _, _ in scored]
-    unique_ids = list(dict.fromkeys(message_ids))
-    cursor = self.email_index_collection.find(
-      {"user_id": user_id, "message_id": {"$in": unique_ids}}
-    )
-    docs = await cursor.to_list(length=len(unique_ids))
-    doc_by_id = {d.get("message_id"): d for d in docs}
-    ordered_docs = [doc_by_id[m_id] for m_id in unique_ids if m_id in doc_by_id]
+    await load_embedding_versions(self.db)
+    mailbox_label_id = await self._resolve_search_label(user_id, mailbox_id)
+    embeddings_version = await self._get_embeddings_version(user_id)
     start = (page - 1) * limit
     end = start + limit
-    page_docs = ordered_docs[start:end]
-    results = []
-    for doc in page_docs:
-      labels = doc.get("labels", [])
-      results.append(
-        {
-          "id": doc.get("message_id"),
-          "history_id": doc.get("history_id"),
-          "subject": doc.get("subject", "(No Subject)"),
-          "sender": {
-            "name": doc.get("from_name") or "",
-            "email": doc.get("from_email") or "",
-          },
-          "to": doc.get("to", []),
-          "received_on": doc.get("received_on") or "",
-          "unread": doc.get("unread", False),
-          "tags": [{"id": l, "name": l} for l in labels],
-          "body": doc.get("snippet", "")[:150],
-          "has_attachments": doc.get("has_attachments", False),
-        }
-      )
+
+    snapshot = None
+    rebuilding = False
+    if cursor:
+      snapshot = await self.search_snapshots.get(user_id, cursor)
+      if snapshot and snapshot.get("embeddings_version") != embeddings_version:
+        snapshot = None
+    snapshot_id = snapshot["_id"] if snapshot else snapshot_id_for(
+      user_id, query, mailbox_label_id, embedding_model_name(), embeddings_version, SCORE_THRESHOLD
+    )
+    if snapshot is None:
+      snapshot = await self.search_snapshots.get(user_id, snapshot_id)
+
+    if snapshot is not None and (end <= len(snapshot["message_ids"]) or len(snapshot["message_ids"]) < snapshot.get("depth", 0)):
+      message_ids = snapshot["message_ids"]
+      ranked_highlights = snapshot.get("highlights") or []
+      logger.info(f"[SEMANTIC SEARCH] Serving page {page} from snapshot {snapshot_id}")
+    else:
+      top_k = max(settings.SEMANTIC_SNAPSHOT_SIZE, end + 10)
+      scored = await self._semantic_candidates(user_id, query, mailbox_label_id, top_k, SCORE_THRESHOLD)
+      message_ids = [m_id for m_id, _, _ in scored]
+      ranked_highlights = [highlight for _, _, highlight in scored]
+      rebuilding = await self.semantic_rebuilder.is_rebuilding(user_id)
+      if rebuilding:
+        # Partial index: fill the page with keyword matches rather than waiting for the rebuild
+        if len(message_ids) < end:
+          seen = set(message_ids)
+          lexical_ids = await self._lexical_candidates(user_id, query, mailbox_label_id, end)
+          extra = [m_id for m_id in lexical_ids if m_id not in seen]
+          message_ids += extra
+          ranked_highlights += [None] * len(extra)
+        logger.info(f"[SEMANTIC SEARCH] Index rebuild in progress, returning partial results ({len(scored)} semantic)")
+      else:
+        await self.search_snapshots.save(
+          user_id, snapshot_id, message_ids, [score for _, score, _ in scored], embeddings_version, top_k,
+          highlights=ranked_highlights
+        )
+
+    if not message_ids:
+      logger.info(f"[SEMANTIC SEARCH] No results above threshold {SCORE_THRESHOLD}, returning empty result")
+      return [], snapshot_id, rebuilding
+
+    highlights = dict(zip(message_ids, ranked_highlights))
+    results = await self._hydrate_previews(user_id, message_ids[start:end])
+    for result in results:
+      result["highlight"] = highlights.get(result["id"])
     logger.info(f"[SEMANTIC SEARCH] Returning {len(results)} results")
+    return results, snapshot_id, rebuilding
+
+  async def get_related_emails(self, user_id: str, email_id: str, limit: int) -> List[Dict[str, Any]]:
+    """
+    Emails similar to `email_id`, ranked by its stored vector (no embedding call),
+    excluding its own thread. Rankings are cached per message until new embeddings land.
+
+    Raises:
+        ValueError: the email has no stored vector yet
+    """
+    await load_embedding_versions(self.db)
+    embeddings_version = await self._get_embeddings_version(user_id)
+    cache_id = snapshot_id_for(
+      user_id, f"related:{email_id}", None, embedding_model_name(), embeddings_version, settings.RELATED_EMAILS_MIN_SCORE
+    )
+    snapshot = await self.search_snapshots.get(user_id, cache_id)
+
+    if snapshot is not None and (limit <= len(snapshot["message_ids"]) or len(snapshot["message_ids"]) < snapshot.get("depth", 0)):
+      message_ids = snapshot["message_ids"]
+      ranked_highlights = snapshot.get("highlights") or []
+      logger.info(f"[RELATED] Serving {email_id} from cache")
+    else:
+      vector_store = get_vector_store()
+      stored = await asyncio.to_thread(vector_store.message_vector, user_id, email_id)
+      if stored is None:
+        raise ValueError(f"Email {email_id} has not been embedded yet")
+      vector, payload = stored
+      thread_id = payload.get("thread_id")
+      if not thread_id:
+        # Vectors written before payloads carried the thread
+        doc = await self.email_index_collection.find_one({"user_id": user_id, "message_id": email_id}, {"thread_id": 1})
+        thread_id = (doc or {}).get("thread_id")
+
+      depth = max(settings.RELATED_EMAILS_DEPTH, limit)
+      scored = await asyncio.to_thread(
+        vector_store.query, user_id, vector, depth * settings.SEMANTIC_CHUNK_OVERFETCH, None, email_id, thread_id
+      )
+      best: Dict[str, Tuple[float, Optional[str]]] = {}
+      for m_id, score, point_payload in scored:
+        if score >= settings.RELATED_EMAILS_MIN_SCORE and m_id not in best:
+          best[m_id] = (score, point_payload.get("passage") or None)
+
+      if thread_id and best:
+        # Older points have no thread_id payload, so the store filter cannot drop them
+        same_thread = await self.email_index_collection.find(
+          {"user_id": user_id, "message_id": {"$in": list(best)}, "thread_id": thread_id},
+          {"message_id": 1}
+        ).to_list(length=None)
+        for doc in same_thread:
+          best.pop(doc["message_id"], None)
+
+      ranked = sorted(best.items(), key=lambda entry: entry[1][0], reverse=True)[:depth]
+      message_ids = [m_id for m_id, _ in ranked]
+      ranked_highlights = [highlight for _, (_, highlight) in ranked]
+      await self.search_snapshots.save(
+        user_id, cache_id, message_ids, [score for _, (score, _) in ranked], embeddings_version, depth,
+        highlights=ranked_highlights, ttl_seconds=settings.RELATED_EMAILS_CACHE_TTL_SECONDS
+      )
+
+    highlights = dict(zip(message_ids, ranked_highlights))
+    results = await self._hydrate_previews(user_id, message_ids[:limit])
+    for result in results:
+      result["highlight"] = highlights.get(result["id"])
+    logger.info(f"[RELATED] Returning {len(results)} emails related to {email_id}")
     return results
 
-  async def _rebuild_semantic_index_for_user(self, user_id: str, mailbox_id: Optional[str] = None) -> None:
+  async def search_emails_hybrid(self, user_id: str, request: HybridSearchRequest) -> Dict[str, Any]:
+    """
+    Run lexical and semantic retrieval concurrently and fuse them with reciprocal rank fusion:
+    score(d) = sum over retrievers of weight / (rrf_k + rank(d)).
+    """
+    started = time.perf_counter()
+    timings: Dict[str, float] = {}
+    degraded = False
+    rebuilding = False
+    logger.info(f"[HYBRID SEARCH] user_id={user_id}, query='{request.query}', mode={request.mode}, candidates={request.candidates}")
+
+    mailbox_label_id = await self._resolve_search_label(user_id, request.mailbox_id)
+    timings["resolve_ms"] = (time.perf_counter() - started) * 1000
+    top_k = max(request.candidates, request.page * request.limit)
+
+    async def timed(name: str, coro):
+      stage_started = time.perf_counter()
+      try:
+        return await coro
+      finally:
+        timings[name] = (time.perf_counter() - stage_started) * 1000
+
+    lexical_task = None
+    semantic_task = None
+    if request.mode in ("hybrid", "lexical"):
+      lexical_task = asyncio.create_task(timed(
+        "lexical_ms", self._lexical_candidates(user_id, request.query, mailbox_label_id, top_k)
+      ))
+    if request.mode in ("hybrid", "semantic"):
+      semantic = self._semantic_candidates(user_id, request.query, mailbox_label_id, top_k, request.min_semantic_score)
+      if request.semantic_timeout_ms:
+        semantic = asyncio.wait_for(semantic, timeout=request.semantic_timeout_ms / 1000)
+      semantic_task = asyncio.create_task(timed("semantic_ms", semantic))
+
+    lexical_ids: List[str] = []
+    semantic_ids: List[str] = []
+    highlights: Dict[str, Optional[str]] = {}
+    if lexical_task:
+      try:
+        lexical_ids = await lexical_task
+      except Exception as e:
+        degraded = True
+        logger.warning(f"[HYBRID SEARCH] Lexical retrieval failed: {e}")
+    if semantic_task:
+      try:
+        semantic_scored = await semantic_task
+        semantic_ids = [m_id for m_id, _, _ in semantic_scored]
+        highlights = {m_id: highlight for m_id, _, highlight in semantic_scored}
+      except asyncio.TimeoutError:
+        degraded = True
+        logger.info(f"[HYBRID SEARCH] Semantic retrieval exceeded {request.semantic_timeout_ms}ms, using lexical results only")
+      except Exception as e:
+        degraded = True
+        logger.warning(f"[HYBRID SEARCH] Semantic retrieval failed: {e}")
+      rebuilding = await self.semantic_rebuilder.is_rebuilding(user_id)
+
+    fusion_started = time.perf_counter()
+    fused: Dict[str, float] = {}
+    for ranked_ids, weight in ((lexical_ids, request.lexical_weight), (semantic_ids, request.semantic_weight)):
+      for rank, m_id in enumerate(ranked_ids, 1):
+        fused[m_id] = fused.get(m_id, 0.0) + weight / (request.rrf_k + rank)
+    ordered = sorted(fused, key=fused.get, reverse=True)
+    start = (request.page - 1) * request.limit
+    page_ids = ordered[start:start + request.limit]
+    timings["fusion_ms"] = (time.perf_counter() - fusion_started) * 1000
+
+    hydrate_started = time.perf_counter()
+    results = await self._hydrate_previews(user_id, page_ids)
+    for result in results:
+      result["highlight"] = highlights.get(result["id"])
+    timings["hydrate_ms"] = (time.perf_counter() - hydrate_started) * 1000
+    timings["total_ms"] = (time.perf_counter() - started) * 1000
+
+    logger.info(f"[HYBRID SEARCH] lexical={len(lexical_ids)} semantic={len(semantic_ids)} fused={len(fused)} returned={len(results)} total={timings['total_ms']:.1f}ms")
+    return {
+      "results": results,
+      "timings": {name: round(value, 2) for name, value in timings.items()},
+      "sources": {"lexical": len(lexical_ids), "semantic": len(semantic_ids)},
+      "degraded": degraded,
+      "rebuilding": rebuilding,
+    }
+
+  async def request_semantic_rebuild(self, user_id: str, force: bool = False) -> Dict[str, Any]:
+    """Queue a background rebuild of the user's vectors (resumes a failed one unless `force`)."""
+    return await self.semantic_rebuilder.request(user_id, force=force)
+
+  async def start_embedding_migration(self, provider: str) -> Dict[str, Any]:
+    """Start migrating all vectors to another embedding provider/model (dual-write + background re-embed)."""
+    return await self.embedding_migrator.start(provider)
+
+  async def get_embedding_migration_status(self) -> Dict[str, Any]:
+    return await self.embedding_migrator.status()
+
+  async def cutover_embedding_migration(self, force: bool = False) -> Dict[str, Any]:
+    return await self.embedding_migrator.cutover(force=force)
+
+  async def abort_embedding_migration(self) -> Dict[str, Any]:
+    return await self.embedding_migrator.abort()
+
+  async def get_semantic_rebuild_status(self, user_id: str) -> Dict[str, Any]:
+    """Rebuild job state and progress, plus the vectors stored so far."""
+    status = await self.semantic_rebuilder.status(user_id)
     vector_store = get_vector_store()
-    if vector_store.count(user_id) > 0:
-      return
-    
-    filter_query: Dict[str, Any] = {"user_id": user_id}
-    if mailbox_id:
-      # Check if this is a kanban label (stored in DB labels collection)
-      db_label = await self.labels_collection.find_one({
-        "user_id": user_id,
-        "name": mailbox_id
-      })
+    status["vectors"] = await asyncio.to_thread(vector_store.count, user_id)
+    return status
 
-      if db_label:
-        # This is a kanban label, query by DB label ID
-        filter_query["labels"] = {"$in": [db_label['label_id']]}
-      else:
-        # This is a Gmail system label, resolve Gmail label ID
-        service = await self.get_gmail_service(user_id)
-        gmail_label_id = await self._resolve_label_id(service, user_id, mailbox_id)
-        if gmail_label_id:
-          filter_query["labels"] = {"$in": [gmail_label_id]}
-      
-    logger.info(f"[SEMANTIC REBUILD] Generating embeddings for user {user_id} from emails...")
-    # Find emails that exist in both collections and are marked as embedded
-    embedded_message_ids = await self.email_index_collection.distinct(
-        "message_id",
-        {"is_embedded": True, **filter_query}
-    )
-    email_cursor = self.emails_collection.find({
-        "message_id": {"$in": embedded_message_ids}
-    })
-    batch_docs = []
-    async for doc in email_cursor:
-      batch_docs.append(doc)
-      if len(batch_docs) >= 50:
-        await self._upsert_embeddings_batch(user_id, batch_docs, vector_store)
-        batch_docs = []
-    if batch_docs:
-      await self._upsert_embeddings_batch(user_id, batch_docs, vector_store)
+  async def dedupe_semantic_index(self, user_id: str) -> Dict[str, Any]:
+    """Collapse duplicate vectors of the user's messages into one per message."""
+    vector_store = get_vector_store()
+    result = await asyncio.to_thread(vector_store.dedupe, user_id)
+    if result["deleted"]:
+      await self._bump_embeddings_version(user_id)
+    logger.info(f"[SEMANTIC DEDUPE] User {user_id}: {result}")
+    return {"user_id": user_id, **result}
 
   async def sync_all_users(self, mailbox_id: Optional[str] = None):
     """Sync all users with Gmail tokens."""
@@ -578,11 +950,11 @@ class MailService:
       else:
         # Fallback to Gmail API and sync to DB
         logger.warning("No labels found in DB, falling back to Gmail API")
-        return await self._get_mailboxes_fallback(user_id)
+        return await single_flight("gmail_mailboxes_fallback").do(user_id, lambda: self._get_mailboxes_fallback(user_id))
 
     except Exception as e:
       logger.warning(f"DB query failed for get_mailboxes, falling back to Gmail API: {e}")
-      return await self._get_mailboxes_fallback(user_id)
+      return await single_flight("gmail_mailboxes_fallback").do(user_id, lambda: self._get_mailboxes_fallback(user_id))
 
   async def _get_mailboxes_fallback(self, user_id: str):
     """Fallback implementation using Gmail API - only sync important labels."""
@@ -721,12 +1093,6 @@ class MailService:
 
         processed_html = body_html or f"<pre>{body_text}</pre>"
         preview_body = body_text or body_html
-        summary_text = None
-        if summarize and preview_body:
-          try:
-            summary_text = await self._get_summarizer().summarize(preview_body)
-          except Exception as e:
-            logger.warning(f"Summarize draft failed for {draft_id}: {e}")
 
         has_attachments = self._has_attachments(payload)
 
@@ -740,13 +1106,16 @@ class MailService:
           "unread": False,  # Drafts are never unread
           "tags": [{"id": "DRAFT", "name": "DRAFT"}],
           "body": preview_body,
-          "summary": summary_text,
+          "summary": None,
           "has_attachments": has_attachments
         })
       except Exception as e:
         logger.error(f"Error processing draft {draft_item.get('id')}: {e}")
         continue
 
+    if summarize:
+      await self._attach_summaries(user_id, thread_list)
+
     return {
       "threads": thread_list,
       "next_page_token": next_page_token,
@@ -768,10 +1137,7 @@ class MailService:
       parsed.thread_id = message.get('threadId', message.get('id'))
 
       if summarize and parsed.body:
-        try:
-          parsed.summary = await self._get_summarizer().summarize(parsed.body)
-        except Exception as e:
-          logger.warning(f"Summarize draft detail failed for {draft_id}: {e}")
+        parsed.summary = await self.summary_service.get_summary(user_id, parsed.id, parsed.body)
 
       return {
         "messages": [parsed],
@@ -835,6 +1201,74 @@ class MailService:
     
     return bool(payload.get('filename'))
 
+  async def _attach_summaries(self, user_id: str, thread_list: List[Dict[str, Any]]) -> None:
+    """Fill the summary of each preview from the summary store (partial if generation is slow)."""
+    summaries = await self.summary_service.get_summaries(
+      user_id, {thread["id"]: thread.get("body", "") for thread in thread_list}
+    )
+    for thread in thread_list:
+      thread["summary"] = summaries.get(thread["id"])
+
+  async def _bump_mail_version(self, user_id: str) -> None:
+    """Invalidate mailbox page ETags after a local change to the user's emails."""
+    await self.sync_state_collection.update_one(
+      {"user_id": user_id},
+      {"$inc": {"mail_version": 1}},
+      upsert=True
+    )
+
+  async def _bump_embeddings_version(self, user_id: str) -> None:
+    """New vectors change semantic rankings: retire the user's result snapshots."""
+    await self.sync_state_collection.update_one(
+      {"user_id": user_id},
+      {"$inc": {"embeddings_version": 1}},
+      upsert=True
+    )
+    await self.search_snapshots.invalidate_user(user_id)
+
+  async def _get_embeddings_version(self, user_id: str) -> int:
+    state = await self.sync_state_collection.find_one({"user_id": user_id}, {"embeddings_version": 1})
+    return (state or {}).get("embeddings_version", 0)
+
+  async def get_mailbox_etag(self, user_id: str, mailbox_id: str, page_token: str = None, limit: int = 50) -> Optional[str]:
+    """Build the ETag for a mailbox page from the user's sync state (one indexed lookup)."""
+    # Drafts are served live from Gmail and carry no local version
+    if mailbox_id.lower() == 'drafts':
+      return None
+
+    state = await self.sync_state_collection.find_one(
+      {"user_id": user_id},
+      {"history_id": 1, "mail_version": 1}
+    )
+    if not state:
+      return None
+
+    return build_etag(
+      "mailbox", user_id, mailbox_id, page_token or "", limit,
+      state.get("history_id"), state.get("mail_version", 0)
+    )
+
+  async def get_email_detail_etag(self, user_id: str, email_id: str) -> Optional[str]:
+    """Build the ETag for a thread from the history IDs and update times of its messages."""
+    email_doc = await self.emails_collection.find_one(
+      {"user_id": user_id, "message_id": email_id},
+      {"thread_id": 1, "labels": 1}
+    )
+    # Drafts and messages missing from DB are served from Gmail directly
+    if not email_doc or 'DRAFT' in email_doc.get('labels', []):
+      return None
+
+    thread_id = email_doc["thread_id"]
+    versions = await self.emails_collection.find(
+      {"user_id": user_id, "thread_id": thread_id},
+      {"_id": 0, "message_id": 1, "history_id": 1, "updated_at": 1}
+    ).sort("received_on", 1).to_list(length=None)
+
+    return build_etag(
+      "thread", user_id, thread_id,
+      *(f"{v.get('message_id')}:{v.get('history_id')}:{v.get('updated_at')}" for v in versions)
+    )
+
   async def get_emails(self, user_id: str, mailbox_id: str, page_token: str = None, limit: int = 50, summarize: bool = False):
     """Get emails from DB first, fallback to Gmail API if needed. Drafts use Gmail API only."""
     # Special handling for drafts - use Gmail API directly
@@ -875,16 +1309,16 @@ class MailService:
       # Get total count for result_size_estimate
       total_count = await self.emails_collection.count_documents(query)
 
+      # One cached-summary lookup for the page, missing ones generated concurrently
+      summaries: Dict[str, str] = {}
+      if summarize:
+        summaries = await self.summary_service.get_summaries(
+          user_id, {doc["message_id"]: doc.get("clean_text") or doc.get("body", "") for doc in email_docs}
+        )
+
       thread_list = []
       for doc in email_docs:
         # Convert EmailDocument to ThreadPreview format
-        summary_text = None
-        if summarize and doc.get("body"):
-          try:
-            summary_text = await self._get_summarizer().summarize(doc.get("body", ""))
-          except Exception as e:
-            logger.warning(f"Summarize failed for {doc.get('message_id')}: {e}")
-
         # --- [START CHANGE] ---
         # Logic đồng nhất: Nếu trong labels (hệ thống) có STARRED, 
         # hãy đảm bảo nó xuất hiện trong tags gửi về frontend
@@ -912,7 +1346,7 @@ class MailService:
           "unread": doc.get("unread", False),
           "tags": display_tags, # Sử dụng biến đã xử lý
           "body": doc.get("snippet", ""),
-          "summary": summary_text,
+          "summary": summaries.get(doc["message_id"]),
           "has_attachments": doc.get("has_attachments", False)
         })
 
@@ -930,7 +1364,10 @@ class MailService:
     except Exception as e:
       logger.warning(f"DB query failed for get_emails, falling back to Gmail API: {e}")
       # Fallback to original Gmail API implementation
-      return await self._get_emails_fallback(user_id, mailbox_id, page_token, limit, summarize)
+      return await single_flight("gmail_emails_fallback").do(
+        f"{user_id}:{mailbox_id}:{page_token}:{limit}:{summarize}",
+        lambda: self._get_emails_fallback(user_id, mailbox_id, page_token, limit, summarize)
+      )
 
   async def _get_emails_fallback(self, user_id: str, mailbox_id: str, page_token: str = None, limit: int = 50, summarize: bool = False):
     """Fallback implementation using Gmail API directly."""
@@ -1022,12 +1459,6 @@ class MailService:
           received_on = datetime.fromtimestamp(int(internal_date)/1000).isoformat() if internal_date else ""
 
           preview_body = msg_data.get('snippet', '')
-          summary_text = None
-          if summarize:
-              try:
-                  summary_text = await self._get_summarizer().summarize(preview_body)
-              except Exception as e:
-                  logger.warning(f"Summarize preview failed for {msg.get('id')}: {e}")
 
           has_attachments = self._has_attachments(payload)
 
@@ -1041,13 +1472,16 @@ class MailService:
             "unread": "UNREAD" in msg_data.get('labelIds', []),
             "tags": [{"id": l, "name": l} for l in msg_data.get('labelIds', [])],
             "body": preview_body,
-            "summary": summary_text,
+            "summary": None,
             "has_attachments": has_attachments
           })
       except Exception as e:
           logger.error(f"Error processing message {msg.get('id')}: {e}")
           continue
 
+    if summarize:
+      await self._attach_summaries(user_id, thread_list)
+
     return {
       "threads": thread_list,
       "next_page_token": next_page_token,
@@ -1084,15 +1518,14 @@ class MailService:
 
       if thread_docs:
         # Convert DB documents to ParsedMessage format
-        parsed_messages = []
-        for doc in thread_docs:
-          parsed = self._convert_email_doc_to_parsed_message(doc)
-          if summarize:
-            try:
-              parsed.summary = await self._get_summarizer().summarize(parsed.body)
-            except Exception as e:
-              logger.warning(f"Summarize detail failed for {doc.get('message_id')}: {e}")
-          parsed_messages.append(parsed)
+        parsed_messages = [self._convert_email_doc_to_parsed_message(doc) for doc in thread_docs]
+
+        if summarize:
+          summaries = await self.summary_service.get_summaries(
+            user_id, {doc["message_id"]: doc.get("clean_text") or doc.get("body", "") for doc in thread_docs}
+          )
+          for parsed in parsed_messages:
+            parsed.summary = summaries.get(parsed.id)
 
         latest = parsed_messages[-1] if parsed_messages else None
 
@@ -1107,11 +1540,11 @@ class MailService:
       else:
         # Fallback to Gmail API if no documents found in DB
         logger.warning(f"Thread {thread_id} not found in DB, falling back to Gmail API")
-        return await self._get_email_detail_fallback(user_id, email_id, summarize)
+        return await self._get_email_detail_fallback_once(user_id, email_id, summarize)
 
     except Exception as e:
       logger.warning(f"DB query failed for get_email_detail, falling back to Gmail API: {e}")
-      return await self._get_email_detail_fallback(user_id, email_id, summarize)
+      return await self._get_email_detail_fallback_once(user_id, email_id, summarize)
 
   def _convert_email_doc_to_parsed_message(self, email_doc: dict) -> ParsedMessage:
     """Convert EmailDocument dict to ParsedMessage format."""
@@ -1139,6 +1572,13 @@ class MailService:
       in_reply_to=email_doc.get("in_reply_to")
     )
 
+  async def _get_email_detail_fallback_once(self, user_id: str, email_id: str, summarize: bool = False) -> ThreadDetailResponse:
+    """Gmail detail fallback shared by concurrent requests for the same thread."""
+    return await single_flight("gmail_detail_fallback").do(
+      f"{user_id}:{email_id}:{summarize}",
+      lambda: self._get_email_detail_fallback(user_id, email_id, summarize)
+    )
+
   async def _get_email_detail_fallback(self, user_id: str, email_id: str, summarize: bool = False) -> ThreadDetailResponse:
     """Fallback implementation using Gmail API directly."""
     service = await self.get_gmail_service(user_id)
@@ -1152,15 +1592,14 @@ class MailService:
     thread_data = service.users().threads().get(userId='me', id=thread_id, format='full').execute()
     messages = thread_data.get('messages', [])
 
-    parsed_messages = []
-    for msg in messages:
-        parsed = self._parse_gmail_message(msg)
-        if summarize:
-            try:
-                parsed.summary = await self._get_summarizer().summarize(parsed.body)
-            except Exception as e:
-                logger.warning(f"Summarize detail failed for {msg.get('id')}: {e}")
-        parsed_messages.append(parsed)
+    parsed_messages = [self._parse_gmail_message(msg) for msg in messages]
+
+    if summarize:
+        summaries = await self.summary_service.get_summaries(
+            user_id, {parsed['id']: parsed['body'] for parsed in parsed_messages}
+        )
+        for parsed in parsed_messages:
+            parsed['summary'] = summaries.get(parsed['id'])
 
     parsed_messages.sort(key=lambda x: x.received_on)
 
@@ -1719,6 +2158,8 @@ class MailService:
               # If draft existed in DB, remove it
               if email_doc:
                   await self.emails_collection.delete_one({"user_id": user_id, "message_id": email_id})
+                  await self.lexical_index.remove_email(user_id, email_id)
+                  await self._bump_mail_version(user_id)
               return {"message": "Draft deleted successfully"}
           except Exception:
               # Not a draft, handle as regular email
@@ -1771,6 +2212,9 @@ class MailService:
               {"$set": db_updates}
           )
           logger.info(f"[MODIFY EMAIL] Updated email {email_id} in DB: {db_updates}")
+          if 'labels' in db_updates:
+              await self.lexical_index.update_labels(user_id, email_id, new_labels)
+          await self._bump_mail_version(user_id)
 
           # Sync changes with Gmail API based on mode
           if settings.MAIL_SYNC_MODE == "background":
@@ -2331,7 +2775,8 @@ class MailService:
       logger.info(f"[Attachment] Returning result - filename: {result['filename']}, mime_type: {result['mime_type']}, data_size: {len(result['data'])}")
       return result
 
-  async def summarize_email(self, user_id: str, email_id: str) -> dict:
+  async def _get_summary_source(self, user_id: str, email_id: str) -> Tuple[str, str]:
+      """Return (message_id, body) of the latest message of the thread to summarize."""
       detail = await self.get_email_detail(user_id, email_id, summarize=False)
       latest = detail.get("latest") if isinstance(detail, dict) else detail.latest  # detail is dict-like
 
@@ -2341,14 +2786,29 @@ class MailService:
       else:
           body = getattr(latest, "body", "") or getattr(latest, "decoded_body", "") or ""
 
-      summary_text = ""
-      try:
-          summary_text = await self._get_summarizer().summarize(body)
-      except Exception as e:
-          logger.warning(f"Summarize single email failed for {email_id}: {e}")
-          summary_text = ""
+      message_id = latest.get("id") if isinstance(latest, dict) else getattr(latest, "id", None)
+      return message_id or email_id, body
 
-      return {"email_id": email_id, "summary": summary_text}
+  async def summarize_email(self, user_id: str, email_id: str) -> dict:
+      message_id, body = await self._get_summary_source(user_id, email_id)
+      summary_text = await self.summary_service.get_summary(
+          user_id, message_id, body, timeout=settings.SUMMARY_SINGLE_TIMEOUT_SECONDS
+      )
+
+      return {"email_id": email_id, "summary": summary_text or ""}
+
+  async def stream_email_summary(self, user_id: str, email_id: str) -> AsyncIterator[bytes]:
+      """
+      Resolve the email and its stored summary up front, then return an SSE event stream.
+      Raises ValueError before streaming starts if the email has nothing to summarize.
+      """
+      message_id, body = await self._get_summary_source(user_id, email_id)
+      body = clean_email_text(body)
+      if not body:
+          raise ValueError("Email has no content to summarize")
+
+      cached = await self.summary_service.get_cached_summaries(user_id, {message_id: body})
+      return self.summary_service.stream_summary(user_id, message_id, body, cached.get(message_id))
 
   async def _get_or_create_label_id(self, service, user_id: str, label_name: str) -> str:
       SYSTEM_LABELS = {'INBOX': 'INBOX', 'TRASH': 'TRASH', 'SPAM': 'SPAM', 'UNREAD': 'UNREAD', 'STARRED': 'STARRED', 'SNOOZED': 'SNOOZED'}
@@ -2421,6 +2881,7 @@ class MailService:
         {"user_id": user_id, "message_id": email_id},
         {"$set": {"labels": new_labels, "updated_at": now_utc.isoformat()}}
     )
+    await self.lexical_index.update_labels(user_id, email_id, new_labels)
 
     # Create snooze schedule record
     await self.snooze_schedules_collection.update_one(
@@ -2438,6 +2899,7 @@ class MailService:
         },
         upsert=True
     )
+    await self._bump_mail_version(user_id)
 
     return {"message": f"Email snoozed until {snooze_until_utc.isoformat()}"}
 
@@ -2472,6 +2934,9 @@ class MailService:
                     }
                 }
             )
+            await self.lexical_index.update_labels(user_id, email_id, labels_to_restore)
+
+            await self._bump_mail_version(user_id)
 
             # Mark snooze schedule as processed
             await self.snooze_schedules_collection.update_one(
@@ -2498,72 +2963,16 @@ class MailService:
             )
 
   async def process_embedding_queue(self):
+    """Claim one fair batch from the embedding queue and run it through the embedding pipeline."""
     try:
-      batch_size = settings.EMBEDDING_BATCH_SIZE
-
-      # Find message_ids from email_index that are not embedded yet
-      unembedded_message_ids = await self.email_index_collection.distinct(
-        "message_id",
-        {"is_embedded": {"$ne": True}}
-      )
-
-      if not unembedded_message_ids:
-        return
-
-      # Limit to batch_size and sort by received_on
-      unembedded_cursor = self.email_index_collection.find(
-        {"message_id": {"$in": unembedded_message_ids}},
-        limit=batch_size
-      ).sort("received_on", -1)
-
-      unembedded_docs = await unembedded_cursor.to_list(length=batch_size)
-      message_ids_to_process = [doc["message_id"] for doc in unembedded_docs]
-
-      # Get full email data from emails_collection
-      email_cursor = self.emails_collection.find({
-        "message_id": {"$in": message_ids_to_process}
-      })
-
-      docs = await email_cursor.to_list(length=len(message_ids_to_process))
-
-      if not docs:
-        return
-
-      logger.info(f"Processing embedding for {len(docs)} emails")
-
-      # Group by user_id
-      docs_by_user = {}
-      for doc in docs:
-        uid = doc["user_id"]
-        if uid not in docs_by_user:
-          docs_by_user[uid] = []
-        docs_by_user[uid].append(doc)
-
-      vector_store = get_vector_store()
-      successfully_embedded_ids = []
-
-      for uid, user_docs in docs_by_user.items():
-        try:
-          await self._upsert_embeddings_batch(uid, user_docs, vector_store)
-          # Only mark as embedded if upsert succeeded
-          for doc in user_docs:
-            successfully_embedded_ids.append(doc["message_id"])
-        except Exception as e:
-          logger.error(f"Failed to embed batch for user {uid}: {e}")
-          # Don't mark failed batches as embedded
-
-      # Update is_embedded flag ONLY for successfully embedded emails
-      if successfully_embedded_ids:
-        await self.email_index_collection.update_many(
-          {"message_id": {"$in": successfully_embedded_ids}},
-          {"$set": {"is_embedded": True}}
-        )
-
-        logger.info(f"Successfully embedded {len(successfully_embedded_ids)} emails")
-
+      await EmbeddingWorker(self).drain(max_claims=1)
     except Exception as e:
       logger.error(f"Error in process_embedding_queue: {e}")
 
+  async def get_embedding_queue_status(self, user_id: str) -> Dict[str, Any]:
+    """Pending/processing/failed embedding work and lag for the user, plus queue totals."""
+    return await self.embedding_queue.lag(user_id)
+
   async def run_sync_loop(self):
     """Run the periodic email sync loop for all users."""
     import asyncio
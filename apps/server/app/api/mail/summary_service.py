@@ -0,0 +1,453 @@
+"""
+Email summary service.
+
+Handles AI summaries for list and detail views:
+- Stored summaries keyed by user, message and content hash (`email_summaries`)
+- One batch lookup per page
+- Concurrent generation of missing summaries under a shared, rate-limit-aware semaphore
+- Short emails packed several per LLM call, since requests per minute is the binding quota
+- Token streaming for single summaries (Server-Sent Events)
+- Background pre-summarization of recent emails within the Gemini RPM budget
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import orjson
+from pymongo import AsyncMongoClient
+from pymongo.asynchronous.database import AsyncDatabase
+
+from app.api.agents.summarizer import Summarizer, MAX_INPUT_CHARS
+from app.config import settings
+from app.utils.rate_limiter import gemini_rate_limiter
+from app.utils.text_cleaner import clean_email_text
+
+
+logger = logging.getLogger(__name__)
+
+# Shared by every request in the process so concurrent pages cannot multiply Gemini calls
+_generation_semaphore = asyncio.Semaphore(settings.SUMMARY_CONCURRENCY)
+
+RATE_LIMIT_PATTERNS = ("429", "resource_exhausted", "resource exhausted", "quota", "rate limit")
+
+SUMMARIZE_JOB_STATE_ID = "summarize_job"
+SUMMARIZE_MAX_ATTEMPTS = 3
+
+
+def summary_content_hash(text: str) -> str:
+    """Hash of the exact input the summarizer sees, so edited bodies get a fresh summary."""
+    return hashlib.sha256(text[:MAX_INPUT_CHARS].encode("utf-8")).hexdigest()
+
+
+def _is_rate_limit_error(error: Exception) -> bool:
+    error_str = str(error).lower()
+    return any(pattern in error_str for pattern in RATE_LIMIT_PATTERNS)
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> bytes:
+    """Encode one Server-Sent Event."""
+    return b"event: " + event.encode("utf-8") + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+def plan_summary_batches(texts: Dict[str, str]) -> List[Dict[str, str]]:
+    """
+    Group texts into LLM calls: short emails are packed up to the item and character
+    limits, long emails get a call of their own.
+    """
+    batches: List[Dict[str, str]] = []
+    current: Dict[str, str] = {}
+    current_chars = 0
+    for message_id, text in texts.items():
+        if settings.SUMMARY_BATCH_MAX_ITEMS <= 1 or len(text) > settings.SUMMARY_BATCH_ITEM_MAX_CHARS:
+            batches.append({message_id: text})
+            continue
+        if current and (
+            len(current) >= settings.SUMMARY_BATCH_MAX_ITEMS
+            or current_chars + len(text) > settings.SUMMARY_BATCH_MAX_CHARS
+        ):
+            batches.append(current)
+            current, current_chars = {}, 0
+        current[message_id] = text
+        current_chars += len(text)
+    if current:
+        batches.append(current)
+    return batches
+
+
+class SummaryService:
+    """Service for cached, concurrent email summarization."""
+
+    def __init__(self, db: AsyncDatabase):
+        self.db = db
+        self.email_summaries_collection = db["email_summaries"]
+        self.emails_collection = db["emails"]
+        self.job_state_collection = db["summary_job_state"]
+        self._summarizer: Optional[Summarizer] = None
+
+    def _get_summarizer(self) -> Summarizer:
+        if self._summarizer is None:
+            self._summarizer = Summarizer()
+        return self._summarizer
+
+    async def get_cached_summaries(self, user_id: str, texts: Dict[str, str]) -> Dict[str, str]:
+        """Return stored summaries whose content hash still matches, in a single query."""
+        if not texts:
+            return {}
+
+        docs = await self.email_summaries_collection.find(
+            {"user_id": user_id, "message_id": {"$in": list(texts.keys())}},
+            {"_id": 0, "message_id": 1, "content_hash": 1, "summary": 1}
+        ).to_list(length=None)
+
+        summaries: Dict[str, str] = {}
+        for doc in docs:
+            message_id = doc["message_id"]
+            if doc.get("summary") and doc.get("content_hash") == summary_content_hash(texts[message_id]):
+                summaries[message_id] = doc["summary"]
+        return summaries
+
+    async def store_summary(self, user_id: str, message_id: str, text: str, summary: str) -> None:
+        now = datetime.utcnow().isoformat()
+        await self.email_summaries_collection.update_one(
+            {
+                "user_id": user_id,
+                "message_id": message_id,
+                "content_hash": summary_content_hash(text)
+            },
+            {
+                "$set": {"summary": summary, "updated_at": now},
+                "$setOnInsert": {"created_at": now}
+            },
+            upsert=True
+        )
+
+    async def _generate_summary(self, user_id: str, message_id: str, text: str) -> Optional[str]:
+        """Generate and store one summary. Returns None on failure."""
+        async with _generation_semaphore:
+            for attempt in range(2):
+                try:
+                    await gemini_rate_limiter.acquire()
+                    summary = await self._get_summarizer().summarize(text)
+                    break
+                except Exception as e:
+                    if attempt == 0 and _is_rate_limit_error(e):
+                        # Hold the permit while cooling down so other callers back off too
+                        logger.warning(f"[SUMMARY] Rate limited on {message_id}, cooling down {settings.SUMMARY_RATE_LIMIT_COOLDOWN_SECONDS}s")
+                        await asyncio.sleep(settings.SUMMARY_RATE_LIMIT_COOLDOWN_SECONDS)
+                        continue
+                    logger.warning(f"[SUMMARY] Summarize failed for {message_id}: {e}")
+                    return None
+
+        if summary:
+            try:
+                await self.store_summary(user_id, message_id, text, summary)
+            except Exception as e:
+                logger.warning(f"[SUMMARY] Failed to store summary for {message_id}: {e}")
+        return summary or None
+
+    async def _generate_batch(self, user_id: str, texts: Dict[str, str]) -> Dict[str, str]:
+        """Generate and store summaries for one planned batch, falling back to single calls."""
+        if len(texts) == 1:
+            message_id, text = next(iter(texts.items()))
+            summary = await self._generate_summary(user_id, message_id, text)
+            return {message_id: summary} if summary else {}
+
+        summaries: Dict[str, str] = {}
+        async with _generation_semaphore:
+            try:
+                await gemini_rate_limiter.acquire()
+                summaries = await self._get_summarizer().summarize_batch(texts, fallback=False)
+            except Exception as e:
+                logger.warning(f"[SUMMARY] Batch summarize failed for {len(texts)} emails: {e}")
+                if _is_rate_limit_error(e):
+                    await asyncio.sleep(settings.SUMMARY_RATE_LIMIT_COOLDOWN_SECONDS)
+
+        for message_id, summary in summaries.items():
+            try:
+                await self.store_summary(user_id, message_id, texts[message_id], summary)
+            except Exception as e:
+                logger.warning(f"[SUMMARY] Failed to store summary for {message_id}: {e}")
+
+        # Emails the model skipped or mangled are retried one per call
+        for message_id, text in texts.items():
+            if message_id not in summaries:
+                summary = await self._generate_summary(user_id, message_id, text)
+                if summary:
+                    summaries[message_id] = summary
+        return summaries
+
+    async def get_summaries(self, user_id: str, texts: Dict[str, str], timeout: Optional[float] = None) -> Dict[str, str]:
+        """
+        Get summaries for a page of messages.
+
+        Args:
+            user_id: Owner of the messages
+            texts: Mapping of message_id to the text to summarize (raw bodies are normalized here)
+            timeout: Seconds to wait for missing summaries (defaults to config)
+
+        Returns:
+            Mapping of message_id to summary. Messages whose summary was not ready
+            before the timeout are omitted (partial results).
+        """
+        texts = {message_id: clean_email_text(text) for message_id, text in texts.items() if message_id and text}
+        texts = {message_id: text for message_id, text in texts.items() if text}
+        if not texts:
+            return {}
+
+        try:
+            summaries = await self.get_cached_summaries(user_id, texts)
+        except Exception as e:
+            logger.warning(f"[SUMMARY] Cached summary lookup failed for user {user_id}: {e}")
+            summaries = {}
+
+        missing = {message_id: text for message_id, text in texts.items() if message_id not in summaries}
+        if not missing:
+            return summaries
+
+        logger.info(f"[SUMMARY] {len(summaries)} cached, generating {len(missing)} for user {user_id}")
+        tasks = [
+            asyncio.create_task(self._generate_batch(user_id, batch))
+            for batch in plan_summary_batches(missing)
+        ]
+        if timeout is None:
+            timeout = settings.SUMMARY_PAGE_TIMEOUT_SECONDS
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+
+        for task in done:
+            if not task.exception():
+                summaries.update(task.result())
+
+        if pending:
+            # The request-scoped DB client closes with the response, so unfinished work is dropped;
+            # the next load (or the background job) fills the gap.
+            logger.info(f"[SUMMARY] Returning partial results, {len(pending)} summaries still pending")
+            for task in pending:
+                task.cancel()
+
+        return summaries
+
+    async def get_summary(self, user_id: str, message_id: str, text: str, timeout: Optional[float] = None) -> Optional[str]:
+        """Get the summary for a single message, generating it if needed."""
+        summaries = await self.get_summaries(user_id, {message_id: text}, timeout)
+        return summaries.get(message_id)
+
+    async def stream_summary(
+        self,
+        user_id: str,
+        message_id: str,
+        text: str,
+        cached_summary: Optional[str] = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Stream a summary as Server-Sent Events.
+
+        Events: `summary` (stored summary, sent at once), `token` (generated chunk),
+        `done` (final summary) and `error`. The caller looks up `cached_summary` before
+        the response starts; the generator itself must not touch the request-scoped
+        database, which is closed once the endpoint returns.
+        """
+        if cached_summary:
+            yield sse_event("summary", {"message_id": message_id, "summary": cached_summary})
+            yield sse_event("done", {"message_id": message_id, "summary": cached_summary, "cached": True})
+            return
+
+        parts: List[str] = []
+        try:
+            async with _generation_semaphore:
+                await gemini_rate_limiter.acquire()
+                async for chunk in self._get_summarizer().stream(text):
+                    parts.append(chunk)
+                    yield sse_event("token", {"text": chunk})
+        except Exception as e:
+            logger.warning(f"[SUMMARY] Streaming summary failed for {message_id}: {e}")
+            yield sse_event("error", {"message_id": message_id, "detail": str(e)})
+            return
+
+        summary = "".join(parts).strip()
+        if summary:
+            await self._store_summary_detached(user_id, message_id, text, summary)
+        yield sse_event("done", {"message_id": message_id, "summary": summary, "cached": False})
+
+    @staticmethod
+    async def _store_summary_detached(user_id: str, message_id: str, text: str, summary: str) -> None:
+        """Store a summary with a dedicated client, for work that outlives the request."""
+        client = AsyncMongoClient(settings.DB_CONNECTION_STRING)
+        try:
+            await SummaryService(client[settings.DB_NAME]).store_summary(user_id, message_id, text, summary)
+        except Exception as e:
+            logger.warning(f"[SUMMARY] Failed to store streamed summary for {message_id}: {e}")
+        finally:
+            await client.close()
+
+    def _summarize_queue_filter(self) -> Dict[str, Any]:
+        cutoff = (datetime.utcnow() - timedelta(days=settings.SUMMARIZE_LOOKBACK_DAYS)).isoformat()
+        return {
+            "received_on": {"$gte": cutoff},
+            "is_summarized": {"$ne": True},
+            "summary_attempts": {"$not": {"$gte": SUMMARIZE_MAX_ATTEMPTS}},
+            "labels": {"$ne": "DRAFT"}
+        }
+
+    async def process_summarize_queue(self) -> Dict[str, Any]:
+        """
+        Pre-summarize recent emails, newest first, within the Gemini RPM budget.
+
+        Progress lives on the email documents (`is_summarized`, `summary_attempts`),
+        so an interrupted run resumes where it stopped after a restart.
+
+        Returns:
+            Dict with run statistics (also persisted for the status endpoint)
+        """
+        started = time.monotonic()
+        started_at = datetime.utcnow().isoformat()
+        max_calls = settings.SUMMARIZE_JOB_MAX_PER_RUN
+        stats = {"generated": 0, "cached": 0, "failed": 0, "llm_calls": 0}
+
+        await self.job_state_collection.update_one(
+            {"_id": SUMMARIZE_JOB_STATE_ID},
+            {"$set": {"running": True, "last_run_started_at": started_at}},
+            upsert=True
+        )
+
+        try:
+            while stats["llm_calls"] < max_calls:
+                docs = await self.emails_collection.find(
+                    self._summarize_queue_filter(),
+                    {"_id": 0, "user_id": 1, "message_id": 1, "body": 1, "clean_text": 1}
+                ).sort("received_on", -1).limit(settings.SUMMARIZE_JOB_BATCH_SIZE).to_list(length=None)
+                if not docs:
+                    break
+
+                done_ids: List[Dict[str, str]] = []
+                failed_ids: List[Dict[str, str]] = []
+                texts_by_user: Dict[str, Dict[str, str]] = {}
+                for doc in docs:
+                    text = doc.get("clean_text") or clean_email_text(doc.get("body") or "")
+                    if text:
+                        texts_by_user.setdefault(doc["user_id"], {})[doc["message_id"]] = text
+                    else:
+                        done_ids.append({"user_id": doc["user_id"], "message_id": doc["message_id"]})
+
+                for user_id, texts in texts_by_user.items():
+                    if stats["llm_calls"] >= max_calls:
+                        break
+                    done, failed = await self._summarize_for_job(user_id, texts, stats, max_calls)
+                    done_ids.extend({"user_id": user_id, "message_id": message_id} for message_id in done)
+                    failed_ids.extend({"user_id": user_id, "message_id": message_id} for message_id in failed)
+
+                await self._mark_summarized(done_ids, failed_ids)
+        finally:
+            duration = time.monotonic() - started
+            rate = (stats["generated"] / duration * 60) if duration > 0 else 0.0
+            per_call = (stats["generated"] / stats["llm_calls"]) if stats["llm_calls"] else 0.0
+            await self.job_state_collection.update_one(
+                {"_id": SUMMARIZE_JOB_STATE_ID},
+                {
+                    "$set": {
+                        "running": False,
+                        "last_run_finished_at": datetime.utcnow().isoformat(),
+                        "last_run_duration_seconds": round(duration, 2),
+                        "last_run_summaries_per_minute": round(rate, 2),
+                        "last_run_summaries_per_call": round(per_call, 2),
+                        "last_run": stats
+                    },
+                    "$inc": {
+                        "total_generated": stats["generated"],
+                        "total_cached": stats["cached"],
+                        "total_failed": stats["failed"],
+                        "total_llm_calls": stats["llm_calls"]
+                    }
+                },
+                upsert=True
+            )
+
+        logger.info(f"[SUMMARIZE JOB] Run completed: {stats}")
+        return stats
+
+    async def _summarize_for_job(
+        self,
+        user_id: str,
+        texts: Dict[str, str],
+        stats: Dict[str, int],
+        max_calls: int
+    ) -> Tuple[List[str], List[str]]:
+        """Summarize one user's slice of the queue. Returns (done, failed) message ids."""
+        done: List[str] = []
+        failed: List[str] = []
+
+        cached = await self.get_cached_summaries(user_id, texts)
+        stats["cached"] += len(cached)
+        done.extend(cached.keys())
+        missing = {message_id: text for message_id, text in texts.items() if message_id not in cached}
+
+        summarizer = self._get_summarizer()
+        for batch in plan_summary_batches(missing):
+            if stats["llm_calls"] >= max_calls:
+                break
+
+            summaries: Dict[str, str] = {}
+            leftovers = batch
+            if len(batch) > 1:
+                # Keep a slice of the quota free for interactive requests
+                await gemini_rate_limiter.acquire(reserve=settings.SUMMARIZE_JOB_INTERACTIVE_RESERVE)
+                stats["llm_calls"] += 1
+                try:
+                    summaries = await summarizer.summarize_batch(batch, fallback=False)
+                except Exception as e:
+                    logger.warning(f"[SUMMARIZE JOB] Batch of {len(batch)} failed: {e}")
+                    if _is_rate_limit_error(e):
+                        await asyncio.sleep(settings.SUMMARY_RATE_LIMIT_COOLDOWN_SECONDS)
+                leftovers = {message_id: text for message_id, text in batch.items() if message_id not in summaries}
+
+            for message_id, text in leftovers.items():
+                if stats["llm_calls"] >= max_calls:
+                    break
+                await gemini_rate_limiter.acquire(reserve=settings.SUMMARIZE_JOB_INTERACTIVE_RESERVE)
+                stats["llm_calls"] += 1
+                try:
+                    summary = await summarizer.summarize(text)
+                except Exception as e:
+                    logger.warning(f"[SUMMARIZE JOB] Failed for {message_id}: {e}")
+                    summary = None
+                    if _is_rate_limit_error(e):
+                        await asyncio.sleep(settings.SUMMARY_RATE_LIMIT_COOLDOWN_SECONDS)
+                if summary:
+                    summaries[message_id] = summary
+                else:
+                    stats["failed"] += 1
+                    failed.append(message_id)
+
+            for message_id, summary in summaries.items():
+                await self.store_summary(user_id, message_id, batch[message_id], summary)
+                stats["generated"] += 1
+                done.append(message_id)
+
+        return done, failed
+
+    async def _mark_summarized(self, done_ids: List[Dict[str, str]], failed_ids: List[Dict[str, str]]) -> None:
+        if done_ids:
+            await self.emails_collection.update_many(
+                {"$or": done_ids},
+                {"$set": {"is_summarized": True}}
+            )
+        if failed_ids:
+            await self.emails_collection.update_many(
+                {"$or": failed_ids},
+                {"$inc": {"summary_attempts": 1}}
+            )
+
+    async def get_summarize_job_status(self) -> Dict[str, Any]:
+        """Return backlog size and throughput of the background summarize job."""
+        backlog = await self.emails_collection.count_documents(self._summarize_queue_filter())
+        state = await self.job_state_collection.find_one({"_id": SUMMARIZE_JOB_STATE_ID}) or {}
+        state.pop("_id", None)
+        return {
+            "backlog": backlog,
+            "lookback_days": settings.SUMMARIZE_LOOKBACK_DAYS,
+            "rate_limit_rpm": settings.GEMINI_RATE_LIMIT_RPM,
+            **state
+        }
@@ -16,8 +16,13 @@ from typing import Optional, Dict, Any, Set, List
 from pymongo.asynchronous.database import AsyncDatabase
 from bson import ObjectId
 
+from app.api.mail.embedding_queue import EmbeddingQueue
+from app.api.mail.fuzzy_index import TrigramIndex
+from app.api.mail.lexical_index import LexicalIndex
 from app.api.mail.models import EmailDocument, Attachment
 from app.config import settings
+from app.utils.single_flight import single_flight
+from app.utils.text_cleaner import clean_email_text
 
 
 logger = logging.getLogger(__name__)
@@ -32,6 +37,9 @@ class EmailSyncService:
         self.email_index_collection = db["email_index"]
         self.sync_state_collection = db["mail_sync_state"]
         self.users_collection = db["users"]
+        self.lexical_index = LexicalIndex(db)
+        self.fuzzy_index = TrigramIndex(db)
+        self.embedding_queue = EmbeddingQueue(db)
 
     async def get_gmail_service(self, user_id: str):
         """Get Gmail service for a user."""
@@ -103,6 +111,24 @@ class EmailSyncService:
 
         return gmail_label_id
 
+    def _extract_clean_text(self, payload: dict) -> str:
+        """Decode the first text/plain (else text/html) body part and normalize it."""
+        bodies = {"text/plain": "", "text/html": ""}
+
+        def walk(part: dict):
+            mime_type = part.get('mimeType')
+            data = part.get('body', {}).get('data')
+            if mime_type in bodies and data and not part.get('filename') and not bodies[mime_type]:
+                try:
+                    bodies[mime_type] = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
+                except Exception as e:
+                    logger.warning(f"[INDEX PARSE] Error decoding {mime_type} part: {e}")
+            for child in part.get('parts', []) or []:
+                walk(child)
+
+        walk(payload)
+        return clean_email_text(bodies["text/plain"] or bodies["text/html"])
+
     def _parse_message_for_index(self, msg_data: dict, user_id: str) -> dict:
         """Parse message for search indexing (legacy format)."""
         payload = msg_data.get('payload', {})
@@ -155,6 +181,7 @@ class EmailSyncService:
             "from_name": name,
             "from_email": email_addr,
             "snippet": snippet,
+            "clean_text": self._extract_clean_text(payload),
             "received_on": received_on,
             "labels": label_ids,
             "to": to_list,
@@ -318,6 +345,8 @@ class EmailSyncService:
         logger.debug(f"[PARSE] Message {msg_id} parsed: text={len(body_text)} chars, html={len(body_html)} chars, attachments={len(attachments)}")
 
         processed_html = body_html or f"<pre>{body_text}</pre>"
+        clean_text = clean_email_text(body_text or body_html)
+        logger.debug(f"[PARSE] Message {msg_id} clean_text: {len(clean_text)} chars (raw body {len(body_text or body_html)} chars)")
 
         # Convert attachments to Attachment objects
         attachments_metadata = []
@@ -362,6 +391,7 @@ class EmailSyncService:
                 processed_html=processed_html,
                 decoded_body=body_text,
                 snippet=msg_data.get('snippet', ''),
+                clean_text=clean_text,
                 labels=label_ids,
                 tags=tags,
                 unread="UNREAD" in label_ids,
@@ -401,6 +431,21 @@ class EmailSyncService:
             upsert=True
         )
 
+        try:
+            await self.lexical_index.index_email(doc)
+        except Exception as e:
+            logger.warning(f"[LEXICAL INDEX] Failed to index message {doc.get('message_id')}: {e}")
+
+        try:
+            await self.fuzzy_index.add_email(doc)
+        except Exception as e:
+            logger.warning(f"[FUZZY INDEX] Failed to index message {doc.get('message_id')}: {e}")
+
+        try:
+            await self.embedding_queue.enqueue(doc["user_id"], [doc["message_id"]])
+        except Exception as e:
+            logger.warning(f"[EMBEDDING QUEUE] Failed to enqueue message {doc.get('message_id')}: {e}")
+
     async def _check_existing_message_ids(self, user_id: str, message_ids: List[str]) -> Set[str]:
         """Batch check which message_ids already exist in DB for a user."""
         if not message_ids:
@@ -658,7 +703,7 @@ class EmailSyncService:
 
         logger.info(f"[SMART SYNC] Completed sync for user {user_id}: {synced_count} emails synced, {error_count} errors")
 
-        result = {"history_id": latest_history_id}
+        result = {"history_id": latest_history_id, "synced_count": synced_count}
 
         # Check if there are remaining pages for backlog processing
         if page_token:
@@ -716,7 +761,17 @@ class EmailSyncService:
         return {"history_id": latest_history_id}
 
     async def sync_email_index(self, user_id: str, mailbox_id: Optional[str] = None, max_emails: Optional[int] = None) -> Dict[str, Any]:
-        """Smart sync that prioritizes recent emails and supports incremental updates."""
+        """
+        Smart sync that prioritizes recent emails and supports incremental updates.
+        Concurrent syncs of the same user and arguments share one run (single-flight).
+        """
+        return await single_flight("sync_email_index").do(
+            f"{user_id}:{mailbox_id}:{max_emails}",
+            lambda: self._sync_email_index(user_id, mailbox_id, max_emails),
+            lease_collection=self.db["single_flight_leases"]
+        )
+
+    async def _sync_email_index(self, user_id: str, mailbox_id: Optional[str] = None, max_emails: Optional[int] = None) -> Dict[str, Any]:
         logger.info(f"[SYNC] Starting sync for user {user_id}, mailbox={mailbox_id}")
 
         if max_emails is None:
@@ -798,9 +853,14 @@ class EmailSyncService:
                 update_data["full_sync_completed"] = True
                 update_data["sync_version"] = "2.0"  # New version with smart sync
 
+            update_ops: Dict[str, Any] = {"$set": update_data}
+            if smart_sync_result.get("synced_count"):
+                # New emails landed, invalidate mailbox page ETags
+                update_ops["$inc"] = {"mail_version": 1}
+
             await self.sync_state_collection.update_one(
                 {"user_id": user_id},
-                {"$set": update_data},
+                update_ops,
                 upsert=True
             )
 
@@ -972,9 +1032,13 @@ class EmailSyncService:
                 update_data["backlog_mode"] = None
                 logger.info(f"[BACKLOG] Backlog processing completed for user {user_id}")
 
+            update_ops: Dict[str, Any] = {"$set": update_data}
+            if processed_count:
+                # New emails landed, invalidate mailbox page ETags
+                update_ops["$inc"] = {"mail_version": 1}
             await self.sync_state_collection.update_one(
                 {"user_id": user_id},
-                {"$set": update_data}
+                update_ops
             )
 
             logger.info(f"[BACKLOG] Completed backlog processing for user {user_id}: {processed_count} emails processed, {error_count} errors, {pages_processed} pages")
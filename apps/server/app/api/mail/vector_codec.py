@@ -0,0 +1,88 @@
+"""
+Vector storage encoding shared by the vector store backends.
+
+- Truncation: keep the leading VECTOR_DIMENSION components, re-normalized
+  (text-embedding-004 front-loads information, so short prefixes stay useful)
+- Scalar quantization: VECTOR_QUANTIZATION=int8 stores one signed byte per component
+  plus a per-vector scale; candidates are scored on the codes and rescored against
+  the full-precision vectors
+"""
+
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.api.mail.semantic_embedding import embedding_dimension
+from app.config import settings
+
+
+def stored_dimension(provider_dimension: Optional[int] = None) -> int:
+    """Dimension of stored vectors: the provider's (serving by default), or VECTOR_DIMENSION when smaller."""
+    provider_dimension = provider_dimension or embedding_dimension()
+    target = settings.VECTOR_DIMENSION
+    return target if 0 < target < provider_dimension else provider_dimension
+
+
+def quantization_enabled() -> bool:
+    return settings.VECTOR_QUANTIZATION == "int8"
+
+
+def rescore_limit(top_k: int) -> int:
+    """Number of quantized candidates rescored at full precision for a top-k query."""
+    return max(top_k, math.ceil(top_k * settings.VECTOR_RESCORE_OVERSAMPLING))
+
+
+def prepare_vector(vector: Sequence[float], dimension: Optional[int] = None) -> List[float]:
+    """Truncate a single vector to the stored dimension (re-normalized when cut)."""
+    dimension = dimension or stored_dimension()
+    if len(vector) <= dimension:
+        return list(vector)
+    head = [float(x) for x in vector[:dimension]]
+    norm = math.sqrt(sum(x * x for x in head))
+    return [x / norm for x in head] if norm else head
+
+
+def prepare_matrix(vectors: np.ndarray, dimension: Optional[int] = None) -> np.ndarray:
+    """Truncate rows to the stored dimension and scale them to unit length."""
+    vectors = np.asarray(vectors, dtype=np.float32)[:, :dimension or stored_dimension()]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-vector int8 quantization. Returns (codes, scales)."""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+INT8_SCORE_BLOCK_ROWS = 8192
+
+
+def int8_scores(codes: np.ndarray, scales: np.ndarray, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Approximate dot products of quantized vectors (all of them, or `rows`) with a float32 query.
+    Rows are widened to float32 a block at a time, so the temporary buffer has a fixed size.
+    """
+    count = len(codes) if rows is None else len(rows)
+    scores = np.empty(count, dtype=np.float32)
+    for start in range(0, count, INT8_SCORE_BLOCK_ROWS):
+        end = min(start + INT8_SCORE_BLOCK_ROWS, count)
+        block = slice(start, end) if rows is None else rows[start:end]
+        scores[start:end] = (codes[block].astype(np.float32) @ query) * scales[block]
+    return scores
+
+
+def storage_estimate(dimension: int, quantized: bool, on_disk: bool) -> Dict[str, int]:
+    """Approximate bytes per million vectors in RAM and on disk (vectors only, no payloads)."""
+    full = dimension * 4
+    codes = dimension + 4
+    ram = (codes if quantized else 0) + (0 if on_disk else full)
+    return {
+        "dimension": dimension,
+        "ram_bytes_per_million": ram * 1_000_000,
+        "disk_bytes_per_million": (full + (codes if quantized else 0)) * 1_000_000,
+    }
@@ -1,35 +1,98 @@
-from typing import Dict, Iterable, List, Optional, Sequence, Tuple
-from uuid import uuid4
+import logging
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from uuid import UUID, uuid5
 
 from qdrant_client import QdrantClient
 from qdrant_client.http import models as qm
 
+from app.api.mail.embedding_versions import EmbeddingVersion, serving_version
+from app.api.mail.local_vector_store import LocalVectorStore
 from app.api.mail.semantic_embedding import embedding_dimension
+from app.api.mail.vector_codec import prepare_vector, quantization_enabled, stored_dimension
 from app.config import settings
 
 
+logger = logging.getLogger(__name__)
+
+# Fixed namespace so point ids are stable across processes and deployments
+POINT_ID_NAMESPACE = UUID("6f1c2b0e-8d4a-5b7e-9c3f-2a1d4e6b8c90")
+
+
+def point_id_for(user_id: str, message_id: str, chunk_index: int = 0) -> str:
+    """Deterministic point id, so re-embedding a message overwrites its vectors in place."""
+    key = f"{user_id}:{message_id}" if chunk_index == 0 else f"{user_id}:{message_id}#{chunk_index}"
+    return str(uuid5(POINT_ID_NAMESPACE, key))
+
+
 class QdrantVectorStore:
     """Lightweight wrapper around Qdrant Cloud for semantic email search."""
 
-    def __init__(self, client: QdrantClient, collection_name: str = "emails"):
+    def __init__(self, client: QdrantClient, collection_name: str = "emails", provider_dimension: Optional[int] = None):
         self.client = client
         self.collection_name = collection_name
+        self.dimension = stored_dimension(provider_dimension)
         self._ensure_collection()
 
+    def _quantization_config(self) -> Optional[qm.ScalarQuantization]:
+        if not quantization_enabled():
+            return None
+        return qm.ScalarQuantization(
+            scalar=qm.ScalarQuantizationConfig(
+                type=qm.ScalarType.INT8,
+                quantile=0.99,
+                always_ram=True,
+            )
+        )
+
+    def _search_params(self) -> Optional[qm.SearchParams]:
+        if not quantization_enabled():
+            return None
+        return qm.SearchParams(
+            quantization=qm.QuantizationSearchParams(
+                rescore=True,
+                oversampling=settings.VECTOR_RESCORE_OVERSAMPLING,
+            )
+        )
+
     def _ensure_collection(self) -> None:
-        dim = embedding_dimension()
+        dim = self.dimension
         try:
-            self.client.get_collection(self.collection_name)
+            info = self.client.get_collection(self.collection_name)
+            vectors = info.config.params.vectors
+            size = getattr(vectors, "size", None)
+            if size is not None and size != dim:
+                raise ValueError(
+                    f"Collection '{self.collection_name}' has {size}-dimension vectors but the "
+                    f"embedding provider produces {dim}; set QDRANT_COLLECTION to a separate collection"
+                )
+        except ValueError:
+            raise
         except Exception:
             self.client.create_collection(
                 collection_name=self.collection_name,
                 vectors_config=qm.VectorParams(
                     size=dim,
                     distance=qm.Distance.COSINE,
+                    on_disk=settings.VECTOR_ON_DISK,
                 ),
+                quantization_config=self._quantization_config(),
             )
+        else:
+            # Apply storage settings changed since the collection was created
+            quantization_config = self._quantization_config()
+            current_quantized = info.config.quantization_config is not None
+            current_on_disk = bool(getattr(vectors, "on_disk", False))
+            if current_quantized != (quantization_config is not None) or current_on_disk != settings.VECTOR_ON_DISK:
+                try:
+                    self.client.update_collection(
+                        collection_name=self.collection_name,
+                        vectors_config={"": qm.VectorParamsDiff(on_disk=settings.VECTOR_ON_DISK)},
+                        quantization_config=quantization_config or qm.Disabled.DISABLED,
+                    )
+                except Exception as e:
+                    logger.warning(f"[VECTOR STORE] Could not update storage settings of '{self.collection_name}': {e}")
         # Ensure payload indexes for filters we use
-        for field in ("user_id", "labels"):
+        for field in ("user_id", "labels", "thread_id"):
             try:
                 self.client.create_payload_index(
                     collection_name=self.collection_name,
@@ -48,26 +111,44 @@ class QdrantVectorStore:
         if not items:
             return
         points: List[qm.PointStruct] = []
+        stale_ids: List[str] = []
         for item in items:
             message_id = item["message_id"]
             embedding = item["embedding"]
+            chunk_index = item.get("chunk_index", 0)
+            chunk_count = item.get("chunk_count", 1)
             payload = {
                 "user_id": user_id,
                 "message_id": message_id,
+                "thread_id": item.get("thread_id", ""),
                 "subject": item.get("subject", ""),
                 "from_name": item.get("from_name", ""),
                 "from_email": item.get("from_email", ""),
                 "snippet": item.get("snippet", ""),
                 "labels": item.get("labels", []),
+                "chunk_index": chunk_index,
+                "chunk_count": chunk_count,
+                "passage": item.get("passage", ""),
             }
             points.append(
                 qm.PointStruct(
-                    id=str(uuid4()),  # let Qdrant use a valid UUID
-                    vector=embedding,
+                    id=point_id_for(user_id, message_id, chunk_index),
+                    vector=prepare_vector(embedding, self.dimension),
                     payload=payload,
                 )
             )
+            if chunk_index == 0:
+                # Chunks left over from a longer earlier version of the message
+                stale_ids.extend(
+                    point_id_for(user_id, message_id, index)
+                    for index in range(chunk_count, settings.EMBEDDING_MAX_CHUNKS)
+                )
         self.client.upsert(collection_name=self.collection_name, points=points)
+        if stale_ids:
+            self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=qm.PointIdsList(points=stale_ids),
+            )
 
     def query(
         self,
@@ -75,6 +156,8 @@ class QdrantVectorStore:
         query_embedding: List[float],
         top_k: int,
         mailbox_label_id: Optional[str] = None,
+        exclude_message_id: Optional[str] = None,
+        exclude_thread_id: Optional[str] = None,
     ) -> List[Tuple[str, float, Dict]]:
         must = [
             qm.FieldCondition(
@@ -95,6 +178,11 @@ class QdrantVectorStore:
             )
         ]
 
+        if exclude_message_id:
+            must_not.append(qm.FieldCondition(key="message_id", match=qm.MatchValue(value=exclude_message_id)))
+        if exclude_thread_id:
+            must_not.append(qm.FieldCondition(key="thread_id", match=qm.MatchValue(value=exclude_thread_id)))
+
         if mailbox_label_id:
             must.append(
                 qm.FieldCondition(
@@ -105,11 +193,12 @@ class QdrantVectorStore:
 
         res = self.client.query_points(
             collection_name=self.collection_name,
-            query=query_embedding,
+            query=prepare_vector(query_embedding, self.dimension),
             limit=top_k,
             with_payload=True,
             with_vectors=False,
             query_filter=qm.Filter(must=must, must_not=must_not),
+            search_params=self._search_params(),
         )
         scored: List[Tuple[str, float, Dict]] = []
         for point in res.points:
@@ -119,6 +208,25 @@ class QdrantVectorStore:
             scored.append((message_id, score, payload))
         return scored
 
+    def message_vector(self, user_id: str, message_id: str) -> Optional[Tuple[List[float], Dict]]:
+        """
+        Stored vector of a message (mean of its chunk vectors) and its first chunk's payload.
+        Returns None when the message has no vectors.
+        """
+        points = self.client.retrieve(
+            collection_name=self.collection_name,
+            ids=[point_id_for(user_id, message_id, index) for index in range(settings.EMBEDDING_MAX_CHUNKS)],
+            with_payload=True,
+            with_vectors=True,
+        )
+        points = [point for point in points if (point.payload or {}).get("user_id") == user_id and point.vector]
+        if not points:
+            return None
+        points.sort(key=lambda point: (point.payload or {}).get("chunk_index", 0))
+        vectors = [list(point.vector) for point in points]
+        mean = [sum(values) / len(vectors) for values in zip(*vectors)]
+        return mean, points[0].payload or {}
+
     def count(self, user_id: Optional[str] = None) -> int:
         if user_id:
             res = self.client.count(
@@ -140,9 +248,76 @@ class QdrantVectorStore:
         )
         return int(res.count or 0)
 
+    def dedupe(self, user_id: Optional[str] = None, page_size: int = 1000) -> Dict[str, int]:
+        """
+        Collapse duplicate points left by random point ids into one point per message
+        chunk, stored under its deterministic id.
+
+        Returns:
+            Counts of scanned points, distinct chunks and deleted points
+        """
+        scroll_filter = None
+        if user_id:
+            scroll_filter = qm.Filter(
+                must=[
+                    qm.FieldCondition(
+                        key="user_id",
+                        match=qm.MatchValue(value=user_id),
+                    )
+                ]
+            )
+
+        groups: Dict[Tuple[str, str, int], List[str]] = {}
+        scanned = 0
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=scroll_filter,
+                limit=page_size,
+                offset=offset,
+                with_payload=["user_id", "message_id", "chunk_index"],
+                with_vectors=False,
+            )
+            for point in points:
+                payload = point.payload or {}
+                key = (str(payload.get("user_id")), str(payload.get("message_id")), int(payload.get("chunk_index") or 0))
+                groups.setdefault(key, []).append(str(point.id))
+            scanned += len(points)
+            if offset is None:
+                break
+
+        deleted = 0
+        for (point_user_id, message_id, chunk_index), ids in groups.items():
+            canonical = point_id_for(point_user_id, message_id, chunk_index)
+            stale = [point_id for point_id in ids if point_id != canonical]
+            if not stale:
+                continue
+            if canonical not in ids:
+                # Keep one copy under the deterministic id before removing the others
+                source = self.client.retrieve(
+                    collection_name=self.collection_name,
+                    ids=[stale[0]],
+                    with_payload=True,
+                    with_vectors=True,
+                )
+                if not source:
+                    continue
+                self.client.upsert(
+                    collection_name=self.collection_name,
+                    points=[qm.PointStruct(id=canonical, vector=source[0].vector, payload=source[0].payload)],
+                )
+            self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=qm.PointIdsList(points=stale),
+            )
+            deleted += len(stale)
+
+        return {"scanned": scanned, "chunks": len(groups), "deleted": deleted}
+
 
 _client: Optional[QdrantClient] = None
-_store: Optional[QdrantVectorStore] = None
+_stores: Dict[str, Union[QdrantVectorStore, LocalVectorStore]] = {}
 
 
 def get_qdrant_client() -> QdrantClient:
@@ -156,11 +331,23 @@ def get_qdrant_client() -> QdrantClient:
     return _client
 
 
-def get_vector_store() -> QdrantVectorStore:
-    global _store
-    if _store is None:
-        _store = QdrantVectorStore(
-            client=get_qdrant_client(),
-            collection_name=getattr(settings, "QDRANT_COLLECTION", "emails") or "emails",
-        )
-    return _store
+def get_vector_store(version: Optional[EmbeddingVersion] = None) -> Union[QdrantVectorStore, LocalVectorStore]:
+    """Vector store of an embedding version (the serving version by default), one per collection."""
+    version = version or serving_version()
+    store = _stores.get(version.collection)
+    if store is None:
+        provider_dimension = embedding_dimension(version.provider)
+        if settings.VECTOR_STORE_BACKEND == "local":
+            store = LocalVectorStore(
+                base_path=settings.LOCAL_VECTOR_STORE_PATH,
+                collection_name=version.collection,
+                provider_dimension=provider_dimension,
+            )
+        else:
+            store = QdrantVectorStore(
+                client=get_qdrant_client(),
+                collection_name=version.collection,
+                provider_dimension=provider_dimension,
+            )
+        _stores[version.collection] = store
+    return store
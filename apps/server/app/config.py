@@ -32,8 +32,99 @@ class Settings(BaseSettings):
     QDRANT_URL: str = ""
     QDRANT_API_KEY: str = ""
     QDRANT_COLLECTION: str = "emails"
+    # Vector store: qdrant or local (embedded, memory-mapped segments on disk)
+    VECTOR_STORE_BACKEND: str = "qdrant"
+    LOCAL_VECTOR_STORE_PATH: str = "vector_data"
+    LOCAL_VECTOR_MERGE_FACTOR: int = 4  # merge this many recent segments of the same size tier
+    LOCAL_VECTOR_MAX_DEAD_RATIO: float = 0.3  # full compaction once superseded rows exceed this share of live rows
+    # Vector storage encoding (both backends)
+    VECTOR_QUANTIZATION: str = "none"  # none or int8 (scalar quantization with full-precision rescoring)
+    VECTOR_RESCORE_OVERSAMPLING: float = 2.0  # quantized candidates rescored per requested result
+    VECTOR_ON_DISK: bool = False  # Qdrant: keep original vectors on disk (local store always memory-maps them)
+    VECTOR_DIMENSION: int = 0  # truncate stored vectors to this many leading components (0 = provider dimension)
     EMBEDDING_BATCH_SIZE: int = 50
     EMBEDDING_JOB_INTERVAL_MINUTES: int = 5
+    # Embedding provider: gemini[:<model>] (text-embedding-004 by default) or hashing[:<dimension>] (offline NumPy model)
+    EMBEDDING_PROVIDER: str = "gemini"
+    EMBEDDING_HASHING_DIMENSION: int = 512
+    EMBEDDING_HASHING_MAX_CHARS: int = 8000  # text chars hashed per email
+    # Embedding model migration (embedding_migration): dual-write + throttled background re-embed
+    EMBEDDING_VERSION_REFRESH_SECONDS: float = 10.0  # how quickly instances see a cutover
+    EMBEDDING_MIGRATION_BATCH_SIZE: int = 64  # emails re-embedded per checkpoint
+    EMBEDDING_MIGRATION_PAUSE_SECONDS: float = 1.0  # pause between batches
+    EMBEDDING_MIGRATION_POLL_SECONDS: float = 30.0  # how often the migration loop checks for work
+    EMBEDDING_MIGRATION_STALE_SECONDS: int = 300  # a job without a checkpoint this long is resumed elsewhere
+    EMBEDDING_MIGRATION_AUTO_CUTOVER: bool = False  # cut over as soon as re-embedding finishes
+    # Long emails are embedded as overlapping chunks; a message scores as its best chunk
+    EMBEDDING_CHUNK_CHARS: int = 1500
+    EMBEDDING_CHUNK_OVERLAP_CHARS: int = 200
+    EMBEDDING_MAX_CHUNKS: int = 8
+    SEMANTIC_CHUNK_OVERFETCH: int = 2  # vector hits fetched per requested message
+    SEMANTIC_HIGHLIGHT_CHARS: int = 300
+    # Related emails (nearest neighbours of a stored message vector)
+    RELATED_EMAILS_DEPTH: int = 50  # neighbours ranked and cached per message
+    RELATED_EMAILS_MIN_SCORE: float = 0.5
+    RELATED_EMAILS_CACHE_TTL_SECONDS: int = 86400  # also invalidated by new embeddings
+    # Embedding work queue (embedding_queue, filled at sync time)
+    EMBEDDING_QUEUE_MAX_USERS_PER_CLAIM: int = 20  # users sharing one claimed batch
+    EMBEDDING_QUEUE_LEASE_SECONDS: int = 600  # claimed items become claimable again after this
+    EMBEDDING_QUEUE_MAX_ATTEMPTS: int = 5
+    EMBEDDING_QUEUE_RETRY_SECONDS: int = 30  # first retry delay, doubled per attempt
+    # Embedding worker (continuous pipelined drain of embedding_queue; off = EMBEDDING_JOB_INTERVAL_MINUTES job)
+    EMBEDDING_WORKER_ENABLED: bool = True
+    EMBEDDING_WORKER_CONCURRENCY: int = 4  # batches being embedded at once
+    EMBEDDING_WORKER_QUEUE_DEPTH: int = 4  # batches claimed ahead of each stage
+    EMBEDDING_WORKER_IDLE_SECONDS: float = 10.0  # pause when the queue is empty
+    # Background semantic index rebuilds (semantic_rebuild_jobs)
+    SEMANTIC_REBUILD_BATCH_SIZE: int = 100  # emails embedded per checkpoint
+    SEMANTIC_REBUILD_POLL_SECONDS: float = 5.0  # how often the rebuild loop looks for queued jobs
+    SEMANTIC_REBUILD_STALE_SECONDS: int = 120  # a running job without a checkpoint this long is resumed elsewhere
+    # Single-flight: cross-instance lease for coalesced operations (in-process coalescing is always on)
+    SINGLE_FLIGHT_LEASE_ENABLED: bool = False
+    SINGLE_FLIGHT_LEASE_SECONDS: int = 300  # renewed while the operation runs
+    SINGLE_FLIGHT_LEASE_POLL_SECONDS: float = 1.0  # how often other instances check for release
+    # Content-hash embedding cache (identical texts embedded once, shared across users)
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_TTL_DAYS: int = 30
+    # Embedding client (sub-batched async calls to the embedding API)
+    EMBEDDING_REQUEST_BATCH_SIZE: int = 16  # texts per API call
+    EMBEDDING_CONCURRENCY: int = 4  # API calls in flight
+    EMBEDDING_MAX_RETRIES: int = 4  # retries on quota/unavailable errors
+    EMBEDDING_BACKOFF_SECONDS: float = 1.0
+    EMBEDDING_MAX_BACKOFF_SECONDS: float = 30.0
+    # Summaries (email_summaries store, on-demand generation)
+    SUMMARY_CONCURRENCY: int = 4
+    SUMMARY_PAGE_TIMEOUT_SECONDS: float = 8.0
+    SUMMARY_SINGLE_TIMEOUT_SECONDS: float = 30.0
+    SUMMARY_RATE_LIMIT_COOLDOWN_SECONDS: float = 10.0
+    SUMMARY_BATCH_MAX_ITEMS: int = 8  # emails packed into one prompt (1 disables batching)
+    SUMMARY_BATCH_ITEM_MAX_CHARS: int = 2000  # longer emails are summarized on their own
+    SUMMARY_BATCH_MAX_CHARS: int = 12000
+    GEMINI_RATE_LIMIT_RPM: int = 15
+    SUMMARIZE_JOB_ENABLED: bool = True
+    SUMMARIZE_JOB_INTERVAL_MINUTES: int = 5
+    SUMMARIZE_LOOKBACK_DAYS: int = 30
+    SUMMARIZE_JOB_BATCH_SIZE: int = 20
+    SUMMARIZE_JOB_MAX_PER_RUN: int = 75  # LLM calls per run (~RPM x interval)
+    SUMMARIZE_JOB_INTERACTIVE_RESERVE: int = 3  # tokens left for on-demand summaries
+    # Query embedding cache (memory, mongo = shared across replicas, none)
+    QUERY_EMBEDDING_CACHE_BACKEND: str = "memory"
+    QUERY_EMBEDDING_CACHE_SIZE: int = 1024
+    QUERY_EMBEDDING_CACHE_TTL_SECONDS: int = 3600
+    # Semantic search result snapshots (ranked ids reused across pages)
+    SEMANTIC_SNAPSHOT_SIZE: int = 200
+    SEMANTIC_SNAPSHOT_TTL_SECONDS: int = 600
+    # Lexical search index (search_postings / search_terms)
+    SEARCH_BACKEND: str = "atlas"  # atlas ($search, local index as fallback) or local
+    SEARCH_INDEX_MAX_BODY_CHARS: int = 5000  # clean_text chars tokenized per email
+    SEARCH_MAX_POSTINGS_PER_TERM: int = 1000  # highest-tf postings scored per query word; bounds latency on common words
+    SEARCH_PREFIX_MAX_EXPANSIONS: int = 50
+    FUZZY_CANDIDATE_LIMIT: int = 200  # trigram candidates re-ranked by edit distance
+    FUZZY_SEARCH_MAX_VALUES: int = 3  # suggestions expanded into emails by search
+    # Response compression (gzip, or brotli when installed)
+    RESPONSE_COMPRESSION_MIN_BYTES: int = 1024
+    RESPONSE_COMPRESSION_GZIP_LEVEL: int = 6
+    RESPONSE_COMPRESSION_BROTLI_QUALITY: int = 4
 
     # Gmail sync configuration
     MAIL_SYNC_MODE: str = "inline"  # "inline" or "background"
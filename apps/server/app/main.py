@@ -9,10 +9,15 @@ from fastapi.responses import JSONResponse
 from pymongo import AsyncMongoClient
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 
+from app.api.mail.embedding_migration import EmbeddingMigrator, load_embedding_versions
+from app.api.mail.embedding_worker import EmbeddingWorker
+from app.api.mail.semantic_rebuild import SemanticRebuilder
 from app.api.mail.service import MailService
+from app.api.mail.summary_service import SummaryService
 from app.api.mail.sync_service import EmailSyncService
 from app.api.router import router as api_router
 from app.config import Settings, settings  # settings used for scheduler DB client
+from app.utils.compression import CompressionMiddleware
 
 settings = Settings()  # type: ignore
 
@@ -51,6 +56,12 @@ app = FastAPI(
 )
 
 app.add_middleware(ProxyHeadersMiddleware, trusted_hosts=["*"])
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.RESPONSE_COMPRESSION_MIN_BYTES,
+    gzip_level=settings.RESPONSE_COMPRESSION_GZIP_LEVEL,
+    brotli_quality=settings.RESPONSE_COMPRESSION_BROTLI_QUALITY,
+)
 
 app.include_router(api_router, prefix=router_prefix)
 
@@ -74,6 +85,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Search-Cursor", "X-Index-Rebuilding"],
 )
 
 
@@ -119,6 +131,37 @@ async def ensure_indexes():
         await email_index.create_index([("is_embedded", 1), ("received_on", -1)])
         sync_state = db["mail_sync_state"]
         await sync_state.create_index([("user_id", 1)], unique=True)
+        email_summaries = db["email_summaries"]
+        await email_summaries.create_index([("user_id", 1), ("message_id", 1), ("content_hash", 1)], unique=True)
+        await email_summaries.create_index([("user_id", 1), ("created_at", -1)])
+        search_postings = db["search_postings"]
+        await search_postings.create_index([("user_id", 1), ("term", 1), ("tf", -1)])
+        await search_postings.create_index([("user_id", 1), ("message_id", 1)])
+        search_terms = db["search_terms"]
+        await search_terms.create_index([("user_id", 1), ("term", 1)], unique=True)
+        search_trigrams = db["search_trigrams"]
+        await search_trigrams.create_index([("user_id", 1), ("field", 1), ("folded", 1)], unique=True)
+        await search_trigrams.create_index([("user_id", 1), ("trigrams", 1)])
+        search_documents = db["search_documents"]
+        await search_documents.create_index([("user_id", 1), ("message_id", 1)], unique=True)
+        search_index_stats = db["search_index_stats"]
+        await search_index_stats.create_index([("user_id", 1)], unique=True)
+        query_embedding_cache = db["query_embedding_cache"]
+        await query_embedding_cache.create_index([("expires_at", 1)], expireAfterSeconds=0)
+        embedding_queue = db["embedding_queue"]
+        await embedding_queue.create_index([("status", 1), ("available_at", 1), ("user_id", 1)])
+        await embedding_queue.create_index([("status", 1), ("lease_until", 1)])
+        await embedding_queue.create_index([("user_id", 1), ("enqueued_at", 1)])
+        await embedding_queue.create_index([("claim_id", 1)])
+        single_flight_leases = db["single_flight_leases"]
+        await single_flight_leases.create_index([("expires_at", 1)], expireAfterSeconds=3600)
+        semantic_rebuild_jobs = db["semantic_rebuild_jobs"]
+        await semantic_rebuild_jobs.create_index([("status", 1), ("requested_at", 1)])
+        embedding_cache = db["embedding_cache"]
+        await embedding_cache.create_index([("expires_at", 1)], expireAfterSeconds=0)
+        semantic_snapshots = db["semantic_search_snapshots"]
+        await semantic_snapshots.create_index([("expires_at", 1)], expireAfterSeconds=0)
+        await semantic_snapshots.create_index([("user_id", 1)])
         email_embeddings = db["email_embeddings"]
         await email_embeddings.create_index([("user_id", 1), ("message_id", 1)], unique=True)
         await email_embeddings.create_index([("user_id", 1)])
@@ -130,6 +173,7 @@ async def ensure_indexes():
         await emails.create_index([("user_id", 1), ("labels", 1)])
         await emails.create_index([("user_id", 1), ("received_on", -1)])
         await emails.create_index([("user_id", 1), ("has_attachments", 1)])
+        await emails.create_index([("is_summarized", 1), ("received_on", -1)])
 
         labels = db["labels"]
         await labels.create_index([("user_id", 1), ("label_id", 1)], unique=True)
@@ -178,6 +222,17 @@ async def run_embedding_job():
         await client.close()
 
 
+async def run_summarize_job():
+    """Periodic job to pre-summarize recent emails within the Gemini RPM budget."""
+    client = AsyncMongoClient(settings.DB_CONNECTION_STRING)
+    try:
+        db = client[settings.DB_NAME]
+        summary_service = SummaryService(db)
+        await summary_service.process_summarize_queue()
+    finally:
+        await client.close()
+
+
 # Global to hold background tasks references to prevent GC
 background_tasks = set()
 
@@ -218,18 +273,57 @@ async def on_startup():
         backlog_task.add_done_callback(background_tasks.discard)
         logging.info(f"[STARTUP] Backlog processing loop started (interval: {settings.MAIL_SYNC_BACKLOG_INTERVAL_SECONDS}s)")
 
+    # Run semantic index rebuild loop in background
+    rebuild_client = AsyncMongoClient(settings.DB_CONNECTION_STRING)
+    semantic_rebuilder = SemanticRebuilder(MailService(rebuild_client[settings.DB_NAME]))
+    rebuild_task = asyncio.create_task(semantic_rebuilder.run_forever())
+    background_tasks.add(rebuild_task)
+    rebuild_task.add_done_callback(background_tasks.discard)
+    logging.info(f"[STARTUP] Semantic rebuild loop started (poll: {settings.SEMANTIC_REBUILD_POLL_SECONDS}s)")
+
+    # Run embedding model migration loop in background
+    migration_client = AsyncMongoClient(settings.DB_CONNECTION_STRING)
+    migration_db = migration_client[settings.DB_NAME]
+    await load_embedding_versions(migration_db, force=True)
+    embedding_migrator = EmbeddingMigrator(MailService(migration_db))
+    migration_task = asyncio.create_task(embedding_migrator.run_forever())
+    background_tasks.add(migration_task)
+    migration_task.add_done_callback(background_tasks.discard)
+    logging.info(f"[STARTUP] Embedding migration loop started (poll: {settings.EMBEDDING_MIGRATION_POLL_SECONDS}s)")
+
     # Legacy scheduler jobs
     scheduler.add_job(run_snooze_job, "interval", minutes=1)
-    scheduler.add_job(
-        run_embedding_job,
-        "interval",
-        minutes=settings.EMBEDDING_JOB_INTERVAL_MINUTES,
-        next_run_time=datetime.now(),
-        id="embedding_job",
-        replace_existing=True,
-    )
+    if settings.EMBEDDING_WORKER_ENABLED:
+        worker_client = AsyncMongoClient(settings.DB_CONNECTION_STRING)
+        embedding_worker = EmbeddingWorker(MailService(worker_client[settings.DB_NAME]))
+        embedding_task = asyncio.create_task(embedding_worker.run_forever())
+        background_tasks.add(embedding_task)
+        embedding_task.add_done_callback(background_tasks.discard)
+        logging.info(f"[STARTUP] Embedding worker started (concurrency: {settings.EMBEDDING_WORKER_CONCURRENCY})")
+    else:
+        scheduler.add_job(
+            run_embedding_job,
+            "interval",
+            minutes=settings.EMBEDDING_JOB_INTERVAL_MINUTES,
+            next_run_time=datetime.now(),
+            id="embedding_job",
+            replace_existing=True,
+        )
+    if settings.SUMMARIZE_JOB_ENABLED and settings.GEMINI_API_KEY:
+        scheduler.add_job(
+            run_summarize_job,
+            "interval",
+            minutes=settings.SUMMARIZE_JOB_INTERVAL_MINUTES,
+            next_run_time=datetime.now(),
+            id="summarize_job",
+            replace_existing=True,
+        )
+        logging.info(f"[STARTUP] Summarize job scheduled every {settings.SUMMARIZE_JOB_INTERVAL_MINUTES} minutes ({settings.GEMINI_RATE_LIMIT_RPM} RPM)")
     scheduler.start()
-    logging.info(f"Scheduler configured: snooze_job every 1 minute; embedding_job every {settings.EMBEDDING_JOB_INTERVAL_MINUTES} minutes")
+    if settings.EMBEDDING_WORKER_ENABLED:
+        logging.info("Scheduler configured: snooze_job every 1 minute; embeddings handled by the embedding worker")
+    else:
+        logging.info(f"Scheduler configured: snooze_job every 1 minute; embedding_job every {settings.EMBEDDING_JOB_INTERVAL_MINUTES} minutes")
     print("Scheduler started for background jobs.")
 
 
@@ -0,0 +1,24 @@
+import hashlib
+from typing import Any, Optional
+
+
+def build_etag(*parts: Any) -> str:
+    """Build a strong ETag from version components (ids, history ids, timestamps)."""
+    raw = "|".join("" if part is None else str(part) for part in parts)
+    digest = hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def _strip_weak(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Check an If-None-Match header against an ETag (weak comparison, RFC 9110)."""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    target = _strip_weak(etag)
+    return any(_strip_weak(candidate) == target for candidate in if_none_match.split(","))
@@ -0,0 +1,49 @@
+import asyncio
+import time
+from typing import Optional
+
+from app.config import settings
+
+
+class TokenBucket:
+    """
+    Async token-bucket rate limiter.
+
+    Holds up to `capacity` tokens, refilled continuously at `rate_per_minute`.
+    Callers may ask to leave a `reserve` of tokens untouched, which lets background
+    jobs yield to interactive requests sharing the same quota.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate_per_second = max(rate_per_minute, 0.001) / 60.0
+        self.capacity = capacity if capacity is not None else max(rate_per_minute, 1)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+        self._updated_at = now
+
+    @property
+    def available(self) -> float:
+        self._refill()
+        return self._tokens
+
+    async def acquire(self, tokens: float = 1, reserve: float = 0) -> None:
+        """Wait until `tokens` can be taken while keeping `reserve` tokens in the bucket."""
+        needed = min(tokens + reserve, self.capacity)
+        while True:
+            async with self._lock:
+                self._refill()
+                if self._tokens >= needed:
+                    self._tokens -= tokens
+                    return
+                wait_seconds = (needed - self._tokens) / self.rate_per_second
+            # Sleep outside the lock so callers with a smaller reserve are not blocked
+            await asyncio.sleep(wait_seconds)
+
+
+# Shared Gemini generation quota for on-demand summaries and the background job
+gemini_rate_limiter = TokenBucket(settings.GEMINI_RATE_LIMIT_RPM)
@@ -0,0 +1,41 @@
+from functools import lru_cache
+from typing import Any, Mapping, Optional
+
+import orjson
+from fastapi.responses import Response
+from pydantic import TypeAdapter
+
+
+class FastJSONResponse(Response):
+    """JSON response rendered with orjson instead of the stdlib encoder."""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+@lru_cache(maxsize=None)
+def _get_adapter(data_type: Any) -> TypeAdapter:
+    return TypeAdapter(data_type)
+
+
+def fast_api_response(
+    data_type: Any,
+    data: Any,
+    message: str = "",
+    headers: Optional[Mapping[str, str]] = None,
+) -> FastJSONResponse:
+    """
+    Build an APIResponse envelope whose data is validated exactly once against `data_type`.
+
+    Returning a Response directly makes FastAPI skip its own response_model validation and
+    encoding pass, so the route's response_model is only used for the OpenAPI schema.
+    Model instances produced by the service are not re-validated (pydantic default).
+    """
+    adapter = _get_adapter(data_type)
+    validated = adapter.validate_python(data)
+    payload = {
+        "message": message,
+        "data": adapter.dump_python(validated, by_alias=True),
+    }
+    return FastJSONResponse(content=payload, headers=headers)
@@ -0,0 +1,144 @@
+"""
+Keyed single-flight execution.
+
+Concurrent callers asking for the same key share one in-flight execution and its
+result (or exception) instead of each doing the work, e.g. several tabs triggering a
+sync of the same mailbox. Groups are process-wide, so they coalesce across the
+per-request service instances.
+
+With a lease collection, the execution also holds a Mongo lease on the key so other
+server instances wait for it to finish before running their own (SINGLE_FLIGHT_LEASE_*).
+Results cannot be shared across processes; waiters run the operation afterwards, which
+is cheap for incremental work.
+"""
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+from pymongo.errors import DuplicateKeyError
+
+from app.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """One named group of keyed in-flight calls, with coalescing counters."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.metrics: Dict[str, Any] = {"calls": 0, "executions": 0, "coalesced": 0, "lease_waits": 0, "errors": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]], lease_collection=None) -> T:
+        """
+        Run `fn` for `key`, or wait for the execution already in flight and return its result.
+
+        The work runs in its own task, so a caller that is cancelled (client disconnect,
+        timeout) stops waiting without cancelling the execution the other callers share.
+
+        Args:
+            key: Identity of the work (user id plus anything that changes the result)
+            fn: Zero-argument coroutine factory doing the work
+            lease_collection: Optional Mongo collection used to hold a cross-instance lease
+        """
+        self.metrics["calls"] += 1
+        task = self._calls.get(key)
+        if task is not None:
+            self.metrics["coalesced"] += 1
+            logger.info(f"[SINGLE FLIGHT] {self.name}: joined in-flight call for {key}")
+        else:
+            self.metrics["executions"] += 1
+            task = asyncio.create_task(self._execute(fn, lease_collection, key))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    async def _execute(self, fn: Callable[[], Awaitable[T]], lease_collection, key: str) -> T:
+        if lease_collection is not None and settings.SINGLE_FLIGHT_LEASE_ENABLED:
+            return await self._run_with_lease(key, fn, lease_collection)
+        return await fn()
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled() and task.exception() is not None:
+            # Also marks the exception retrieved when every caller has gone away
+            self.metrics["errors"] += 1
+
+    async def _run_with_lease(self, key: str, fn: Callable[[], Awaitable[T]], lease_collection) -> T:
+        lease_id = f"{self.name}:{key}"
+        owner = uuid.uuid4().hex
+        lease_seconds = settings.SINGLE_FLIGHT_LEASE_SECONDS
+        waited = False
+        while not await _acquire_lease(lease_collection, lease_id, owner, lease_seconds):
+            if not waited:
+                waited = True
+                self.metrics["lease_waits"] += 1
+                logger.info(f"[SINGLE FLIGHT] {self.name}: {key} is running on another instance, waiting")
+            await asyncio.sleep(settings.SINGLE_FLIGHT_LEASE_POLL_SECONDS)
+
+        renew_task = asyncio.create_task(_renew_lease(lease_collection, lease_id, owner, lease_seconds))
+        try:
+            return await fn()
+        finally:
+            renew_task.cancel()
+            try:
+                await lease_collection.delete_one({"_id": lease_id, "owner": owner})
+            except Exception as e:
+                logger.warning(f"[SINGLE FLIGHT] {self.name}: failed to release lease {lease_id}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self.metrics["calls"]
+        return {
+            **self.metrics,
+            "in_flight": len(self._calls),
+            "coalesce_rate": round(self.metrics["coalesced"] / calls, 4) if calls else 0.0,
+        }
+
+
+async def _acquire_lease(lease_collection, lease_id: str, owner: str, lease_seconds: int) -> bool:
+    now = datetime.utcnow()
+    try:
+        # Matches only a free (expired) lease; a live one makes the upsert collide on _id
+        await lease_collection.update_one(
+            {"_id": lease_id, "expires_at": {"$lt": now}},
+            {"$set": {"owner": owner, "acquired_at": now, "expires_at": now + timedelta(seconds=lease_seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def _renew_lease(lease_collection, lease_id: str, owner: str, lease_seconds: int) -> None:
+    while True:
+        await asyncio.sleep(max(lease_seconds / 3, 1))
+        try:
+            await lease_collection.update_one(
+                {"_id": lease_id, "owner": owner},
+                {"$set": {"expires_at": datetime.utcnow() + timedelta(seconds=lease_seconds)}}
+            )
+        except Exception as e:
+            logger.warning(f"[SINGLE FLIGHT] Failed to renew lease {lease_id}: {e}")
+
+
+_groups: Dict[str, SingleFlight] = {}
+
+
+def single_flight(name: str) -> SingleFlight:
+    """Process-wide single-flight group for one kind of operation."""
+    group = _groups.get(name)
+    if group is None:
+        group = _groups[name] = SingleFlight(name)
+    return group
+
+
+def single_flight_metrics() -> Dict[str, Any]:
+    return {name: group.stats() for name, group in _groups.items()}
@@ -0,0 +1,164 @@
+import re
+from html.parser import HTMLParser
+from typing import List
+
+MAX_CLEAN_TEXT_CHARS = 20000
+
+# Real tags only, so "Name <a@b.com>" in plain text is not mistaken for markup
+_HTML_PATTERN = re.compile(r"<(?:html|body|div|p|br|table|span|a|img|!doctype)(?:\s[^<>]*)?/?>", re.IGNORECASE)
+
+_BLOCK_TAGS = {
+    "p", "div", "br", "tr", "li", "ul", "ol", "table", "section", "article",
+    "header", "footer", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "pre",
+}
+_VOID_TAGS = {"br", "hr", "img", "meta", "link", "input", "wbr", "col", "area", "base", "source"}
+_SKIP_TAGS = {"script", "style", "head", "title", "blockquote"}
+# Class names mail clients put on the quoted-history container
+_QUOTE_CLASSES = ("gmail_quote", "yahoo_quoted", "moz-cite-prefix")
+
+# A line that starts the quoted history of a reply; everything from it on is dropped
+_QUOTE_HEADER_PATTERNS = [
+    re.compile(r"^\s*On .{0,300}wrote:\s*$", re.IGNORECASE | re.DOTALL),
+    re.compile(r"^\s*Vào .{0,300}đã viết:\s*$", re.IGNORECASE | re.DOTALL),
+    re.compile(r"^\s*-{2,}\s*Original Message\s*-{2,}\s*$", re.IGNORECASE),
+    re.compile(r"^\s*_{20,}\s*$"),
+    # Outlook reply block ("From: ...\nSent: ..."); Gmail forwards use "Date:" and are kept
+    re.compile(r"^\s*From:\s.+\sSent:\s.+$", re.IGNORECASE),
+]
+_SIGNATURE_DELIMITER = re.compile(r"^--\s?$")
+_MOBILE_FOOTER = re.compile(r"^\s*(Sent from my \w+|Get Outlook for \w+|Sent from Mail for Windows)", re.IGNORECASE)
+_ZERO_WIDTH = re.compile("[\u200b\u200c\u200d\u2060\ufeff]")
+
+
+class _TextExtractor(HTMLParser):
+    """Collect visible text, skipping scripts, styles and quoted-history blocks."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if self._skip_depth:
+            if tag not in _VOID_TAGS:
+                self._skip_depth += 1
+            return
+
+        classes = dict(attrs).get("class") or ""
+        if tag in _SKIP_TAGS or any(name in classes for name in _QUOTE_CLASSES):
+            if tag not in _VOID_TAGS:
+                self._skip_depth = 1
+            return
+
+        if tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if self._skip_depth:
+            if tag not in _VOID_TAGS:
+                self._skip_depth -= 1
+            return
+        if tag in _BLOCK_TAGS and tag not in _VOID_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+
+def looks_like_html(text: str) -> bool:
+    return bool(_HTML_PATTERN.search(text[:2000]))
+
+
+def html_to_text(html: str) -> str:
+    """Convert an HTML body to plain text (visible content only)."""
+    parser = _TextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        # Badly broken markup: fall back to dropping anything tag-shaped
+        return re.sub(r"<[^>]+>", " ", html)
+    return "".join(parser.parts)
+
+
+def strip_quoted_history(text: str) -> str:
+    """Drop `>` quoted lines and everything after a reply header ("On ... wrote:", Outlook blocks)."""
+    lines = text.split("\n")
+    kept: List[str] = []
+    for i, line in enumerate(lines):
+        if line.lstrip().startswith(">"):
+            continue
+        # Reply headers are often wrapped over two lines
+        joined = f"{line} {lines[i + 1]}" if i + 1 < len(lines) else line
+        if kept and any(p.match(line) or p.match(joined) for p in _QUOTE_HEADER_PATTERNS):
+            break
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def strip_signature(text: str) -> str:
+    """Drop the signature after a `-- ` delimiter and mobile client footers."""
+    lines = text.split("\n")
+    for i, line in enumerate(lines):
+        if i > 0 and _SIGNATURE_DELIMITER.match(line):
+            lines = lines[:i]
+            break
+    return "\n".join(line for line in lines if not _MOBILE_FOOTER.match(line))
+
+
+def collapse_whitespace(text: str) -> str:
+    text = _ZERO_WIDTH.sub("", text.replace("\xa0", " ").replace("\r\n", "\n").replace("\r", "\n"))
+    lines = [re.sub(r"[ \t\f\v]+", " ", line).strip() for line in text.split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def clean_email_text(body: str) -> str:
+    """
+    Normalize an email body for LLM, embedding and search input.
+
+    Strips HTML, quoted reply history and signatures, then collapses whitespace.
+    Applying it to already-clean text returns the same text, so stored `clean_text`
+    and bodies cleaned on the fly hash identically.
+    """
+    if not body:
+        return ""
+
+    text = html_to_text(body) if looks_like_html(body) else body
+    text = collapse_whitespace(text)
+    text = strip_quoted_history(text)
+    text = strip_signature(text)
+    return collapse_whitespace(text)[:MAX_CLEAN_TEXT_CHARS]
+
+
+def split_passages(text: str, max_chars: int, overlap_chars: int, max_passages: int) -> List[str]:
+    """
+    Split text into overlapping passages of at most `max_chars`, cutting at paragraph,
+    sentence or word boundaries when one falls in the second half of the window.
+    Text that fits in one window is returned as a single passage.
+    """
+    text = text.strip()
+    if len(text) <= max_chars or max_chars <= 0:
+        return [text] if text else []
+
+    overlap_chars = min(overlap_chars, max_chars // 2)
+    passages: List[str] = []
+    start = 0
+    while start < len(text) and len(passages) < max_passages:
+        end = min(start + max_chars, len(text))
+        if end < len(text):
+            window = text[start:end]
+            for separator in ("\n\n", "\n", ". ", " "):
+                cut = window.rfind(separator)
+                if cut >= max_chars // 2:
+                    end = start + cut + len(separator)
+                    break
+        passages.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = max(end - overlap_chars, start + 1)
+        # Start the next passage on a word boundary
+        space = text.find(" ", start, end)
+        if space != -1:
+            start = space + 1
+    return [passage for passage in passages if passage]
@@ -0,0 +1,11 @@
+import os
+
+
+# Settings are read at import time; the tests never reach a real database or provider
+os.environ.setdefault("DB_CONNECTION_STRING", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "email_client_test")
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_DURATION_MINUTE", "15")
+os.environ.setdefault("REFRESH_TOKEN_DURATION_DAY", "7")
+os.environ.setdefault("BASE_URL", "http://localhost:8000")
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.api.mail.embedding_queue import EmbeddingQueue
+from app.config import settings
+
+
+def _matches(doc, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(_matches(doc, branch) for branch in condition):
+                return False
+            continue
+        value = doc.get(key)
+        if isinstance(condition, dict):
+            for op, operand in condition.items():
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$lte" and not (value is not None and value <= operand):
+                    return False
+                if op == "$lt" and not (value is not None and value < operand):
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction):
+        self.docs.sort(key=lambda doc: doc[key], reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+    async def to_list(self, length=None):
+        return self.docs[:length] if length else self.docs
+
+
+class FakeQueueCollection:
+    """The subset of an async Mongo collection EmbeddingQueue.claim uses."""
+
+    def __init__(self, docs):
+        self.docs = {doc["_id"]: doc for doc in docs}
+
+    def find(self, query, projection=None):
+        return FakeCursor([dict(doc) for doc in self.docs.values() if _matches(doc, query)])
+
+    async def update_many(self, query, update):
+        for doc in self.docs.values():
+            if _matches(doc, query):
+                doc.update(update["$set"])
+
+    async def aggregate(self, pipeline):
+        match, group, sort, limit = pipeline
+        oldest = {}
+        for doc in self.docs.values():
+            if _matches(doc, match["$match"]):
+                user_id = doc["user_id"]
+                oldest[user_id] = min(oldest.get(user_id, doc["enqueued_at"]), doc["enqueued_at"])
+        users = sorted(({"_id": user_id, "oldest": at} for user_id, at in oldest.items()), key=lambda g: g["oldest"])
+        return FakeCursor(users[:limit["$limit"]])
+
+
+def _pending(user_id, count, enqueued_at):
+    return [
+        {
+            "_id": f"{user_id}:m{i}",
+            "user_id": user_id,
+            "message_id": f"m{i}",
+            "status": "pending",
+            "available_at": enqueued_at,
+            "enqueued_at": enqueued_at + timedelta(seconds=i),
+            "claim_id": None,
+        }
+        for i in range(count)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_multi_round_claim_returns_each_item_once(monkeypatch):
+    monkeypatch.setattr(settings, "EMBEDDING_QUEUE_MAX_USERS_PER_CLAIM", 20)
+    start = datetime.utcnow() - timedelta(hours=1)
+    queue = EmbeddingQueue({"embedding_queue": None, "embedding_queue_state": None})
+    queue.queue_collection = FakeQueueCollection(_pending("a", 100, start) + _pending("b", 5, start))
+
+    claim = await queue.claim(max_items=50)
+
+    # Round 1: 25 for a, 5 for b; round 2: the 20 left over go to a
+    items = claim["items"]
+    assert len(items["a"]) == len(set(items["a"])) == 45
+    assert sorted(items["b"]) == [f"m{i}" for i in range(5)]
+    claimed = [doc for doc in queue.queue_collection.docs.values() if doc["claim_id"] == claim["claim_id"]]
+    assert len(claimed) == 50
+    assert {doc["message_id"] for doc in claimed if doc["user_id"] == "a"} == set(items["a"])
@@ -0,0 +1,105 @@
+import random
+import time
+
+import pytest
+
+from app.api.mail.fuzzy_index import TrigramIndex
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length=None):
+        return self.docs
+
+
+class FakeTrigramCollection:
+    """In-memory `search_trigrams`: the upserts add_email sends and the suggest pipeline."""
+
+    def __init__(self):
+        self.docs = {}
+
+    async def bulk_write(self, operations, ordered=True):
+        for operation in operations:
+            query, update = operation._filter, operation._doc
+            key = (query["user_id"], query["field"], query["folded"])
+            doc = self.docs.get(key)
+            if doc is None:
+                doc = self.docs[key] = {**query, **update["$setOnInsert"], "variants": []}
+                doc["trigram_set"] = set(doc["trigrams"])
+            doc.update(update["$set"])
+            for field, value in update["$addToSet"].items():
+                if value not in doc[field]:
+                    doc[field].append(value)
+            for field, value in update["$max"].items():
+                doc[field] = max(doc.get(field, value), value)
+
+    async def aggregate(self, pipeline):
+        match, _, _, limit = pipeline
+        query_grams = set(match["$match"]["trigrams"]["$in"])
+        candidates = []
+        for doc in self.docs.values():
+            overlap = len(query_grams & doc["trigram_set"])
+            if doc["user_id"] == match["$match"]["user_id"] and overlap:
+                candidates.append({**{k: doc[k] for k in ("field", "value", "folded", "variants", "last_seen")}, "overlap": overlap})
+        candidates.sort(key=lambda doc: (doc["overlap"], doc["last_seen"]), reverse=True)
+        return FakeCursor(candidates[:limit["$limit"]])
+
+
+def _index():
+    index = TrigramIndex({"search_trigrams": None})
+    index.trigrams_collection = FakeTrigramCollection()
+    return index
+
+
+def _typo(word, rng):
+    i = rng.randrange(1, len(word) - 1)
+    edit = rng.choice(("substitute", "transpose", "delete"))
+    if edit == "substitute":
+        return word[:i] + rng.choice("abcdefghijklmnopqrstuvwxyz") + word[i + 1:]
+    if edit == "transpose":
+        return word[:i - 1] + word[i] + word[i - 1] + word[i + 1:]
+    return word[:i] + word[i + 1:]
+
+
+@pytest.mark.asyncio
+async def test_variants_of_a_folded_value_are_kept():
+    index = _index()
+    await index.add_email({"user_id": "u", "from_name": "José Pérez", "received_on": "2024-01-01"})
+    await index.add_email({"user_id": "u", "from_name": "jose perez", "received_on": "2024-01-02"})
+
+    suggestions = await index.suggest("u", "jose perez", with_variants=True)
+
+    assert len(suggestions) == 1
+    assert sorted(suggestions[0]["variants"]) == ["José Pérez", "jose perez"]
+    assert "variants" not in (await index.suggest("u", "jose perez"))[0]
+
+
+@pytest.mark.asyncio
+async def test_typo_recall_and_p99_latency():
+    """One typo in the first word of a sender name still finds the sender in the top 3."""
+    rng = random.Random(3)
+    syllables = ["an", "be", "ko", "mi", "ra", "lu", "ste", "var", "nor", "pel", "dri", "son", "tha", "wen"]
+    names = sorted({
+        " ".join("".join(rng.sample(syllables, 3)).capitalize() for _ in range(2))
+        for _ in range(400)
+    })
+    index = _index()
+    for i, name in enumerate(names):
+        await index.add_email({"user_id": "u", "from_name": name, "received_on": f"2024-01-{i % 28 + 1:02d}"})
+
+    hits = 0
+    latencies = []
+    queries = rng.sample(names, 200)
+    for name in queries:
+        query = _typo(name.split()[0].lower(), rng)
+        started = time.perf_counter()
+        suggestions = await index.suggest("u", query, limit=3)
+        latencies.append(time.perf_counter() - started)
+        hits += any(item["value"] == name for item in suggestions)
+
+    # Latency covers the in-process re-ranking of up to FUZZY_CANDIDATE_LIMIT candidates
+    latencies.sort()
+    assert hits / len(queries) >= 0.9
+    assert latencies[int(len(latencies) * 0.99) - 1] * 1000 < 150
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from app.api.mail.local_vector_store import LocalVectorStore
+from app.config import settings
+
+
+DIMENSION = 16
+
+
+def _items(rng, message_ids, chunks=1):
+    return [
+        {"message_id": message_id, "chunk_index": chunk, "chunk_count": chunks, "embedding": rng.normal(size=DIMENSION).tolist()}
+        for message_id in message_ids
+        for chunk in range(chunks)
+    ]
+
+
+@pytest.mark.parametrize("quantization", ["none", "int8"])
+def test_count_from_manifests_matches_loaded_store(tmp_path, monkeypatch, quantization):
+    monkeypatch.setattr(settings, "VECTOR_QUANTIZATION", quantization)
+    monkeypatch.setattr(settings, "VECTOR_DIMENSION", 0)
+    rng = np.random.default_rng(1)
+    store = LocalVectorStore(str(tmp_path), "count", provider_dimension=DIMENSION)
+    for batch in range(30):
+        # Re-embedded messages replace all their chunks, with fewer chunks than before
+        store.upsert("a", _items(rng, [f"m{i}" for i in range(batch % 7, batch % 7 + 5)], chunks=3 if batch < 15 else 1))
+        store.upsert("b", _items(rng, [f"n{batch}"]))
+    loaded = store.count()
+
+    reopened = LocalVectorStore(str(tmp_path), "count", provider_dimension=DIMENSION)
+    assert reopened.count() == loaded == store.count("a") + store.count("b")
+    assert reopened._loaded_users() == []
@@ -0,0 +1,91 @@
+import json
+import random
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.mail.models import Label, ParsedMessage, Sender, ThreadDetailResponse
+from app.models.api_response import APIResponse
+from app.utils import compression
+from app.utils.compression import CompressionMiddleware
+from app.utils.responses import fast_api_response
+
+
+def _large_thread(messages: int = 30) -> ThreadDetailResponse:
+    rng = random.Random(5)
+    words = [f"{rng.choice('bcdfghklmnprstvw')}{rng.choice('aeiou')}{rng.choice('nrst')}{i % 97}" for i in range(2000)]
+    parsed = []
+    for i in range(messages):
+        paragraphs = "".join(
+            f"<p style=\"margin:0 0 12px 0;font-family:Arial,sans-serif;font-size:14px\">{' '.join(rng.choices(words, k=60))}</p>"
+            for _ in range(25)
+        )
+        body = f"<div dir=\"ltr\"><table width=\"100%\"><tr><td>{paragraphs}</td></tr></table></div>"
+        parsed.append(ParsedMessage(
+            id=f"m{i}",
+            thread_id="t1",
+            title=f"Re: Planning {i}",
+            subject="Re: Planning",
+            sender=Sender(name="Anna", email="anna@example.com"),
+            to=[Sender(name="Bob", email="bob@example.com")],
+            received_on=f"2025-01-{i % 28 + 1:02d}T09:00:00Z",
+            body=body,
+            processed_html=body,
+            tags=[Label(id="INBOX", name="Inbox", type="system")],
+        ))
+    return ThreadDetailResponse(
+        messages=parsed,
+        latest=parsed[-1],
+        has_unread=False,
+        total_replies=messages - 1,
+        labels=[Label(id="INBOX", name="Inbox", type="system")],
+    )
+
+
+@pytest.fixture(scope="module")
+def thread():
+    return _large_thread()
+
+
+@pytest.fixture(scope="module")
+def client(thread):
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
+
+    @app.get("/thread")
+    async def get_thread():
+        return fast_api_response(ThreadDetailResponse, thread)
+
+    @app.get("/small")
+    async def get_small():
+        return fast_api_response(Label, Label(id="INBOX", name="Inbox"))
+
+    return TestClient(app)
+
+
+def test_fast_response_matches_pydantic_serialization(client, thread):
+    response = client.get("/thread", headers={"Accept-Encoding": "identity"})
+
+    expected = APIResponse[ThreadDetailResponse](data=thread).model_dump(by_alias=True)
+    assert response.json() == json.loads(json.dumps(expected))
+
+
+@pytest.mark.parametrize("encoding,max_ratio", [("gzip", 0.25), ("br", 0.25)])
+def test_large_thread_compression_ratio(client, encoding, max_ratio):
+    if encoding == "br" and compression.brotli is None:
+        pytest.skip("brotli is not installed")
+    raw = client.get("/thread", headers={"Accept-Encoding": "identity"})
+    encoded = client.get("/thread", headers={"Accept-Encoding": encoding})
+
+    raw_size = int(raw.headers["content-length"])
+    encoded_size = int(encoded.headers["content-length"])
+    assert encoded.headers["content-encoding"] == encoding
+    assert encoded.json() == raw.json()
+    assert encoded_size <= raw_size * max_ratio
+
+
+def test_small_response_is_not_compressed(client):
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+
+    assert "content-encoding" not in response.headers
@@ -0,0 +1,123 @@
+import json
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from app.api.agents.summarizer import Summarizer
+from app.api.mail import summary_service
+from app.api.mail.summary_service import SummaryService, plan_summary_batches
+from app.config import settings
+from app.utils.rate_limiter import TokenBucket
+
+
+class StubChatModel:
+    """Chat model stand-in: answers batch prompts with a JSON array, single prompts with text."""
+
+    def __init__(self, skip_ids=()):
+        self.skip_ids = set(skip_ids)
+        self.batch_calls = []
+        self.single_calls = []
+
+    async def ainvoke(self, messages):
+        prompt = messages[-1].content
+        if prompt.startswith("Summarize this email:"):
+            email = prompt.split("\n\n", 1)[1]
+            self.single_calls.append(email)
+            return SimpleNamespace(content=f"single: {email}")
+
+        payload = json.loads(prompt)
+        self.batch_calls.append([entry["id"] for entry in payload])
+        reply = [
+            {"id": entry["id"], "summary": f"batch: {entry['email']}"}
+            for entry in payload
+            if entry["id"] not in self.skip_ids
+        ]
+        # Models do not always keep the input order
+        random.Random(0).shuffle(reply)
+        return SimpleNamespace(content="```json\n" + json.dumps(reply) + "\n```")
+
+
+class FakeCollection:
+    def __init__(self):
+        self.stored = {}
+
+    async def update_one(self, query, update, upsert=False):
+        self.stored[query["message_id"]] = update["$set"]["summary"]
+
+
+class FakeDb(dict):
+    def __missing__(self, name):
+        return self.setdefault(name, FakeCollection())
+
+
+@pytest.fixture
+def batch_limits(monkeypatch):
+    monkeypatch.setattr(settings, "SUMMARY_BATCH_MAX_ITEMS", 3)
+    monkeypatch.setattr(settings, "SUMMARY_BATCH_ITEM_MAX_CHARS", 100)
+    monkeypatch.setattr(settings, "SUMMARY_BATCH_MAX_CHARS", 250)
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(summary_service, "gemini_rate_limiter", TokenBucket(rate_per_minute=6000))
+    service = SummaryService(FakeDb())
+    service._summarizer = Summarizer(model=StubChatModel())
+    return service
+
+
+def test_plan_packs_short_emails_within_item_and_char_limits(batch_limits):
+    texts = {f"m{i}": "x" * 60 for i in range(5)}
+    texts["long"] = "y" * 150
+    texts.update({"a": "z" * 90, "b": "z" * 90, "c": "z" * 90})
+
+    batches = plan_summary_batches(texts)
+
+    assert [list(batch) for batch in batches] == [
+        ["m0", "m1", "m2"],
+        ["long"],
+        ["m3", "m4", "a"],
+        ["b", "c"],
+    ]
+    assert all(len(batch) <= 3 for batch in batches)
+    assert all(sum(map(len, batch.values())) <= 250 for batch in batches if len(batch) > 1)
+
+
+def test_plan_splits_on_char_budget(batch_limits):
+    texts = {"a": "x" * 100, "b": "x" * 100, "c": "x" * 100}
+
+    assert [list(batch) for batch in plan_summary_batches(texts)] == [["a", "b"], ["c"]]
+
+
+def test_plan_without_batching_gives_one_call_per_email(monkeypatch):
+    monkeypatch.setattr(settings, "SUMMARY_BATCH_MAX_ITEMS", 1)
+
+    assert plan_summary_batches({"a": "x", "b": "y"}) == [{"a": "x"}, {"b": "y"}]
+
+
+@pytest.mark.asyncio
+async def test_generate_batch_maps_summaries_to_message_ids(service):
+    texts = {"m1": "lunch on friday", "m2": "invoice attached", "m3": "server is down"}
+
+    summaries = await service._generate_batch("user-1", texts)
+
+    assert summaries == {message_id: f"batch: {text}" for message_id, text in texts.items()}
+    assert service._summarizer.model.batch_calls == [["m1", "m2", "m3"]]
+    assert service._summarizer.model.single_calls == []
+    assert service.email_summaries_collection.stored == summaries
+
+
+@pytest.mark.asyncio
+async def test_generate_batch_retries_ids_missing_from_reply(service):
+    service._summarizer = Summarizer(model=StubChatModel(skip_ids={"m2"}))
+    texts = {"m1": "lunch on friday", "m2": "invoice attached", "m3": "server is down"}
+
+    summaries = await service._generate_batch("user-1", texts)
+
+    assert summaries == {
+        "m1": "batch: lunch on friday",
+        "m2": "single: invoice attached",
+        "m3": "batch: server is down",
+    }
+    assert service._summarizer.model.single_calls == ["invoice attached"]
+    assert service.email_summaries_collection.stored == summaries
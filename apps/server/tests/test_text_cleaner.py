@@ -0,0 +1,48 @@
+from app.utils.text_cleaner import clean_email_text
+
+
+MESSAGE = "Hi team, the quarterly report is attached. Please review the budget section before Friday's meeting."
+
+HTML_REPLY = (
+    "<!DOCTYPE html><html><head><title>Re: Report</title>"
+    "<style>" + "table td { font-family: Arial, sans-serif; padding: 4px 8px; color: #333333; }" * 20 + "</style></head>"
+    "<body><div dir=\"ltr\"><table width=\"100%\" cellpadding=\"0\" cellspacing=\"0\"><tr><td style=\"padding:12px\">"
+    f"<p style=\"margin:0 0 12px 0;font-size:14px\">{MESSAGE}</p>"
+    "</td></tr></table></div>"
+    "<div class=\"gmail_quote\"><div dir=\"ltr\" class=\"gmail_attr\">On Mon, Jan 6, 2025 at 9:14 AM Anna wrote:<br></div>"
+    "<blockquote style=\"margin:0 0 0 .8ex;border-left:1px #ccc solid;padding-left:1ex\">"
+    + "<p>Earlier message in the thread with plenty of quoted detail.</p>" * 40 +
+    "</blockquote></div></body></html>"
+)
+
+PLAIN_REPLY = (
+    f"{MESSAGE}\n\n"
+    "--\nBob Nguyen\nSenior Analyst | Finance\n+84 90 000 0000\n\n"
+    "On Mon, Jan 6, 2025 at 9:14 AM Anna <anna@example.com> wrote:\n"
+    + "> Earlier message in the thread with plenty of quoted detail.\n" * 40
+)
+
+
+def _estimated_tokens(text: str) -> int:
+    # Roughly four characters per token for English text
+    return len(text) // 4
+
+
+def test_html_reply_drops_markup_and_quoted_history():
+    cleaned = clean_email_text(HTML_REPLY)
+
+    assert cleaned == MESSAGE
+    assert _estimated_tokens(cleaned) <= _estimated_tokens(HTML_REPLY) * 0.05
+
+
+def test_plain_reply_drops_signature_and_quotes():
+    cleaned = clean_email_text(PLAIN_REPLY)
+
+    assert cleaned == MESSAGE
+    assert _estimated_tokens(cleaned) <= _estimated_tokens(PLAIN_REPLY) * 0.1
+
+
+def test_cleaning_is_idempotent():
+    cleaned = clean_email_text(HTML_REPLY)
+
+    assert clean_email_text(cleaned) == cleaned
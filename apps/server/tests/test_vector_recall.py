@@ -0,0 +1,87 @@
+"""
+Recall@k of the compressed vector encodings against exact float32 search.
+
+Quantization is checked on the offline hashing model. Truncation only suits models that
+front-load information (text-embedding-004 and other Matryoshka-trained models); feature
+hashing spreads it evenly, so truncation is checked on synthetic vectors whose variance
+decays with the component index instead.
+"""
+
+import asyncio
+import random
+
+import numpy as np
+import pytest
+
+from app.api.mail.local_vector_store import LocalVectorStore
+from app.api.mail.semantic_embedding import HashingEmbeddingProvider
+from app.config import settings
+
+
+TOP_K = 10
+
+
+def _hashing_corpus(dimension: int = 512, emails: int = 2000, queries: int = 50):
+    rng = random.Random(7)
+    common = [f"word{i}" for i in range(300)]
+    topics = [[f"topic{t}term{i}" for i in range(30)] for t in range(40)]
+    docs = [" ".join(rng.sample(rng.choice(topics), 12) + rng.sample(common, 10)) for _ in range(emails)]
+    query_texts = [" ".join(rng.sample(rng.choice(topics), 4)) for _ in range(queries)]
+    provider = HashingEmbeddingProvider(dimension)
+    return asyncio.run(provider.embed_documents(docs)), asyncio.run(provider.embed_documents(query_texts))
+
+
+def _front_loaded_corpus(dimension: int = 768, emails: int = 2000, queries: int = 50):
+    rng = np.random.default_rng(7)
+    decay = np.exp(-np.arange(dimension) / (dimension / 8)).astype(np.float32)
+    vectors = rng.normal(size=(emails, dimension)).astype(np.float32) * decay
+    # Queries are noisy copies of stored vectors, like a query close to one email
+    picks = rng.choice(emails, size=queries, replace=False)
+    query_vectors = vectors[picks] + rng.normal(size=(queries, dimension)).astype(np.float32) * decay * 0.5
+    return vectors.tolist(), query_vectors.tolist()
+
+
+@pytest.fixture(scope="module")
+def hashing_corpus():
+    return _hashing_corpus()
+
+
+@pytest.fixture(scope="module")
+def front_loaded_corpus():
+    return _front_loaded_corpus()
+
+
+def _recall(tmp_path, corpus) -> float:
+    vectors, queries = corpus
+    store = LocalVectorStore(str(tmp_path), "recall", provider_dimension=len(vectors[0]))
+    store.upsert("user", [{"message_id": f"m{i}", "embedding": vector} for i, vector in enumerate(vectors)])
+
+    # Ground truth: exact cosine similarity at the provider dimension
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    hits = 0
+    for query in queries:
+        exact = {f"m{i}" for i in np.argsort(-(matrix @ np.asarray(query, dtype=np.float32)))[:TOP_K]}
+        hits += len(exact & {message_id for message_id, _, _ in store.query("user", query, TOP_K)})
+    return hits / (len(queries) * TOP_K)
+
+
+@pytest.mark.parametrize("oversampling,floor", [(1.0, 0.95), (2.0, 0.99)])
+def test_int8_recall(tmp_path, monkeypatch, hashing_corpus, oversampling, floor):
+    monkeypatch.setattr(settings, "VECTOR_QUANTIZATION", "int8")
+    monkeypatch.setattr(settings, "VECTOR_DIMENSION", 0)
+    monkeypatch.setattr(settings, "VECTOR_RESCORE_OVERSAMPLING", oversampling)
+
+    assert _recall(tmp_path, hashing_corpus) >= floor
+
+
+@pytest.mark.parametrize("quantization,dimension,floor", [
+    ("none", 384, 0.97),
+    ("none", 256, 0.95),
+    ("int8", 256, 0.95),
+])
+def test_truncated_recall(tmp_path, monkeypatch, front_loaded_corpus, quantization, dimension, floor):
+    monkeypatch.setattr(settings, "VECTOR_QUANTIZATION", quantization)
+    monkeypatch.setattr(settings, "VECTOR_DIMENSION", dimension)
+
+    assert _recall(tmp_path, front_loaded_corpus) >= floor